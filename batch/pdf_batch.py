@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""按 JSON 清单批量运行 pdf_fill 与 pdfinsert 的多个任务。
+
+每晚需要执行的几十个合并 (不同的输入目录、不同的输出，有的用 pdf_fill，有的用 pdfinsert) 写在一个清单中，
+由本脚本在一个进程池中统一执行，省去每个任务单独启动 Python、导入 pypdf/PyPDF2/reportlab 和注册字体的开销:
+
+-   每个工作进程只导入一次两个脚本，并与 --serve 的工作进程一样预先注册页码字体、常驻处理结果缓存
+    (pdf_fill 的 ResultCache 及已计算的文件哈希、pdfinsert 的页码覆盖层缓存)。任务以与 --serve 的 run 请求
+    相同的方式执行 (见各脚本的 _service_call)，日志按任务收集。
+-   输入 (或输出) 有重叠的任务编为一组，同一组在同一个工作进程中按清单顺序依次执行，不同的组并行执行。
+    组内共用已解析并处理的输入 (见各脚本的 share_inputs)，后面的任务不再重新解析；一个任务的输出是另一个
+    任务的输入时，两者同样在一组中按顺序执行。
+-   每个任务都以 --profile 运行，结束后输出一份汇总的耗时报告 (各任务的耗时、页数和各阶段耗时)，
+    也可以用 --report 写出 JSON。
+
+清单格式:
+    {
+      "workers": 4,
+      "jobs": [
+        {"name": "week1", "tool": "pdf_fill", "input": "scans/week1", "output": "out/week1.pdf", "args": ["--compact"]},
+        {"name": "notes", "tool": "pdfinsert", "input": "notes", "output": "out/notes.pdf"}
+      ]
+    }
+    input、output 的相对路径相对于清单所在目录。pdf_fill 的任务等同于 pdf_fill.py <input> -o <output> <args...>，
+    pdfinsert 的任务等同于 pdfinsert.py <input> -o <output> <args...> (输入为目录时合并其中的 PDF)。
+    任务在脚本所在目录下运行，args 中的相对路径 (如 --cache-dir) 相对于该目录。
+
+用法:
+    python3 batch/pdf_batch.py manifest.json [--workers 4] [--report report.json] [--log-dir logs/]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+TOOLS = {"pdf_fill": REPO_DIR / "pdf_fill", "pdfinsert": REPO_DIR / "pdf_insert"} # 工具名 (模块名) -> 所在目录
+LOG_TAIL_LINES = 20 # 任务失败时输出的日志行数
+
+_modules = {} # (工作进程) 已导入的工具模块: {工具名: 模块}
+
+
+# --- 清单 ---
+
+def load_manifest(manifest_path):
+    """读取清单，返回 (工作进程数或 None, 任务列表)。清单无效时抛出 ValueError。
+
+    每个任务为 {"name", "tool", "input", "output", "args"}，input 和 output 已解析为绝对路径。
+    """
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list) or not manifest["jobs"]:
+        raise ValueError("清单必须是包含非空 jobs 列表的对象")
+    workers = manifest.get("workers")
+    if workers is not None and (not isinstance(workers, int) or workers < 0):
+        raise ValueError("workers 必须是非负整数")
+
+    base_dir = Path(manifest_path).resolve().parent
+    jobs, names = [], set()
+    for idx, entry in enumerate(manifest["jobs"], 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"第 {idx} 个任务必须是对象")
+        tool = entry.get("tool")
+        if tool not in TOOLS:
+            raise ValueError(f"第 {idx} 个任务的 tool 必须是 {' 或 '.join(TOOLS)}")
+        for key in ("input", "output"):
+            if not isinstance(entry.get(key), str) or not entry[key] or entry[key] == "-":
+                raise ValueError(f"第 {idx} 个任务缺少 {key} (不能为 -)")
+        args = entry.get("args", [])
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            raise ValueError(f"第 {idx} 个任务的 args 必须是字符串列表")
+        name = str(entry.get("name") or f"{idx}-{tool}")
+        if name in names:
+            raise ValueError(f"任务名重复: {name}")
+        names.add(name)
+        jobs.append({"name": name, "tool": tool, "input": str(base_dir / entry["input"]),
+                     "output": str(base_dir / entry["output"]), "args": args})
+    return workers, jobs
+
+
+def _job_paths(job):
+    """任务读写的路径 (输入、输入目录中的 PDF 和输出)，用于把有重叠的任务编为一组。"""
+    paths = {os.path.realpath(job["input"]), os.path.realpath(job["output"])}
+    if os.path.isdir(job["input"]):
+        paths.update(os.path.realpath(pdf_file) for pdf_file in Path(job["input"]).glob("*.pdf"))
+    return paths
+
+
+def _input_bytes(job):
+    source = Path(job["input"])
+    if source.is_dir():
+        return sum(pdf_file.stat().st_size for pdf_file in source.glob("*.pdf"))
+    return source.stat().st_size if source.exists() else 0
+
+
+def group_jobs(jobs):
+    """把读写路径有重叠的任务编为一组 (并查集)，组内保持清单顺序。
+
+    返回组的列表，按输入总大小从大到小排列，使耗时最长的组最先开始。
+    """
+    parent = list(range(len(jobs)))
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    owners = {} # 路径 -> 第一个读写它的任务
+    for idx, job in enumerate(jobs):
+        for path in _job_paths(job):
+            if path in owners:
+                parent[find(idx)] = find(owners[path])
+            else:
+                owners[path] = idx
+
+    groups = {}
+    for idx, job in enumerate(jobs):
+        groups.setdefault(find(idx), []).append(job)
+    return sorted(groups.values(), key=lambda group: -sum(_input_bytes(job) for job in group))
+
+
+# --- 工作进程 ---
+
+def _init_batch_worker(tools):
+    """(工作进程) 进程池的 initializer: 导入用到的工具，并与 --serve 的工作进程一样预先加载字体和缓存。
+
+    pdf_fill 相对于当前目录查找 Font/ 中的页码字体，因此在各工具的目录下初始化；任务同样在该目录下运行。
+    """
+    for tool in tools:
+        sys.path.insert(0, str(TOOLS[tool]))
+        os.chdir(TOOLS[tool])
+        module = __import__(tool)
+        module._init_service_worker()
+        _modules[tool] = module
+
+
+def _preload_stamp_font(tools):
+    """在主进程中注册 pdf_fill 的页码字体：回退时的警告因此只输出一次 (工作进程中不再输出)，
+    fork 出的工作进程也直接继承已导入的模块和已注册的字体。"""
+    if "pdf_fill" not in tools:
+        return
+    cwd = os.getcwd()
+    sys.path.insert(0, str(TOOLS["pdf_fill"]))
+    os.chdir(TOOLS["pdf_fill"])
+    try:
+        __import__("pdf_fill").get_stamp_font()
+    finally:
+        sys.path.remove(str(TOOLS["pdf_fill"]))
+        os.chdir(cwd)
+
+
+def _output_written(output, started):
+    """任务是否写出了输出: 合并结果在本次运行中写出，或 (--no-merge 时) 输出目录存在。"""
+    try:
+        stat = os.stat(output)
+    except OSError:
+        return False
+    return os.path.isdir(output) or stat.st_mtime >= started - 1 # 容许文件系统时间戳的精度误差
+
+
+def _trace_summary(trace_path):
+    """读取任务的 --profile trace，返回 (各阶段耗时秒数, 计数器)；没有 trace 时均为空。"""
+    try:
+        with open(trace_path, encoding="utf-8") as f:
+            other = json.load(f).get("otherData", {})
+    except (OSError, ValueError):
+        return {}, {}
+    return other.get("stage_seconds", {}), other.get("counters", {})
+
+
+def run_job(job, trace_path, epoch):
+    """(工作进程) 执行一个任务，返回结果记录。epoch 是批量运行开始的时间 (time.time())。"""
+    module = _modules[job["tool"]]
+    argv = [job["input"], "-o", job["output"]] + job["args"]
+    if "--profile" in job["args"][:-1]: # 任务自己指定的 trace 保留，只读取其中的汇总
+        trace_path = os.path.join(TOOLS[job["tool"]], job["args"][job["args"].index("--profile") + 1])
+        keep_trace = True
+    else:
+        argv += ["--profile", trace_path]
+        keep_trace = False
+    started = time.time()
+    start = time.perf_counter()
+    result, error, stdout, stderr = module._service_call("run", {"argv": argv, "cwd": str(TOOLS[job["tool"]])})
+    seconds = time.perf_counter() - start
+    exit_code = result["exit_code"] if result is not None else None
+    if error is None and exit_code == 0 and not _output_written(job["output"], started):
+        error = f"没有写出 {job['output']}"
+    elif error is None and exit_code != 0:
+        error = f"退出码 {exit_code}"
+    stage_seconds, counters = _trace_summary(trace_path)
+    if not keep_trace and os.path.exists(trace_path):
+        os.remove(trace_path)
+    return {"name": job["name"], "tool": job["tool"], "input": job["input"], "output": job["output"],
+            "args": job["args"], "pid": os.getpid(), "start": started - epoch, "seconds": seconds,
+            "ok": error is None, "error": error, "stage_seconds": stage_seconds, "counters": counters,
+            "log": stdout + stderr}
+
+
+def run_group(group_idx, group, trace_dir, epoch):
+    """(工作进程) 按顺序执行一组任务，组内共用已处理的输入 (见各工具的 share_inputs)。返回结果记录列表。"""
+    results = []
+    for module in _modules.values():
+        module.share_inputs(True)
+    try:
+        for job_idx, job in enumerate(group):
+            trace_path = os.path.join(trace_dir, f"{group_idx}-{job_idx}.json")
+            results.append(dict(run_job(job, trace_path, epoch), group=group_idx))
+    finally:
+        for module in _modules.values():
+            module.share_inputs(False)
+    return results
+
+
+# --- 报告 ---
+
+def summarize(results, groups, workers, wall_seconds):
+    """汇总各任务的结果，返回报告对象 (--report 写出的 JSON)。"""
+    stage_seconds, counters, tool_seconds = {}, {}, Counter()
+    for result in results:
+        stage_seconds.setdefault(result["tool"], Counter()).update(result["stage_seconds"])
+        counters.setdefault(result["tool"], Counter()).update(result["counters"])
+        tool_seconds[result["tool"]] += result["seconds"]
+    return {
+        "workers": workers,
+        "groups": len(groups),
+        "wall_seconds": wall_seconds,
+        "job_seconds": sum(result["seconds"] for result in results),
+        "failed": [result["name"] for result in results if not result["ok"]],
+        "tools": {tool: {"jobs": sum(result["tool"] == tool for result in results), "seconds": tool_seconds[tool],
+                         "stage_seconds": dict(stage_seconds[tool]), "counters": dict(counters[tool])}
+                  for tool in tool_seconds},
+        "jobs": [{key: value for key, value in result.items() if key != "log"} for result in results],
+    }
+
+
+def print_report(report):
+    jobs = report["jobs"]
+    name_width = max(len("任务"), *(len(job["name"]) for job in jobs))
+    print(f"\n[批量] {len(jobs)} 个任务，{report['groups']} 组，{report['workers']} 个工作进程")
+    print(f"    {'任务':<{name_width}}  {'工具':<9}  {'组':>3}  {'进程':>7}  {'开始':>7}  {'耗时':>7}  {'页数':>6}  状态")
+    for job in jobs:
+        pages = job["counters"].get("pages", "-")
+        status = "成功" if job["ok"] else f"失败: {job['error']}"
+        print(f"    {job['name']:<{name_width}}  {job['tool']:<9}  {job['group']:>3}  {job['pid'] or '-':>7}  "
+              f"{job['start']:>6.2f}s  {job['seconds']:>6.2f}s  {pages:>6}  {status}")
+    for tool, totals in report["tools"].items():
+        stages = Counter(totals["stage_seconds"])
+        stages.pop("file", None) # file 阶段包含了其中各文件的其他阶段
+        print(f"[阶段] {tool} ({totals['jobs']} 个任务，合计 {totals['seconds']:.2f}s): "
+              + (", ".join(f"{name} {seconds:.2f}s" for name, seconds in stages.most_common()) or "无记录"))
+    wall, job_seconds = report["wall_seconds"], report["job_seconds"]
+    print(f"[批量] 总耗时 {wall:.2f}s，各任务耗时合计 {job_seconds:.2f}s"
+          + (f" (并行度 {job_seconds / wall:.1f})" if wall > 0 else ""))
+    if report["failed"]:
+        print(f"[批量] {len(report['failed'])} 个任务失败: {', '.join(report['failed'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按 JSON 清单批量运行 pdf_fill 与 pdfinsert 的任务，共用工作进程和缓存")
+    parser.add_argument("manifest", help="任务清单 (JSON)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="工作进程数（默认取清单中的 workers；都未指定或为 0 时为 CPU 核心数，且不超过组数）")
+    parser.add_argument("--report", default=None, help="把汇总的耗时报告写出为 JSON")
+    parser.add_argument("--log-dir", default=None, help="把每个任务的日志写入此目录下的 <任务名>.log")
+    args = parser.parse_args()
+
+    try:
+        manifest_workers, jobs = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取清单 {args.manifest}: {e}")
+    if args.workers is not None and args.workers < 0:
+        parser.error("--workers 不能为负数")
+    groups = group_jobs(jobs)
+    workers = args.workers if args.workers is not None else manifest_workers
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    tools = sorted({job["tool"] for job in jobs})
+    print(f"[批量] {len(jobs)} 个任务编为 {len(groups)} 组，使用 {workers} 个工作进程")
+
+    log_dir = Path(args.log_dir) if args.log_dir else None
+    if log_dir is not None:
+        log_dir.mkdir(parents=True, exist_ok=True)
+    _preload_stamp_font(tools)
+    trace_dir = tempfile.mkdtemp(prefix="pdf_batch_")
+    results = []
+    epoch = time.time()
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(tools,)) as pool:
+            futures = {pool.submit(run_group, idx, group, trace_dir, epoch): (idx, group)
+                       for idx, group in enumerate(groups, 1)}
+            for future in as_completed(futures):
+                try:
+                    group_results = future.result()
+                except Exception as e: # 工作进程异常退出等: 整组记为失败
+                    idx, group = futures[future]
+                    group_results = [{"name": job["name"], "tool": job["tool"], "input": job["input"],
+                                      "output": job["output"], "args": job["args"], "pid": None, "start": 0.0,
+                                      "seconds": 0.0, "ok": False, "error": f"{type(e).__name__}: {e}",
+                                      "stage_seconds": {}, "counters": {}, "log": "", "group": idx}
+                                     for job in group]
+                for result in group_results:
+                    results.append(result)
+                    print(f"[{'完成' if result['ok'] else '失败'}] {result['name']} ({result['tool']}) "
+                          f"{result['seconds']:.2f}s")
+                    if log_dir is not None:
+                        (log_dir / f"{result['name'].replace(os.sep, '_')}.log").write_text(result["log"], encoding="utf-8")
+                    if not result["ok"]:
+                        print("    " + "\n    ".join(result["log"].splitlines()[-LOG_TAIL_LINES:]))
+    finally:
+        shutil.rmtree(trace_dir, ignore_errors=True)
+    wall_seconds = time.perf_counter() - start
+
+    order = {job["name"]: idx for idx, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result["name"]])
+    report = summarize(results, groups, workers, wall_seconds)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[结果] 已写入 {args.report}")
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
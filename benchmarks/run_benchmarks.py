@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""pdf_fill 与 pdfinsert 的可复现基准测试。
+
+先用固定随机种子生成合成 PDF 语料 (N 个文件 × M 页)，再以子进程分别运行两个脚本，
+记录每次运行的耗时、每秒处理页数、峰值内存 (RSS) 和输出大小，结果写入 JSON 文件，
+便于在不同提交之间比较。
+
+语料类型:
+    text     矢量文字页 (A4)
+    raster   大尺寸截图页 (每页一张整页位图，与剪贴板截图生成的 PDF 相同)
+    outline  多层嵌套书签的文字页
+    mixed    混合页面尺寸 (A5 ~ A3、Letter、横向及随机尺寸)，夹杂小幅位图
+
+运行项:
+    fill-merge       pdf_fill.py <语料目录> -o merged.pdf
+    fill-no-merge    pdf_fill.py <语料目录> --no-merge
+    insert-merge     pdfinsert.py (默认模式，处理 pdfs/ 并合并)
+    insert-cli       pdfinsert.py <语料目录> (命令行模式，不合并)
+
+两个脚本都以 --no-cache 运行，测量的是完整处理耗时。pdfinsert 以项目目录为工作目录，
+因此每次运行都把 pdfinsert.py 复制到新的临时项目目录中执行 (pdf_common/ 复制到其上一级)，
+复制时间不计入耗时。
+
+用法:
+    python3 benchmarks/run_benchmarks.py [--files 10] [--pages 10] [--corpus text raster]
+                                         [--runs fill-merge insert-merge] [--repeat 3]
+                                         [--fill-args="--compact -j 4"] [--compare 旧结果.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+FILL_DIR = REPO_DIR / "pdf_fill"
+INSERT_DIR = REPO_DIR / "pdf_insert"
+COMMON_DIR = REPO_DIR / "pdf_common" # 两个脚本共用的代码，pdfinsert.py 从其所在目录的上一级导入
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+CORPUS_KINDS = ("text", "raster", "outline", "mixed")
+RUN_NAMES = ("fill-merge", "fill-no-merge", "insert-merge", "insert-cli")
+LIBRARIES = ("pypdf", "PyPDF2", "reportlab", "Pillow")
+
+RASTER_SIZE = (1600, 2400)   # 截图页的像素尺寸 (约为 2 倍缩放屏幕上的整屏截图)
+RASTER_PIXELS_PER_POINT = 2  # 截图页每个 PDF 点对应的像素数
+OUTLINE_DEPTH = 6            # outline 语料的书签嵌套深度
+OUTLINES_PER_PAGE = 3        # outline 语料每页的书签数
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "limit", "integral", "series", "matrix", "vector",
+         "theorem", "proof", "lemma", "where", "such", "that", "converges", "x^2+y^2", "dx", "=")
+
+
+# --- 语料生成 ---
+
+def _mixed_page_sizes():
+    from reportlab.lib.pagesizes import A3, A4, A5, letter, landscape
+    return [A4, A5, A3, letter, landscape(A4), landscape(letter)]
+
+
+def _draw_text_page(c, rng, width, height, title):
+    """绘制一页矢量内容: 标题、若干段随机文字和几条线框。"""
+    margin = 40
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(margin, height - margin - 16, title)
+    c.setFont("Helvetica", 10)
+    y = height - margin - 44
+    while y > margin:
+        c.drawString(margin, y, " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))))
+        y -= 14
+    for _ in range(rng.randint(1, 4)):
+        c.rect(rng.uniform(margin, width / 2), rng.uniform(margin, height / 2),
+               rng.uniform(40, width / 2 - margin), rng.uniform(20, height / 3))
+
+
+def _screenshot_image(rng, size):
+    """生成一张类似界面截图的位图: 纯色区块、文字行状的细条和一块不可压缩的噪声区域。"""
+    from PIL import Image, ImageDraw
+    width, height = size
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle((x, y, x + rng.randint(100, width // 2), y + rng.randint(40, height // 6)),
+                       fill=tuple(rng.randint(200, 250) for _ in range(3)))
+    y = 40
+    while y < height - 40:
+        x = 40
+        while x < width - 80:
+            word = rng.randint(12, 90)
+            draw.rectangle((x, y, x + word, y + 14), fill=(rng.randint(0, 60),) * 3)
+            x += word + rng.randint(8, 16)
+        y += rng.randint(24, 40)
+    patch = (width // 6, height // 10)
+    image.paste(Image.frombytes("RGB", patch, rng.randbytes(patch[0] * patch[1] * 3)),
+                (rng.randrange(width - patch[0]), rng.randrange(height - patch[1])))
+    return image
+
+
+def _write_corpus_file(path, kind, rng, pages, file_idx):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(str(path), pagesize=A4, invariant=1)
+    outline_level = 0
+    for page_idx in range(pages):
+        title = f"file {file_idx} page {page_idx + 1}"
+        if kind == "raster":
+            width, height = (px / RASTER_PIXELS_PER_POINT for px in RASTER_SIZE)
+            c.setPageSize((width, height))
+            c.drawImage(ImageReader(_screenshot_image(rng, RASTER_SIZE)), 0, 0, width, height)
+        elif kind == "mixed":
+            width, height = rng.choice(_mixed_page_sizes() + [(rng.uniform(200, 900), rng.uniform(200, 1200))])
+            c.setPageSize((width, height))
+            _draw_text_page(c, rng, width, height, title)
+            if page_idx % 4 == 3:
+                size = (rng.randint(300, 800), rng.randint(200, 600))
+                c.drawImage(ImageReader(_screenshot_image(rng, size)), 40, 40,
+                            min(size[0] / 2, width - 80), min(size[1] / 2, height - 80))
+        else:
+            width, height = A4
+            _draw_text_page(c, rng, width, height, title)
+        if kind == "outline":
+            for entry_idx in range(OUTLINES_PER_PAGE):
+                key = f"p{page_idx}e{entry_idx}"
+                c.bookmarkPage(key)
+                c.addOutlineEntry(f"{title} / {outline_level + 1}.{entry_idx + 1}", key, level=outline_level)
+                outline_level = (outline_level + 1) % OUTLINE_DEPTH
+        c.showPage()
+    if kind == "outline":
+        c.showOutline()
+    c.save()
+
+
+def generate_corpus(corpus_dir, kind, files, pages, seed):
+    """在 corpus_dir 中生成 files 个 pages 页的 PDF，已有相同参数的语料时直接复用。
+
+    返回语料描述 (参数、文件数、总页数、总大小和内容哈希)。reportlab 以 invariant 模式写出，
+    相同参数在任何机器上生成的文件逐字节相同，因此内容哈希可用于确认两次结果测量的是同一语料。
+    """
+    spec = {"kind": kind, "files": files, "pages": pages, "seed": seed}
+    spec_path = corpus_dir / "corpus.json"
+    if spec_path.exists():
+        with open(spec_path, encoding="utf-8") as f:
+            description = json.load(f)
+        if all(description.get(k) == v for k, v in spec.items()):
+            return description
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    corpus_dir.mkdir(parents=True)
+    # 每种语料使用独立的随机序列，单独生成某种语料时结果不变
+    rng = random.Random(f"{seed}:{kind}")
+    start = time.perf_counter()
+    for file_idx in range(files):
+        # 文件名以数字开头，pdfinsert 按该数字排序合并
+        _write_corpus_file(corpus_dir / f"{file_idx + 1:03d}_{kind}.pdf", kind, rng, pages, file_idx + 1)
+    elapsed = time.perf_counter() - start
+
+    digest = hashlib.sha256()
+    total_bytes = 0
+    for pdf_file in sorted(corpus_dir.glob("*.pdf")):
+        data = pdf_file.read_bytes()
+        digest.update(data)
+        total_bytes += len(data)
+    description = dict(spec, total_pages=files * pages, total_bytes=total_bytes, sha256=digest.hexdigest())
+    with open(spec_path, "w", encoding="utf-8") as f:
+        json.dump(description, f, indent=2)
+    print(f"[语料] {kind}: {files} 个文件 × {pages} 页, {total_bytes / 1024 ** 2:.1f} MB, 生成耗时 {elapsed:.1f} 秒")
+    return description
+
+
+# --- 运行与测量 ---
+
+def _output_bytes(path):
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.glob("*.pdf"))
+    return path.stat().st_size if path.exists() else 0
+
+
+def prepare_run(run_name, corpus_dir, work_dir, python, fill_args, insert_args):
+    """为一次运行准备工作目录，返回 (命令, 工作目录, 输出路径)。"""
+    if run_name.startswith("fill-"):
+        if run_name == "fill-merge":
+            output = work_dir / "merged.pdf"
+            target = [str(output)]
+        else:
+            output = work_dir / "output"
+            target = [str(output) + "/", "--no-merge"]
+        cmd = [python, "pdf_fill.py", str(corpus_dir), "-o"] + target + ["--no-cache"] + fill_args
+        # pdf_fill 相对于当前目录查找 Font/ 中的页码字体
+        return cmd, FILL_DIR, output
+
+    project_dir = work_dir / "pdfinsert"
+    project_dir.mkdir()
+    shutil.copy2(INSERT_DIR / "pdfinsert.py", project_dir / "pdfinsert.py")
+    shutil.copytree(COMMON_DIR, work_dir / COMMON_DIR.name, ignore=shutil.ignore_patterns("__pycache__"))
+    cmd = [python, "pdfinsert.py", "--no-cache"] + insert_args
+    if run_name == "insert-merge":
+        shutil.copytree(corpus_dir, project_dir / "pdfs", ignore=shutil.ignore_patterns("*.json"))
+        return cmd, project_dir, project_dir / "merged_output.pdf"
+    return cmd + [str(corpus_dir)], project_dir, project_dir / "output"
+
+
+def run_measured(cmd, cwd, log_path):
+    """运行 cmd，返回 (退出码, 耗时秒数, 峰值 RSS 字节数)。
+
+    峰值 RSS 取子进程及其已结束的子进程 (如 --jobs 的工作进程) 中最大的单个进程，
+    在没有 os.wait4 的平台上为 None。
+    """
+    with open(log_path, "wb") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        if not hasattr(os, "wait4"):
+            returncode = proc.wait()
+            return returncode, time.perf_counter() - start, None
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return proc.returncode, elapsed, peak_rss
+
+
+def run_benchmark(run_name, corpus, corpus_dir, repeat, python, fill_args, insert_args):
+    """重复运行 repeat 次，返回结果记录。各指标取中位数，原始样本保存在 samples 中。"""
+    samples = []
+    error = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="pdfbench_") as work:
+            work_dir = Path(work)
+            cmd, cwd, output = prepare_run(run_name, corpus_dir, work_dir, python, fill_args, insert_args)
+            log_path = work_dir / "run.log"
+            returncode, elapsed, peak_rss = run_measured(cmd, cwd, log_path)
+            output_bytes = _output_bytes(output)
+            if returncode != 0 or output_bytes == 0:
+                tail = log_path.read_text(encoding="utf-8", errors="replace").splitlines()[-20:]
+                error = {"returncode": returncode, "log_tail": tail}
+                break
+            samples.append({"wall_seconds": elapsed, "peak_rss_bytes": peak_rss, "output_bytes": output_bytes})
+
+    result = {"run": run_name, "corpus": corpus["kind"], "input_pages": corpus["total_pages"],
+              "args": fill_args if run_name.startswith("fill-") else insert_args}
+    if error is not None:
+        result["error"] = error
+        return result
+    wall = statistics.median(s["wall_seconds"] for s in samples)
+    rss_samples = [s["peak_rss_bytes"] for s in samples if s["peak_rss_bytes"] is not None]
+    result.update(
+        wall_seconds=wall,
+        pages_per_second=corpus["total_pages"] / wall,
+        peak_rss_bytes=int(statistics.median(rss_samples)) if rss_samples else None,
+        output_bytes=samples[-1]["output_bytes"],
+        samples=samples,
+    )
+    return result
+
+
+def format_result(result):
+    name = f"[{result['corpus']}] {result['run']}"
+    if "error" in result:
+        return f"{name:<26} 失败 (退出码 {result['error']['returncode']})"
+    rss = f"{result['peak_rss_bytes'] / 1024 ** 2:7.1f} MB" if result["peak_rss_bytes"] is not None else "      -   "
+    return (f"{name:<26} {result['wall_seconds']:7.2f} 秒 {result['pages_per_second']:8.1f} 页/秒 "
+            f"峰值内存 {rss} 输出 {result['output_bytes'] / 1024 ** 2:7.2f} MB")
+
+
+# --- 环境信息与结果比较 ---
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_DIR, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def library_versions(python):
+    """在被测解释器中查询各依赖库的版本 (两个脚本可能各自使用不同的虚拟环境)。"""
+    code = (
+        "import json\n"
+        "from importlib import metadata\n"
+        "versions = {}\n"
+        f"for name in {list(LIBRARIES)!r}:\n"
+        "    try:\n"
+        "        versions[name] = metadata.version(name)\n"
+        "    except metadata.PackageNotFoundError:\n"
+        "        versions[name] = None\n"
+        "print(json.dumps(versions))\n"
+    )
+    output = subprocess.run([python, "-c", code], check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output)
+
+
+def environment_info(python):
+    commit = _git("rev-parse", "HEAD")
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")) if commit else None,
+        "python": subprocess.run([python, "-c", "import platform; print(platform.python_version())"],
+                                 check=True, stdout=subprocess.PIPE, text=True).stdout.strip(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": library_versions(python),
+    }
+
+
+def _change(old, new):
+    if old is None or new is None or old == 0:
+        return "       -"
+    return f"{(new - old) / old * 100:+7.1f}%"
+
+
+def compare_results(baseline, current):
+    """按 (语料, 运行项) 对比两份结果，输出耗时、峰值内存和输出大小的相对变化。"""
+    print(f"\n[比较] 基准 {baseline['environment'].get('commit', '?')[:10]} -> "
+          f"当前 {current['environment'].get('commit', '?')[:10]} (负数表示减少)")
+    for kind, corpus in current["corpora"].items():
+        old_corpus = baseline["corpora"].get(kind)
+        if old_corpus is not None and old_corpus["sha256"] != corpus["sha256"]:
+            print(f"    [!] 警告: 语料 {kind} 与基准中的语料不同，比较结果不可靠")
+    old_results = {(r["corpus"], r["run"]): r for r in baseline["results"] if "error" not in r}
+    for result in current["results"]:
+        old = old_results.get((result["corpus"], result["run"]))
+        if old is None or "error" in result:
+            continue
+        name = f"[{result['corpus']}] {result['run']}"
+        print(f"    {name:<26} 耗时 {_change(old['wall_seconds'], result['wall_seconds'])}  "
+              f"峰值内存 {_change(old['peak_rss_bytes'], result['peak_rss_bytes'])}  "
+              f"输出 {_change(old['output_bytes'], result['output_bytes'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pdf_fill 与 pdfinsert 的可复现基准测试")
+    parser.add_argument("--files", type=int, default=10, help="每种语料的文件数（默认 10）")
+    parser.add_argument("--pages", type=int, default=10, help="每个文件的页数（默认 10）")
+    parser.add_argument("--seed", type=int, default=0, help="语料生成的随机种子（默认 0）")
+    parser.add_argument("--corpus", nargs="+", choices=CORPUS_KINDS, default=list(CORPUS_KINDS),
+                        help="要生成并测试的语料类型（默认全部）")
+    parser.add_argument("--runs", nargs="+", choices=RUN_NAMES, default=list(RUN_NAMES),
+                        help="要执行的运行项（默认全部）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，指标取中位数（默认 3）")
+    parser.add_argument("--corpus-dir", default=None,
+                        help="语料保存目录。指定后保留生成的语料，参数相同时下次直接复用（默认使用临时目录）")
+    parser.add_argument("--python", default=sys.executable, help="运行两个脚本的 Python 解释器（默认当前解释器）")
+    parser.add_argument("--fill-args", default="", help="传给 pdf_fill.py 的额外参数，如 --fill-args=\"--compact -j 4\"")
+    parser.add_argument("--insert-args", default="", help="传给 pdfinsert.py 的额外参数，如 --insert-args=\"-j 4 --stream\"")
+    parser.add_argument("-o", "--output", default=None,
+                        help="结果 JSON 路径（默认 benchmarks/results/<时间>_<提交>.json）")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 比较")
+    args = parser.parse_args()
+
+    fill_args, insert_args = shlex.split(args.fill_args), shlex.split(args.insert_args)
+    environment = environment_info(args.python)
+    temp_corpus = None
+    if args.corpus_dir is None:
+        temp_corpus = tempfile.mkdtemp(prefix="pdfbench_corpus_")
+    corpus_root = Path(args.corpus_dir or temp_corpus).resolve()
+
+    report = {"environment": environment, "corpora": {}, "results": []}
+    try:
+        for kind in args.corpus:
+            corpus_dir = corpus_root / kind
+            # 语料在单独的进程中生成: Linux 的峰值 RSS 会从父进程继承到 fork 出的子进程，
+            # 生成位图后本进程的内存占用会抬高之后所有测量的峰值内存
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                corpus = pool.submit(generate_corpus, corpus_dir, kind, args.files, args.pages, args.seed).result()
+            report["corpora"][kind] = corpus
+            for run_name in args.runs:
+                result = run_benchmark(run_name, corpus, corpus_dir, args.repeat, args.python, fill_args, insert_args)
+                report["results"].append(result)
+                print(format_result(result))
+                if "error" in result:
+                    print("    " + "\n    ".join(result["error"]["log_tail"]))
+    finally:
+        if temp_corpus is not None:
+            shutil.rmtree(temp_corpus, ignore_errors=True)
+
+    if args.output is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        commit = (environment["commit"] or "nogit")[:10] + ("-dirty" if environment["dirty"] else "")
+        output_path = RESULTS_DIR / f"{stamp}_{commit}.json"
+    else:
+        output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[结果] 已写入 {output_path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare_results(json.load(f), report)
+
+    if any("error" in r for r in report["results"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
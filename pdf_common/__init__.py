@@ -0,0 +1,9 @@
+"""pdf_fill 与 pdfinsert 共用的代码。
+
+两个脚本分别基于 pypdf 和 PyPDF2，而批量运行 (batch/pdf_batch.py) 会把它们加载到同一个进程中，
+因此这里的代码不保存任何与库相关的全局状态：类在构造时接收所用库的 generic 模块，
+函数从传入的对象推断它来自哪个库 (见 writer.generic_module)。两个库中用到的类名和方法相同。
+
+两个脚本把仓库根目录加入 sys.path 后以 `from pdf_common.xxx import ...` 导入，
+单独复制脚本使用时需要把 pdf_common/ 一同复制到脚本所在目录的上一级。
+"""
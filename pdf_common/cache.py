@@ -0,0 +1,101 @@
+"""按输入文件内容和处理参数持久保存处理结果的磁盘缓存。"""
+
+import os
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Optional, Tuple
+
+CACHE_DIR_NAME = ".cache"       # 缓存目录名，两个脚本都放在脚本所在目录下
+CACHE_MAX_BYTES = 2 * 1024 ** 3 # 缓存总大小上限的默认值，超出时按最近使用时间淘汰
+
+
+class ResultCache:
+    """按输入文件内容哈希和处理参数持久保存处理结果的磁盘缓存。
+
+    键由文件内容的 SHA-256、构造时给出的工具参数 params (缓存版本、边距、页码字体等，
+    处理逻辑或参数改变时键随之改变) 以及 key() 的调用参数 (如页范围) 共同决定。
+    同一文件的内容哈希只计算一次，预读时可以用已读入的内容提前计算 (见 remember)。
+    每个条目是一个 PDF 文件；命中时更新其修改时间，evict() 按修改时间从旧到新淘汰。
+    对象本身只保存目录、参数和计数，可以直接传给子进程。
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = CACHE_MAX_BYTES, params: tuple = ()):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+        self._digests = {} # (路径, 大小, 修改时间) -> 内容哈希，避免同一文件的多个页范围重复计算
+
+    @staticmethod
+    def _file_id(input_file) -> tuple:
+        stat = os.stat(input_file)
+        return (os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns)
+
+    def key(self, input_file, *params) -> str:
+        """返回 input_file 在调用参数 params 下的缓存键。"""
+        file_id = self._file_id(input_file)
+        if file_id not in self._digests:
+            digest = hashlib.sha256()
+            with open(input_file, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(chunk)
+            self._digests[file_id] = digest.hexdigest()
+        params = self.params + params
+        return hashlib.sha256(f"{self._digests[file_id]}{params!r}".encode()).hexdigest()
+
+    def remember(self, input_file, data: bytes):
+        """用已读入内存的文件内容 data (预读) 计算 input_file 的内容哈希，之后的 key() 不再读取文件。"""
+        self._digests[self._file_id(input_file)] = hashlib.sha256(data).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        """是否有 key 的条目 (不计入命中统计，也不更新使用时间)。"""
+        return (self.cache_dir / f"{key}.pdf").is_file()
+
+    def get(self, key: str) -> Optional[Path]:
+        """返回缓存条目的路径；未命中时返回 None。"""
+        cached_file = self.cache_dir / f"{key}.pdf"
+        if cached_file.is_file():
+            os.utime(cached_file) # 记录最近使用时间，供 evict() 使用
+            self.hits += 1
+            return cached_file
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result):
+        """写入一个条目，result 是已序列化的 PDF 字节、处理结果文件的路径或尚未写出的 PdfWriter。
+        先写到临时文件再改名，并行写入同一个键也是安全的。"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_file = self.cache_dir / f"{key}.{os.getpid()}.tmp"
+        if isinstance(result, bytes):
+            temp_file.write_bytes(result)
+        elif isinstance(result, (str, os.PathLike)):
+            shutil.copyfile(result, temp_file)
+        else:
+            with open(temp_file, "wb") as fp:
+                result.write(fp)
+        os.replace(temp_file, self.cache_dir / f"{key}.pdf")
+
+    def evict(self) -> Tuple[int, int]:
+        """按最近使用时间从旧到新删除条目，直到总大小不超过 max_bytes。返回 (删除条目数, 释放字节数)。"""
+        if not self.cache_dir.is_dir():
+            return 0, 0
+        entries = []
+        for cached_file in self.cache_dir.glob("*.pdf"):
+            stat = cached_file.stat()
+            entries.append((stat.st_mtime, stat.st_size, cached_file))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        removed, freed = 0, 0
+        for _, size, cached_file in entries:
+            if total_size <= self.max_bytes:
+                break
+            cached_file.unlink()
+            total_size -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def report(self) -> str:
+        return f"处理结果缓存: 命中 {self.hits}, 未命中 {self.misses}"
@@ -0,0 +1,169 @@
+"""--append 使用的合并结果旁路索引。"""
+
+import os
+import re
+import json
+import itertools
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+MERGE_INDEX_SUFFIX = ".index.json" # 旁路索引文件名后缀 (追加在合并结果文件名之后)
+MERGE_INDEX_VERSION = 1            # 索引格式改变时递增，旧索引视为无效
+
+
+def file_identity(pdf_file) -> dict:
+    """输入文件在 MergeIndex 中的身份：文件名、大小和修改时间。"""
+    stat = os.stat(pdf_file)
+    return {"file": os.path.basename(pdf_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_startxref(f: BinaryIO) -> int:
+    """返回 PDF 文件末尾 startxref 给出的最后一个交叉引用表的偏移量。"""
+    f.seek(0, os.SEEK_END)
+    f.seek(max(f.tell() - 1024, 0))
+    offsets = re.findall(rb"startxref\s+(\d+)", f.read())
+    if not offsets:
+        raise ValueError("文件末尾没有 startxref")
+    return int(offsets[-1])
+
+
+class MergeIndex:
+    """--append 使用的合并结果旁路索引 (<合并结果>.index.json)。
+
+    记录合并了哪些文件 (文件名、大小、修改时间)、各自的页数和顶层书签的对象号，
+    以及每页的对象号、文档目录/页面树/书签根的对象号、trailer 条目、下一个可用对象号和最后一个
+    交叉引用表的偏移量。有了这些信息，追加新文件时可以直接在合并结果末尾写出增量更新，
+    不必重新解析整个文件。索引同时记录合并结果的大小和修改时间，合并结果被改动后索引即失效。
+    索引本身只保存数字和字符串，与所用的 PDF 库无关。
+    """
+
+    def __init__(self, pdf_path, data: dict):
+        self.pdf_path = pdf_path
+        self.files: List[dict] = data["files"]     # [{"file", "size", "mtime_ns", "pages", "outline"}, ...]
+        self.page_ids: List[int] = data["page_ids"] # 各页面的对象号
+        self.root: int = data["root"]
+        self.pages: int = data["pages"]
+        self.outlines: Optional[int] = data["outlines"] # 书签根的对象号，没有书签时为 None
+        self.info: Optional[int] = data["info"]
+        self.file_id: Optional[List[str]] = data["id"]  # trailer 中 /ID 的两个十六进制字符串
+        self.size: int = data["size"]                   # trailer 中的 /Size，即下一个可用对象号
+        self.startxref: int = data["startxref"]
+        self.compact: bool = data["compact"]            # 最后一个交叉引用表是否为交叉引用流
+
+    @staticmethod
+    def path_for(pdf_path) -> Path:
+        pdf_path = Path(pdf_path)
+        return pdf_path.with_name(pdf_path.name + MERGE_INDEX_SUFFIX)
+
+    @classmethod
+    def load(cls, pdf_path) -> Optional["MergeIndex"]:
+        """读取 pdf_path 的索引；索引不存在、格式不符或合并结果已被改动时返回 None。"""
+        try:
+            data = json.loads(cls.path_for(pdf_path).read_text(encoding="utf-8"))
+            stat = os.stat(pdf_path)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MERGE_INDEX_VERSION or \
+                [data.get("pdf_size"), data.get("pdf_mtime_ns")] != [stat.st_size, stat.st_mtime_ns]:
+            return None
+        return cls(pdf_path, data)
+
+    @classmethod
+    def build(cls, pdf_path, source_files: list, page_counts: List[int], reader_class) -> Optional["MergeIndex"]:
+        """用 reader_class (pypdf 或 PyPDF2 的 PdfReader) 读取刚完整写出的合并结果，为其建立索引。
+
+        source_files 是按合并顺序排列的文件 (用于记录身份)，page_counts 是各自合并的页数 (跳过的文件为 0)。
+        页面树不是单层 (页面直接挂在根节点下) 或顶层书签与非空文件不能一一对应时无法追加，返回 None。
+        """
+        with open(pdf_path, "rb") as f:
+            reader = reader_class(f, strict=False)
+            trailer = reader.trailer
+            root_ref = trailer.raw_get("/Root")
+            catalog = root_ref.get_object()
+            pages_ref = catalog.raw_get("/Pages")
+            page_ids = [page.indirect_reference.idnum for page in reader.pages]
+            kids = pages_ref.get_object()["/Kids"]
+            if [getattr(kid, "idnum", None) for kid in kids] != page_ids or sum(page_counts) != len(page_ids):
+                return None
+            outline_ids = []
+            outlines_ref = catalog.raw_get("/Outlines") if "/Outlines" in catalog else None
+            item_ref = outlines_ref.get_object().raw_get("/First") if outlines_ref is not None and \
+                "/First" in outlines_ref.get_object() else None
+            while item_ref is not None:
+                outline_ids.append(item_ref.idnum)
+                item = item_ref.get_object()
+                item_ref = item.raw_get("/Next") if "/Next" in item else None
+            if len(outline_ids) != sum(1 for count in page_counts if count):
+                return None
+            info = trailer.raw_get("/Info") if "/Info" in trailer else None
+            file_id = None
+            if "/ID" in trailer:
+                # TextStringObject 的 original_bytes 是解码前的原始字节，ByteStringObject 本身就是字节
+                file_id = [(value.original_bytes if hasattr(value, "original_bytes") else bytes(value)).hex()
+                           for value in trailer["/ID"]]
+            startxref = read_startxref(f)
+            f.seek(startxref)
+            compact = not f.read(4).startswith(b"xref")
+            if "/Size" in trailer:
+                size = int(trailer["/Size"])
+            else: # PyPDF2 读取交叉引用流时不保留 /Size，按已知的最大对象号推算
+                size = max(itertools.chain(*(ids.keys() for ids in reader.xref.values()), reader.xref_objStm)) + 1
+
+        outline_iter = iter(outline_ids)
+        files = [dict(file_identity(source), pages=count, outline=next(outline_iter) if count else None)
+                 for source, count in zip(source_files, page_counts)]
+        return cls(pdf_path, {
+            "files": files, "page_ids": page_ids, "root": root_ref.idnum, "pages": pages_ref.idnum,
+            "outlines": outlines_ref.idnum if outlines_ref is not None else None,
+            "info": info.idnum if info is not None else None, "id": file_id,
+            "size": size, "startxref": startxref, "compact": compact,
+        })
+
+    @property
+    def outline_ids(self) -> List[int]:
+        return [entry["outline"] for entry in self.files if entry["outline"] is not None]
+
+    def matches_prefix(self, source_files: list) -> bool:
+        """source_files 的前若干个是否正好是索引中的文件 (且未被修改)，即只在末尾新增了文件。"""
+        if len(source_files) < len(self.files):
+            return False
+        return all(file_identity(source) == {key: entry[key] for key in ("file", "size", "mtime_ns")}
+                   for source, entry in zip(source_files, self.files))
+
+    def add_files(self, source_files: list, page_counts: List[int], outline_ids: List[int]):
+        """记录追加的文件；outline_ids 是其中非空文件的顶层书签对象号，按顺序排列。"""
+        outline_iter = iter(outline_ids)
+        self.files += [dict(file_identity(source), pages=count, outline=next(outline_iter) if count else None)
+                       for source, count in zip(source_files, page_counts)]
+
+    def record_append(self, writer, source_files: list, page_counts: List[int]):
+        """writer (以本索引为 base 的 StreamingPdfWriter) close() 之后记录追加的文件并保存索引。"""
+        self.add_files(source_files, page_counts, writer.outline_ids)
+        self.page_ids = writer.page_ids
+        self.outlines = writer.outlines_id
+        self.size = writer.next_id
+        self.startxref = writer.startxref
+        self.save()
+
+    def trailer_entries(self, generic) -> dict:
+        """增量更新的 trailer 需要沿用的 /Info 和 /ID，用 generic (所用库的 generic 模块) 的对象表示。"""
+        entries = {}
+        if self.info is not None:
+            entries[generic.NameObject("/Info")] = generic.IndirectObject(self.info, 0, None)
+        if self.file_id is not None:
+            entries[generic.NameObject("/ID")] = generic.ArrayObject(
+                [generic.ByteStringObject(bytes.fromhex(value)) for value in self.file_id])
+        return entries
+
+    def save(self):
+        stat = os.stat(self.pdf_path)
+        data = {
+            "version": MERGE_INDEX_VERSION, "pdf_size": stat.st_size, "pdf_mtime_ns": stat.st_mtime_ns,
+            "root": self.root, "pages": self.pages, "outlines": self.outlines, "info": self.info,
+            "id": self.file_id, "size": self.size, "startxref": self.startxref, "compact": self.compact,
+            "files": self.files, "page_ids": self.page_ids,
+        }
+        index_path = self.path_for(self.pdf_path)
+        temp_path = index_path.with_name(index_path.name + ".tmp")
+        temp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        temp_path.replace(index_path)
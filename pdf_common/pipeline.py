@@ -0,0 +1,120 @@
+"""预读与延后写出 (--prefetch)：让读取、处理和写出在串行处理时重叠进行。"""
+
+import sys
+import time
+import queue
+import threading
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+
+_QUEUE_END = object() # 队列结束标记
+
+
+def _no_stage(name: str, **args):
+    return nullcontext()
+
+
+class Prefetcher:
+    """在后台线程中按顺序对接下来的输入执行 load，使读取和解析与当前文件的处理重叠进行。
+
+    队列最多保存 depth 个已完成的结果，后台线程因此最多领先 depth + 1 个文件，内存占用有上限。
+    迭代时按原顺序产出 (输入, load 的结果)；load 出错时结果为 None，由调用方按原来的方式读取并报告错误。
+    wait_seconds 是主线程等待后台线程的总时间，接近 0 说明读取完全被处理掩盖。
+    stage 是脚本的 profile_stage，等待时间记为 prefetch_wait 阶段。
+    """
+
+    def __init__(self, items: list, load, depth: int, stage=_no_stage):
+        self.count = len(items)
+        self.wait_seconds = 0.0
+        self._stage = stage
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(items, load), name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _run(self, items: list, load):
+        for item in items:
+            if self._stopped.is_set():
+                break
+            try:
+                result = load(item)
+            except Exception:
+                result = None
+            self._queue.put((item, result))
+        self._queue.put(_QUEUE_END)
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            with self._stage("prefetch_wait"):
+                entry = self._queue.get()
+            self.wait_seconds += time.perf_counter() - start
+            if entry is _QUEUE_END:
+                return
+            yield entry
+
+    def close(self):
+        """停止后台线程；提前结束迭代时丢弃已预读的结果。"""
+        self._stopped.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class WriteBehind:
+    """在后台线程中按提交顺序执行写出任务，主线程不必等待写入完成就可以继续处理下一个文件。
+
+    队列最多保存 depth 个任务，已满时 submit 阻塞；wait_seconds 是 submit 阻塞的总时间，
+    明显大于 0 说明写出跟不上处理。出错的任务记录在 failures 中，close() 之后由调用方报告，
+    或者调用 raise_failures() 重新抛出。stage 同 Prefetcher，记录 write_behind/write_wait 阶段。
+    """
+
+    def __init__(self, depth: int, stage=_no_stage):
+        self.count = 0
+        self.wait_seconds = 0.0
+        self.failures: List[Tuple[str, Exception]] = []
+        self._stage = stage
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._run, name="write_behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is _QUEUE_END:
+                return
+            label, func, args = task
+            try:
+                with self._stage("write_behind", file=label):
+                    func(*args)
+            except Exception as e:
+                self.failures.append((label, e))
+
+    def submit(self, label: str, func, *args):
+        start = time.perf_counter()
+        with self._stage("write_wait", file=label):
+            self._queue.put((label, func, args))
+        self.wait_seconds += time.perf_counter() - start
+        self.count += 1
+
+    def close(self):
+        """等待已提交的任务全部完成。"""
+        self._queue.put(_QUEUE_END)
+        self._thread.join()
+
+    def raise_failures(self):
+        """(close() 之后) 有任务出错时重新抛出第一个错误，其余错误写到标准错误。"""
+        for label, e in self.failures[1:]:
+            print(f"[错误] 延后写出 {label} 失败: {e}", file=sys.stderr)
+        if self.failures:
+            raise self.failures[0][1]
+
+
+def write_later(write_behind: Optional[WriteBehind], label: str, func, *args):
+    """把写出任务交给 write_behind；write_behind 为 None 时立即执行。"""
+    if write_behind is None:
+        func(*args)
+    else:
+        write_behind.submit(label, func, *args)
@@ -0,0 +1,88 @@
+"""--profile 的记录器。"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+class TraceProfiler:
+    """--profile 的记录器: 记录各阶段的耗时和计数器 (页数、页码叠加数、读写字节数等)。
+
+    阶段以 Chrome trace-event 格式的 "X" 事件记录，每个进程各有一个实例。进程池的子进程
+    在退出时把自己的事件写入 parts_dir (见各脚本的 _init_worker)，主进程在 write_trace 中
+    合并后写出一个可以在 chrome://tracing 或 https://ui.perfetto.dev 中打开的 JSON 文件。
+    cprofile_path 非空时同时用 cProfile 记录函数级耗时，子进程的文件名后附加其进程号。
+    process_name 是主进程在 trace 中显示的名称。
+    """
+
+    def __init__(self, parts_dir, cprofile_path: Optional[str] = None, process_name: str = "main"):
+        self.parts_dir = Path(parts_dir)
+        self.cprofile_path = cprofile_path
+        self.process_name = process_name
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.events: List[dict] = []
+        self.counters: Counter = Counter()
+        self.cprofile = None
+        if cprofile_path:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def stage(self, name: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append({"name": name, "ph": "X", "pid": self.pid, "tid": threading.get_native_id(),
+                                "ts": start * 1e6, "dur": (time.perf_counter() - start) * 1e6, "args": args})
+
+    def _dump_cprofile(self, path: str):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(path)
+
+    def dump_part(self):
+        """(子进程) 把本进程的事件和计数器写入 parts_dir。"""
+        self._dump_cprofile(f"{self.cprofile_path}.{self.pid}")
+        with open(self.parts_dir / f"{self.pid}.json", "w", encoding="utf-8") as fp:
+            json.dump({"events": self.events, "counters": self.counters}, fp)
+
+    def write_trace(self, trace_path) -> Tuple[Counter, Counter]:
+        """(主进程) 合并所有进程的事件，写出 trace 文件。返回 (各阶段总耗时秒数, 合并后的计数器)。"""
+        end = time.perf_counter()
+        self._dump_cprofile(self.cprofile_path)
+        self.events.append({"name": "run", "ph": "X", "pid": self.pid, "tid": threading.get_native_id(),
+                            "ts": self.start * 1e6, "dur": (end - self.start) * 1e6, "args": {"argv": sys.argv[1:]}})
+        parts = {self.pid: {"events": self.events, "counters": self.counters}}
+        for part_file in sorted(self.parts_dir.glob("*.json")):
+            with open(part_file, encoding="utf-8") as fp:
+                parts[int(part_file.stem)] = json.load(fp)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+        trace_events = []
+        totals: Counter = Counter()
+        counters: Counter = Counter()
+        for pid, part in parts.items():
+            name = self.process_name if pid == self.pid else f"worker {pid}"
+            trace_events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+            trace_events.extend(part["events"])
+            # 每个进程的计数器作为一个计数器事件，放在该进程最后一个事件结束时
+            last_ts = max((e["ts"] + e["dur"] for e in part["events"]), default=end * 1e6)
+            trace_events.append({"name": "counters", "ph": "C", "pid": pid, "ts": last_ts, "args": part["counters"]})
+            counters.update(part["counters"])
+            for event in part["events"]:
+                if event["name"] != "run":
+                    totals[event["name"]] += event["dur"] / 1e6
+        with open(trace_path, "w", encoding="utf-8") as fp:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms",
+                       "otherData": {"counters": counters, "stage_seconds": totals}}, fp, ensure_ascii=False)
+        return totals, counters
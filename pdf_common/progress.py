@@ -0,0 +1,111 @@
+"""--progress jsonl 的进度事件输出。"""
+
+import os
+import json
+import time
+from collections import Counter
+from typing import List, Optional
+
+
+class ProgressReporter:
+    """--progress jsonl 的输出: 每行一个 JSON 进度事件，供前端或其他程序解析。
+
+    事件 (都包含 event 和自开始以来的秒数 t):
+        start         tool, files, input_bytes
+        stage         name: 开始的阶段 (如 process、merge、write，由各脚本决定)
+        file_started  file, index, files (仅在主进程中处理的文件；进程池中的文件在子进程中开始)
+        pages         file, pages: 大文件的一个分片处理完成
+        file_finished file, index, pages, ok，可能还有 output、output_bytes、cached
+        file_merged   file, pages, merged_pages: 一个已处理的文件追加到合并结果
+        written       file, bytes: 写出一个输出文件
+        error         message: 不属于单个文件的错误 (如没有可处理的文件、合并结果写出失败)
+        done          ok, files, pages, failed (处理失败的文件名), bytes_written, elapsed；
+                      调用方可以附加字段，如出错退出时的 error
+    pages、file_finished 和 written 事件还带有累计的 files_done、pages_done、pages_per_sec，
+    以及按已处理的输入字节数估算的剩余处理秒数 eta (尚无法估算时为 null)。
+    文件以文件名为键 (--dpi 重采样后的文件与原文件同名)。进度只在主进程中汇总和输出。
+    """
+
+    def __init__(self, stream, tool: str):
+        self.stream = stream
+        self.tool = tool
+        self.start = time.perf_counter()
+        self.file_sizes: dict = {}
+        self.file_indices: dict = {}
+        self.total_bytes = 0
+        self._file_pages: Counter = Counter()     # 文件名 -> 已报告的页数
+        self._file_fraction: Counter = Counter()  # 文件名 -> 已完成的比例
+        self.done_bytes = 0.0
+        self.pages_done = 0
+        self.files_done = 0
+        self.bytes_written = 0
+        self.failed: List[str] = []
+        self.errors = 0
+
+    def begin(self, input_files: list):
+        """确定输入文件后输出 start 事件。"""
+        self.file_sizes = {os.path.basename(f): os.path.getsize(f) for f in input_files}
+        self.file_indices = {os.path.basename(f): idx for idx, f in enumerate(input_files)}
+        self.total_bytes = sum(self.file_sizes.values())
+        self.emit("start", tool=self.tool, files=len(input_files), input_bytes=self.total_bytes)
+
+    def emit(self, event: str, **fields):
+        record = {"event": event, "t": round(time.perf_counter() - self.start, 3)}
+        record.update(fields)
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+    def _totals(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        eta = None
+        if self.done_bytes > 0:
+            eta = round(elapsed * max(self.total_bytes - self.done_bytes, 0) / self.done_bytes, 1)
+        return {"files_done": self.files_done, "pages_done": self.pages_done,
+                "pages_per_sec": round(self.pages_done / elapsed, 1) if elapsed > 0 else None, "eta": eta}
+
+    def _advance(self, name: str, pages: int, fraction: float):
+        self._file_pages[name] += pages
+        self._file_fraction[name] += fraction
+        self.pages_done += pages
+        self.done_bytes += self.file_sizes.get(name, 0) * fraction
+
+    def stage(self, name: str):
+        self.emit("stage", name=name)
+
+    def file_started(self, pdf_file):
+        name = os.path.basename(pdf_file)
+        self.emit("file_started", file=name, index=self.file_indices.get(name), files=len(self.file_sizes))
+
+    def pages(self, pdf_file, pages: int, total_pages: int):
+        """pdf_file (共 total_pages 页) 又有 pages 页处理完成。"""
+        name = os.path.basename(pdf_file)
+        self._advance(name, pages, pages / total_pages if total_pages else 0)
+        self.emit("pages", file=name, pages=pages, **self._totals())
+
+    def file_finished(self, pdf_file, pages: Optional[int] = None, ok: bool = True, **fields):
+        """pdf_file 处理完成；pages 为 None 时 (如命中缓存) 页数未知，不计入 pages_done。"""
+        name = os.path.basename(pdf_file)
+        reported = self._file_pages.pop(name, 0)
+        self._advance(name, max((pages or 0) - reported, 0), 1 - self._file_fraction.pop(name, 0))
+        self.files_done += 1
+        if not ok:
+            self.failed.append(name)
+        self.emit("file_finished", file=name, index=self.file_indices.get(name), pages=pages, ok=ok,
+                  **fields, **self._totals())
+
+    def file_merged(self, pdf_file, pages: int, merged_pages: int):
+        self.emit("file_merged", file=os.path.basename(pdf_file), pages=pages, merged_pages=merged_pages)
+
+    def written(self, output_path, nbytes: int):
+        self.bytes_written += nbytes
+        self.emit("written", file=os.fspath(output_path), bytes=nbytes, **self._totals())
+
+    def error(self, message: str):
+        self.errors += 1
+        self.emit("error", message=message)
+
+    def finish(self, ok: bool = True, **fields):
+        """输出 done 事件。有文件处理失败或出现过 error 事件时 ok 为 false。"""
+        self.emit("done", ok=ok and not self.failed and not self.errors, files=self.files_done,
+                  pages=self.pages_done, failed=self.failed, bytes_written=self.bytes_written,
+                  elapsed=round(time.perf_counter() - self.start, 3), **fields)
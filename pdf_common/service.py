@@ -0,0 +1,161 @@
+"""--serve 使用的常驻 JSON-RPC 2.0 服务。"""
+
+import os
+import sys
+import json
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+
+def require_params(params: dict, *names: str):
+    missing = [name for name in names if name not in params]
+    if missing:
+        raise ValueError(f"缺少参数: {', '.join(missing)}")
+
+
+class WorkerService:
+    """--serve: 常驻的 JSON-RPC 2.0 服务，省去每次运行的 Python 启动、导入 PDF 库/reportlab 和注册字体的开销。
+
+    请求和响应都是一行一个 JSON 对象，可以通过标准输入/输出或 Unix socket 收发。methods 中的方法
+    在 workers 个常驻工作进程 (由脚本的 initializer 初始化) 中以 call(method, params) 执行，
+    call 返回 (结果, 错误信息, 标准输出, 标准错误)，多个请求可以同时处理；serial(method, params)
+    为真的请求 (如读写固定项目目录的请求) 依次执行。stdin 模式下响应按完成顺序写出，以 id 对应请求。
+    除 methods 外服务本身还提供:
+        ping         返回服务进程号、工作进程数和已交给工作进程的请求数
+        shutdown     处理完进行中的请求后退出
+    methods 的结果还包含该请求的 stdout 和 stderr；cwd 省略时为服务的工作目录。
+    """
+
+    def __init__(self, workers: int, call: Callable, initializer: Callable, methods: Iterable[str],
+                 serial: Optional[Callable[[str, dict], bool]] = None):
+        self.workers = workers
+        self.call = call
+        self.initializer = initializer
+        self.methods = frozenset(methods)
+        self.serial = serial
+        self.requests = 0
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._serial_lock = threading.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+
+    def _execute(self, method: str, params: dict):
+        serial = self.serial is not None and self.serial(method, params)
+        with self._serial_lock if serial else nullcontext():
+            with self._lock:
+                pool = self._pool
+                self.requests += 1
+            try:
+                return pool.submit(self.call, method, params).result()
+            except BrokenProcessPool:
+                with self._lock:
+                    if self._pool is pool: # 工作进程被杀死等情况下重建进程池，后续请求不受影响
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+                raise
+
+    @staticmethod
+    def parse(line: Union[str, bytes]) -> Tuple[Optional[dict], Optional[dict]]:
+        """解析一行请求，返回 (请求, None)；无法解析或不是有效的请求时返回 (None, 错误响应)。"""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return None, {"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "无法解析的 JSON"}}
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return None, {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "无效的请求"}}
+        return request, None
+
+    def handle(self, request: dict) -> Optional[dict]:
+        """处理一个请求，返回响应对象；通知 (没有 id 的请求) 返回 None。"""
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        method, params = request["method"], request.get("params", {})
+        if method == "ping":
+            response["result"] = {"pid": os.getpid(), "workers": self.workers, "requests": self.requests}
+        elif method == "shutdown":
+            self.stopping.set()
+            response["result"] = {}
+        elif method not in self.methods:
+            response["error"] = {"code": -32601, "message": f"未知的方法: {method}"}
+        elif not isinstance(params, dict):
+            response["error"] = {"code": -32602, "message": "params 必须是对象"}
+        else:
+            try:
+                result, error, stdout, stderr = self._execute(method, dict(params, cwd=params.get("cwd", os.getcwd())))
+            except BrokenProcessPool:
+                response["error"] = {"code": -32000, "message": "工作进程异常退出"}
+            else:
+                if error is None:
+                    response["result"] = dict(result, stdout=stdout, stderr=stderr)
+                else:
+                    response["error"] = {"code": -32000, "message": error, "data": {"stdout": stdout, "stderr": stderr}}
+        return response if "id" in request else None
+
+    def serve_stdio(self):
+        """从标准输入逐行读取请求，响应写到标准输出。交给工作进程的请求各在一个线程中等待结果。"""
+        write_lock = threading.Lock()
+        threads = []
+
+        def write(response: Optional[dict]):
+            if response is not None:
+                with write_lock:
+                    sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+                    sys.stdout.flush()
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            request, error = self.parse(line)
+            if request is None:
+                write(error)
+            elif request["method"] in self.methods:
+                thread = threading.Thread(target=lambda request: write(self.handle(request)), args=(request,))
+                thread.start()
+                threads.append(thread)
+            else:
+                write(self.handle(request))
+                if self.stopping.is_set():
+                    break
+        for thread in threads:
+            thread.join()
+
+    def serve_socket(self, socket_path: str):
+        """在 socket_path 上监听；每个连接一个线程，连接内的请求按顺序处理。"""
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path) # 上次的服务没有正常退出留下的 socket 文件
+            else:
+                raise RuntimeError(f"已有服务在 {socket_path} 上运行")
+            finally:
+                probe.close()
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    request, response = service.parse(line)
+                    if request is not None:
+                        response = service.handle(request)
+                    if response is not None:
+                        self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                        self.wfile.flush()
+                    if service.stopping.is_set():
+                        threading.Thread(target=server.shutdown).start()
+                        break
+
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(socket_path)
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
@@ -0,0 +1,10 @@
+"""命令行中的大小参数 (--max-memory、--cache-size)。"""
+
+
+def parse_size(text: str) -> int:
+    """解析 "512M"、"2G"、"1048576" 这类大小字符串，返回字节数。"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
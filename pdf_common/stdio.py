@@ -0,0 +1,85 @@
+"""标准输入/输出与分帧流 (-, -o -, --frames)。"""
+
+import os
+import sys
+import struct
+from typing import BinaryIO, Iterator, Tuple
+
+STDIO_PATH = "-" # 作为输入或输出路径时表示标准输入/标准输出
+STDIN_NAME = "stdin" # 来自标准输入的 PDF 的名称 (用于日志、书签等)
+FRAME_NAME_HEADER = struct.Struct(">I") # 分帧流中每帧的文件名长度
+FRAME_DATA_HEADER = struct.Struct(">Q") # 分帧流中每帧的 PDF 数据长度
+
+
+def detach_stdout() -> BinaryIO:
+    """-o -: 在文件描述符层面保存标准输出并返回，供写出 PDF 使用；标准输出随后指向标准错误，
+    文字日志 (包括子进程的输出) 因此不会混入 PDF 数据。"""
+    sys.stdout.flush()
+    stdout_binary = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return stdout_binary
+
+
+class StdoutOutput:
+    """写到标准输出的 PDF 输出流。标准输出可能是管道，不能 seek，因此自行记录 tell() 需要的已写出字节数；
+    close() 只刷新，不关闭标准输出。"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        self.stream.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self) -> "StdoutOutput":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_frames(stream: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    """读取分帧流，按顺序产出 (文件名, PDF 数据)，直到流结束。
+
+    每帧依次为: 4 字节文件名长度、UTF-8 文件名、8 字节数据长度、PDF 数据 (长度均为大端无符号整数)。
+    文件名为空时使用 stdin-<序号>；流在一帧中间结束时抛出 ValueError。
+    """
+    index = 0
+    while True:
+        header = stream.read(FRAME_NAME_HEADER.size)
+        if not header:
+            return
+        index += 1
+        name = _read_frame_field(stream, header, FRAME_NAME_HEADER, index).decode("utf-8")
+        data = _read_frame_field(stream, stream.read(FRAME_DATA_HEADER.size), FRAME_DATA_HEADER, index)
+        yield name or f"{STDIN_NAME}-{index}", data
+
+
+def _read_frame_field(stream: BinaryIO, header: bytes, header_struct: struct.Struct, index: int) -> bytes:
+    """读取分帧流中长度为 header 的一个字段。"""
+    if len(header) != header_struct.size:
+        raise ValueError(f"分帧流在第 {index} 帧的长度字段处意外结束")
+    size = header_struct.unpack(header)[0]
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError(f"分帧流在第 {index} 帧意外结束 (需要 {size} 字节，只有 {len(data)} 字节)")
+    return data
+
+
+def write_frame(stream: BinaryIO, name: str, data: bytes):
+    """把文件名为 name 的 PDF 数据 data 作为一帧写入分帧流 (格式见 read_frames)。"""
+    encoded_name = name.encode("utf-8")
+    stream.write(FRAME_NAME_HEADER.pack(len(encoded_name)) + encoded_name)
+    stream.write(FRAME_DATA_HEADER.pack(len(data)))
+    stream.write(data)
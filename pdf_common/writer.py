@@ -0,0 +1,611 @@
+"""PDF 写出: 重复资源去重、紧凑格式 (--compact) 的对象流与交叉引用流、流式合并 (--stream)。"""
+
+import sys
+import zlib
+import hashlib
+import itertools
+from io import BytesIO
+from typing import BinaryIO, List, Optional, Tuple
+
+OBJECT_STREAM_SIZE = 100 # --compact 模式下每个对象流最多打包的对象数
+DEDUP_DICT_TYPES = ("/Font", "/FontDescriptor", "/ExtGState", "/Encoding") # 合并时可在页面间共享的字典对象类型
+RESOURCE_KEYS = frozenset(("/Font", "/XObject", "/ExtGState", "/ColorSpace", "/Pattern", "/Shading", "/Properties",
+                           "/ProcSet")) # 资源字典的键；只含这些键的字典 (如空白页共享的 Resources) 也参与去重
+
+
+def generic_module(obj):
+    """返回 obj 所属库 (pypdf 或 PyPDF2) 的 generic 模块。"""
+    return sys.modules[type(obj).__module__.split(".")[0] + ".generic"]
+
+
+def serialize_object(obj) -> bytes:
+    """返回对象的 PDF 序列化字节，作为判断两个对象是否完全相同的依据。"""
+    packet = BytesIO()
+    obj.write_to_stream(packet, None)
+    return packet.getvalue()
+
+
+def stream_data(stream) -> bytes:
+    """返回流对象未经解码的数据。
+
+    解析过的内容流 (ContentStream) 只保存操作列表: pypdf 由 get_data() 重建数据，
+    PyPDF2 每次访问 _data 都重新生成，因此调用方应只取一次。
+    """
+    if isinstance(stream, generic_module(stream).ContentStream):
+        return stream.get_data()
+    return stream._data
+
+
+# --- 重复资源去重 ---
+def is_dedup_candidate(obj) -> bool:
+    """流 (字体文件、图像、ICC 配置、表单等)、数组、DEDUP_DICT_TYPES 中的字典和资源字典可以被多处共享；
+    页面、书签、注释等与自身位置相关的对象不参与去重。"""
+    g = generic_module(obj)
+    if isinstance(obj, (g.StreamObject, g.ArrayObject)):
+        return True
+    if not isinstance(obj, g.DictionaryObject):
+        return False
+    return obj.get("/Type") in DEDUP_DICT_TYPES or (len(obj) > 0 and RESOURCE_KEYS.issuperset(obj.keys()))
+
+
+def deduplicate_objects(writer) -> Tuple[int, int]:
+    """合并 writer 中内容完全相同的资源对象，每组只保留一份。返回 (合并的对象数, 节省的字节数)。
+
+    多个文件来自同一模板时，各自带来的字体、图像和 ICC 配置完全相同。去重重复进行直到
+    没有新的重复对象 (例如 ICC 流合并后，引用它们的颜色空间数组也随之变得相同)。
+    被合并的对象替换为 null，不再被任何对象引用。
+    """
+    g = generic_module(writer)
+    objects = writer._objects
+    merged_count, saved_bytes = 0, 0
+    while True:
+        canonical_ids = {}
+        remap = {}
+        for idnum, obj in enumerate(objects, start=1):
+            if obj is None or not is_dedup_candidate(obj):
+                continue
+            data = serialize_object(obj)
+            content_key = (type(obj).__name__, hashlib.sha256(data).digest())
+            if content_key in canonical_ids:
+                remap[idnum] = canonical_ids[content_key]
+                saved_bytes += len(data)
+            else:
+                canonical_ids[content_key] = idnum
+        if not remap:
+            return merged_count, saved_bytes
+
+        for obj in objects:
+            stack = [obj]
+            while stack:
+                current = stack.pop()
+                if isinstance(current, g.DictionaryObject):
+                    items = list(current.items())
+                elif isinstance(current, g.ArrayObject):
+                    items = list(enumerate(current))
+                else:
+                    continue
+                for key, value in items:
+                    if isinstance(value, g.IndirectObject):
+                        if value.idnum in remap:
+                            current[key] = g.IndirectObject(remap[value.idnum], 0, writer)
+                    elif isinstance(value, (g.DictionaryObject, g.ArrayObject)):
+                        stack.append(value)
+        for idnum in remap:
+            objects[idnum - 1] = g.NullObject()
+        merged_count += len(remap)
+
+
+# --- 紧凑输出格式 ---
+def flate_stream(stream):
+    """返回流对象的 Flate 压缩版本；已经带有 /Filter 或压缩后没有变小时原样返回。"""
+    if "/Filter" in stream:
+        return stream
+    g = generic_module(stream)
+    data = stream_data(stream)
+    encoded = g.EncodedStreamObject() # PyPDF2 的 flate_encode() 会丢掉原有的字典条目，这里自行构造
+    encoded.update(stream)
+    encoded[g.NameObject("/Filter")] = g.NameObject("/FlateDecode")
+    encoded._data = zlib.compress(data)
+    return encoded if len(encoded._data) < len(data) else stream
+
+
+class CompactObjectWriter:
+    """以紧凑格式 (--compact) 写出 PDF 对象。
+
+    未压缩的流 (如叠加页码后的页面内容) 用 Flate 压缩后直接写出；其他对象先序列化并缓存，
+    每 OBJECT_STREAM_SIZE 个打包成一个压缩的对象流 (/ObjStm)；close() 时用压缩的交叉引用流
+    (/XRef) 代替传统的交叉引用表和 trailer。需要 PDF 1.5 以上，调用方负责写出文件头。
+    generic 是所用库的 generic 模块 (pypdf.generic 或 PyPDF2.generic)，
+    allocate_id 用于为对象流和交叉引用流分配对象号。
+    """
+
+    def __init__(self, stream: BinaryIO, generic, allocate_id):
+        self.stream = stream
+        self.generic = generic
+        self._allocate_id = allocate_id
+        self._entries = {} # 对象号 -> (1, 文件偏移, 0) 或 (2, 对象流号, 流内序号)
+        self._pending: List[Tuple[int, bytes]] = [] # 待打包的 (对象号, 序列化字节)
+
+    def write_object(self, obj_id: int, obj):
+        if isinstance(obj, self.generic.StreamObject):
+            self._entries[obj_id] = (1, self.stream.tell(), 0)
+            self.stream.write(f"{obj_id} 0 obj\n".encode())
+            flate_stream(obj).write_to_stream(self.stream, None)
+            self.stream.write(b"\nendobj\n")
+            return
+        self._pending.append((obj_id, serialize_object(obj)))
+        if len(self._pending) >= OBJECT_STREAM_SIZE:
+            self.flush()
+
+    def flush(self):
+        """把缓存的对象打包成一个对象流写出。"""
+        if not self._pending:
+            return
+        g = self.generic
+        objstm_id = self._allocate_id()
+        header = []
+        offset = 0
+        for index, (obj_id, data) in enumerate(self._pending):
+            header.append(f"{obj_id} {offset}")
+            offset += len(data) + 1
+            self._entries[obj_id] = (2, objstm_id, index)
+        header = " ".join(header).encode() + b"\n"
+        objstm = g.DecodedStreamObject()
+        objstm.update({
+            g.NameObject("/Type"): g.NameObject("/ObjStm"),
+            g.NameObject("/N"): g.NumberObject(len(self._pending)),
+            g.NameObject("/First"): g.NumberObject(len(header)),
+        })
+        objstm.set_data(header + b"\n".join(data for _, data in self._pending))
+        self._pending = []
+        self.write_object(objstm_id, objstm)
+
+    def close(self, trailer: dict, prev: Optional[int] = None) -> int:
+        """写出剩余的对象流和交叉引用流，返回交叉引用流的偏移量。trailer 是 /Root、/Info 等文件尾条目。
+
+        prev 为已有文件最后一个交叉引用表的偏移量时写出的是增量更新：交叉引用流只列出本次写出的对象
+        (/Index 给出各连续的对象号区间)，并通过 /Prev 指向原有的交叉引用表。
+        """
+        g = self.generic
+        self.flush()
+        xref_id = self._allocate_id()
+        self._entries[xref_id] = (1, self.stream.tell(), 0)
+        if prev is None:
+            obj_ids = list(range(xref_id + 1))
+        else:
+            obj_ids = sorted(self._entries)
+            index: List[int] = []
+            for obj_id in obj_ids:
+                if index and index[-2] + index[-1] == obj_id:
+                    index[-1] += 1
+                else:
+                    index += [obj_id, 1]
+        rows = [self._entries.get(obj_id, (0, 0, 0)) for obj_id in obj_ids]
+        if prev is None:
+            rows[0] = (0, 0, 65535)
+        widths = [1] + [max(1, (max(row[field] for row in rows).bit_length() + 7) // 8) for field in (1, 2)]
+        xref = g.DecodedStreamObject()
+        xref.update(trailer)
+        xref.update({
+            g.NameObject("/Type"): g.NameObject("/XRef"),
+            g.NameObject("/Size"): g.NumberObject(xref_id + 1),
+            g.NameObject("/W"): g.ArrayObject([g.NumberObject(width) for width in widths]),
+        })
+        if prev is not None:
+            xref[g.NameObject("/Index")] = g.ArrayObject([g.NumberObject(value) for value in index])
+            xref[g.NameObject("/Prev")] = g.NumberObject(prev)
+        xref.set_data(b"".join(b"".join(value.to_bytes(width, "big") for value, width in zip(row, widths))
+                               for row in rows))
+        xref_offset = self.stream.tell()
+        self.write_object(xref_id, xref)
+        self.stream.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+        return xref_offset
+
+
+def add_object(writer, obj):
+    """把新建的对象 obj 加入 writer，返回其间接引用。
+
+    通过公开的 clone 接口完成：clone 只把带有 indirect_reference 属性的对象加入目标 writer，
+    新建的对象没有这个属性，因此先设为 None。
+    """
+    obj.indirect_reference = None
+    return obj.clone(writer).indirect_reference
+
+
+def write_compact_pdf(writer, stream: BinaryIO):
+    """以紧凑格式写出 PdfWriter (pypdf 或 PyPDF2) 中的全部对象 (见 CompactObjectWriter)。"""
+    g = generic_module(writer)
+    if type(writer).__module__.startswith("PyPDF2."):
+        if not writer._root:
+            writer._root = writer._add_object(writer._root_object)
+        writer._sweep_indirect_references(writer._root) # 与 PdfWriter.write 相同: 导入仍指向其他文件的对象
+        root = writer._root
+    else:
+        if hasattr(writer, "_resolve_links"): # 较新的 pypdf 在写出前解析指向其他文件的链接
+            writer._resolve_links()
+        root = writer.root_object.indirect_reference
+    stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    compact = CompactObjectWriter(stream, g, itertools.count(len(writer._objects) + 1).__next__)
+    for obj_id, obj in enumerate(writer._objects, start=1):
+        if obj is not None and not isinstance(obj, g.NullObject): # 去重后留下的 null 不再被引用
+            compact.write_object(obj_id, obj)
+    trailer = {g.NameObject("/Root"): root}
+    info = writer._info
+    if info is not None:
+        trailer[g.NameObject("/Info")] = info if isinstance(info, g.IndirectObject) else info.indirect_reference
+    if getattr(writer, "_ID", None):
+        trailer[g.NameObject("/ID")] = writer._ID
+    compact.close(trailer)
+
+
+# --- 流式合并 ---
+class StreamingPdfWriter:
+    """逐个输入文件增量写出的 PDF 写入器，用于超大合并。
+
+    每次 add_pages() 都会把这批页面及其引用的全部对象立即序列化到输出流，
+    之后调用方即可释放对应的 reader/writer；内存中只保留页面对象号和书签等轻量信息，
+    页面树、书签和交叉引用表在 close() 时统一写出。峰值内存因此取决于最大的单个输入，
+    而不是所有输入的总和。generic 是所用库的 generic 模块 (见 CompactObjectWriter)。
+
+    已写出的对象无法再合并，因此资源对象 (见 is_dedup_candidate) 在分配对象号之前按其内容及
+    引用的全部对象计算哈希 (见 _content_digest)，与之前写出的对象相同时直接引用已有的对象号。
+    合并数和估计节省的字节数记录在 dedup_count / dedup_saved 中。
+
+    compact 为 True 时对象经 CompactObjectWriter 写出 (对象流 + 交叉引用流)，
+    内存中最多额外缓存 OBJECT_STREAM_SIZE 个已序列化的小对象。
+
+    给定 base (已有合并结果的 MergeIndex) 时在该文件末尾继续写 (--append)：stream 以追加方式打开，
+    新对象从原文件的 /Size 开始编号，页面接在原有页面之后，close() 写出 PDF 增量更新 (见 close)。
+    base_reader 是读取原文件的 PdfReader，用于取出需要改写的原有对象。
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, stream: BinaryIO, generic, compact: bool = False, base=None, base_reader=None):
+        self.stream = stream
+        self.generic = generic
+        self._compact = CompactObjectWriter(stream, generic, self._allocate_id) if compact else None
+        self._offsets = {}
+        self._next_id = 3
+        self._page_ids: List[int] = []
+        self._outline = [] # 顶层书签: [标题, 页索引, 子书签列表]
+        self._digest_ids = {} # 内容哈希 -> 已分配的对象号
+        self._id_digests = {} # 对象号 -> 内容哈希
+        self.dedup_count = 0
+        self.dedup_saved = 0
+        self._base = base
+        self._base_reader = base_reader
+        self.outlines_id: Optional[int] = None # close() 后: 书签根的对象号 (没有书签时为 None)
+        self.outline_ids: List[int] = []       # close() 后: 本次写出的顶层书签的对象号
+        self.startxref: Optional[int] = None   # close() 后: 最后一个交叉引用表的偏移量
+        if base is not None:
+            self.CATALOG_ID = base.root
+            self.PAGES_ID = base.pages
+            self._next_id = base.size
+            self._page_ids = list(base.page_ids)
+            self.outlines_id = base.outlines
+            return
+        self.stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def __len__(self) -> int:
+        return len(self._page_ids)
+
+    @property
+    def page_ids(self) -> List[int]:
+        """各页面在输出文件中的对象号 (--append 时包括原有页面)。"""
+        return list(self._page_ids)
+
+    @property
+    def next_id(self) -> int:
+        """下一个可用的对象号，即 trailer 中的 /Size。"""
+        return self._next_id
+
+    def _allocate_id(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, obj):
+        if self._compact is not None:
+            self._compact.write_object(obj_id, obj)
+            return
+        self._offsets[obj_id] = self.stream.tell()
+        self.stream.write(f"{obj_id} 0 obj\n".encode())
+        obj.write_to_stream(self.stream, None)
+        self.stream.write(b"\nendobj\n")
+
+    def _content_digest(self, ref, memo: dict) -> Optional[Tuple[bytes, int]]:
+        """返回 (内容哈希, 估计字节数)，覆盖 ref 所指对象及其引用的全部对象；无法去重时返回 None。
+
+        间接引用按被引用对象的内容哈希参与计算 (而不是对象号)，因此来自不同文件的相同资源
+        得到相同的哈希。引用页面树 (经由 /Parent 或页面对象) 或处于循环引用中的对象不参与去重。
+        memo 以源对象为键，在同一次 add_pages 中复用。
+        """
+        g = self.generic
+
+        def source_key(child):
+            return (id(child.pdf), child.idnum)
+
+        def child_refs(obj):
+            refs = []
+            stack = [obj]
+            while stack:
+                current = stack.pop()
+                values = current.values() if isinstance(current, g.DictionaryObject) else current
+                for value in values:
+                    if isinstance(value, g.IndirectObject):
+                        if value.pdf is not None: # 已写出的对象按 _id_digests 计算
+                            refs.append(value)
+                    elif isinstance(value, (g.DictionaryObject, g.ArrayObject)):
+                        stack.append(value)
+            return refs
+
+        def encode(obj, data=None):
+            if isinstance(obj, g.IndirectObject):
+                if obj.pdf is None:
+                    return self._id_digests.get(obj.idnum, f"O{obj.idnum}".encode())
+                return memo[source_key(obj)][0]
+            if isinstance(obj, g.DictionaryObject):
+                parts = [b"<<"]
+                for key in sorted(obj):
+                    if key != "/Length" or data is None: # /Length 写出时重新计算
+                        parts += [key.encode("utf-8", "surrogateescape"), encode(dict.__getitem__(obj, key))]
+                if data is not None:
+                    parts += [b"stream", hashlib.sha256(data).digest()]
+                return b" ".join(parts + [b">>"])
+            if isinstance(obj, g.ArrayObject):
+                return b" ".join([b"["] + [encode(value) for value in list.__iter__(obj)] + [b"]"])
+            return f"{type(obj).__name__}:{obj!r}".encode("utf-8", "surrogateescape")
+
+        visiting = object()
+        stack = [ref]
+        while stack:
+            current = stack[-1]
+            key = source_key(current)
+            if key in memo and memo[key] is not visiting: # 已计算 (重复入栈)
+                stack.pop()
+                continue
+            obj = current.get_object()
+            if obj is None:
+                memo[key] = (hashlib.sha256(b"null").digest(), 4)
+                stack.pop()
+                continue
+            if isinstance(obj, g.DictionaryObject) and "/Parent" in obj:
+                memo[key] = None # 页面、书签、结构树等与位置相关的对象
+                stack.pop()
+                continue
+            refs = child_refs(obj)
+            if key not in memo: # 第一次访问: 先计算所有子对象
+                memo[key] = visiting
+                unvisited = [child for child in refs if source_key(child) not in memo]
+                if unvisited:
+                    stack.extend(unvisited)
+                    continue
+            stack.pop()
+            if any(memo[source_key(child)] is None or memo[source_key(child)] is visiting for child in refs):
+                memo[key] = None # 循环引用或引用了无法去重的对象
+                continue
+            data = stream_data(obj) if isinstance(obj, g.StreamObject) else None
+            encoded = encode(obj, data)
+            size = len(encoded) + (len(data) if data is not None else 0)
+            size += sum(memo[source_key(child)][1] for child in refs)
+            memo[key] = (hashlib.sha256(encoded).digest(), size)
+        return memo[source_key(ref)]
+
+    def _relinker(self, id_map: dict, pending: list):
+        """返回 (relink, relink_children)，把来自其他 reader/writer 的间接引用改写为输出文件中的对象号。
+
+        新分配了对象号、尚待写出的对象放入 pending，由调用方经 _write_pending 写出。
+        """
+        g = self.generic
+        digest_memo = {}
+
+        def relink(ref):
+            if ref.pdf is None: # 已改写为输出文件中的对象号
+                return ref
+            key = (id(ref.pdf), ref.idnum)
+            if key not in id_map:
+                target = ref.get_object()
+                if target is None:
+                    return g.NullObject()
+                content = self._content_digest(ref, digest_memo) if is_dedup_candidate(target) else None
+                if content is not None and content[0] in self._digest_ids:
+                    id_map[key] = self._digest_ids[content[0]]
+                    self.dedup_count += 1
+                    self.dedup_saved += content[1]
+                    return g.IndirectObject(id_map[key], 0, None)
+                id_map[key] = self._allocate_id()
+                if content is None: # 非资源对象也可能在计算其他对象的哈希时得到了哈希
+                    content = digest_memo.get(key)
+                if content is not None:
+                    self._digest_ids.setdefault(content[0], id_map[key])
+                    self._id_digests[id_map[key]] = content[0]
+                pending.append((id_map[key], target))
+            return g.IndirectObject(id_map[key], 0, None)
+
+        def relink_children(obj, skip_keys=()):
+            stack = [obj]
+            while stack:
+                current = stack.pop()
+                if isinstance(current, g.DictionaryObject):
+                    items = [(k, v) for k, v in current.items() if k not in skip_keys]
+                    skip_keys = ()
+                    for key, value in items:
+                        if isinstance(value, g.IndirectObject):
+                            current[key] = relink(value)
+                        elif isinstance(value, (g.DictionaryObject, g.ArrayObject)):
+                            stack.append(value)
+                elif isinstance(current, g.ArrayObject):
+                    for idx, value in enumerate(current):
+                        if isinstance(value, g.IndirectObject):
+                            current[idx] = relink(value)
+                        elif isinstance(value, (g.DictionaryObject, g.ArrayObject)):
+                            stack.append(value)
+
+        return relink, relink_children
+
+    def _write_pending(self, pending: list, relink_children):
+        while pending:
+            obj_id, obj = pending.pop()
+            relink_children(obj)
+            self._write_object(obj_id, obj)
+
+    def add_pages(self, pages):
+        """立即写出 pages (PageObject 列表) 及其引用的所有对象。
+
+        写出过程中会就地把对象内的间接引用改写为输出文件中的对象号，
+        因此这些页面所属的 reader/writer 之后不应再被使用。
+        """
+        g = self.generic
+        id_map = {}
+        pending = []
+        relink, relink_children = self._relinker(id_map, pending)
+
+        page_objects = []
+        for page in pages:
+            ref = page.indirect_reference
+            page_id = self._allocate_id()
+            if ref is not None:
+                id_map[(id(ref.pdf), ref.idnum)] = page_id
+            page_objects.append((page_id, page))
+
+        for page_id, page in page_objects:
+            relink_children(page, skip_keys=("/Parent",))
+            page[g.NameObject("/Parent")] = g.IndirectObject(self.PAGES_ID, 0, None)
+            self._write_object(page_id, page)
+            self._write_pending(pending, relink_children)
+        # 全部写出后才登记页面；中途出错时已写出的对象不会被页面树引用
+        self._page_ids.extend(page_id for page_id, _ in page_objects)
+
+    def add_object(self, ref):
+        """立即写出 ref 所指的对象及其引用的所有对象 (与 add_pages 一样改写引用并参与去重)，
+        返回它在输出文件中的间接引用。"""
+        pending = []
+        relink, relink_children = self._relinker({}, pending)
+        new_ref = relink(ref)
+        self._write_pending(pending, relink_children)
+        return new_ref
+
+    def replace_object(self, obj_id: int, obj):
+        """(--append) 以 obj 替换原文件中的对象 obj_id。obj 中的间接引用必须已是输出文件中的对象号
+        (原文件中的对象或 add_object 的返回值)，不再改写。"""
+        self._write_object(obj_id, obj)
+
+    def add_outline_item(self, title: str, page_index: int, parent: Optional[list] = None) -> list:
+        """记录一个书签 (仅保存在内存中的轻量信息)，在 close() 时写出。返回可作为 parent 的句柄。"""
+        node = [title, page_index, []]
+        (parent[2] if parent is not None else self._outline).append(node)
+        return node
+
+    def _write_outline_level(self, nodes: list, parent_id: int, prev_id: Optional[int] = None) -> Tuple[List[int], int]:
+        """写出同一层级的书签，返回 (各书签的对象号, 可见书签总数)。prev_id 是排在第一个书签之前的已有书签。"""
+        g = self.generic
+        node_ids = [self._allocate_id() for _ in nodes]
+        visible_count = len(nodes)
+        for idx, (node_id, (title, page_index, children)) in enumerate(zip(node_ids, nodes)):
+            item = g.DictionaryObject({
+                g.NameObject("/Title"): g.TextStringObject(title),
+                g.NameObject("/Parent"): g.IndirectObject(parent_id, 0, None),
+            })
+            if 0 <= page_index < len(self._page_ids):
+                item[g.NameObject("/Dest")] = g.ArrayObject([g.IndirectObject(self._page_ids[page_index], 0, None),
+                                                             g.NameObject("/Fit")])
+            if idx > 0:
+                item[g.NameObject("/Prev")] = g.IndirectObject(node_ids[idx - 1], 0, None)
+            elif prev_id is not None:
+                item[g.NameObject("/Prev")] = g.IndirectObject(prev_id, 0, None)
+            if idx < len(nodes) - 1:
+                item[g.NameObject("/Next")] = g.IndirectObject(node_ids[idx + 1], 0, None)
+            if children:
+                child_ids, child_count = self._write_outline_level(children, node_id)
+                item[g.NameObject("/First")] = g.IndirectObject(child_ids[0], 0, None)
+                item[g.NameObject("/Last")] = g.IndirectObject(child_ids[-1], 0, None)
+                item[g.NameObject("/Count")] = g.NumberObject(child_count)
+                visible_count += child_count
+            self._write_object(node_id, item)
+        return node_ids, visible_count
+
+    def _base_object(self, obj_id: int):
+        """(--append) 原文件中对象 obj_id 的浅拷贝，修改后经 replace_object 写出。"""
+        return self.generic.DictionaryObject(self._base_reader.get_object(obj_id).items())
+
+    def close(self):
+        """写出页面树、书签、文档目录和交叉引用表。
+
+        在已有文件上继续写 (base) 时只写出有变化的对象：页面树根、新书签、书签根和原来的最后一个
+        顶层书签 (指向新书签)，只有原来没有书签时才改写文档目录。交叉引用表只列出本次写出的对象，
+        并通过 /Prev 指向原有的交叉引用表，即 PDF 的增量更新，原有内容一个字节也不改变。
+        """
+        g = self.generic
+        pages_root = g.DictionaryObject() if self._base is None else self._base_object(self.PAGES_ID)
+        pages_root.update({
+            g.NameObject("/Type"): g.NameObject("/Pages"),
+            g.NameObject("/Kids"): g.ArrayObject([g.IndirectObject(page_id, 0, None) for page_id in self._page_ids]),
+            g.NameObject("/Count"): g.NumberObject(len(self._page_ids)),
+        })
+        self._write_object(self.PAGES_ID, pages_root)
+
+        catalog = None
+        if self._base is None:
+            catalog = g.DictionaryObject({
+                g.NameObject("/Type"): g.NameObject("/Catalog"),
+                g.NameObject("/Pages"): g.IndirectObject(self.PAGES_ID, 0, None),
+            })
+        if self._outline:
+            prev_id = None
+            visible_before = 0
+            if self.outlines_id is None:
+                self.outlines_id = self._allocate_id()
+                outline_root = g.DictionaryObject({g.NameObject("/Type"): g.NameObject("/Outlines")})
+                if catalog is None:
+                    catalog = self._base_object(self.CATALOG_ID)
+                catalog[g.NameObject("/Outlines")] = g.IndirectObject(self.outlines_id, 0, None)
+            else:
+                outline_root = self._base_object(self.outlines_id)
+                prev_id = self._base.outline_ids[-1]
+                visible_before = int(outline_root.get("/Count", 0))
+            self.outline_ids, count = self._write_outline_level(self._outline, self.outlines_id, prev_id)
+            if prev_id is None:
+                outline_root[g.NameObject("/First")] = g.IndirectObject(self.outline_ids[0], 0, None)
+            else:
+                previous = self._base_object(prev_id)
+                previous[g.NameObject("/Next")] = g.IndirectObject(self.outline_ids[0], 0, None)
+                self._write_object(prev_id, previous)
+            outline_root[g.NameObject("/Last")] = g.IndirectObject(self.outline_ids[-1], 0, None)
+            outline_root[g.NameObject("/Count")] = g.NumberObject(visible_before + count)
+            self._write_object(self.outlines_id, outline_root)
+        if catalog is not None:
+            self._write_object(self.CATALOG_ID, catalog)
+
+        trailer = {g.NameObject("/Root"): g.IndirectObject(self.CATALOG_ID, 0, None)}
+        if self._base is not None:
+            trailer.update(self._base.trailer_entries(g))
+        if self._compact is not None:
+            self.startxref = self._compact.close(trailer, self._base.startxref if self._base is not None else None)
+            return
+        xref_offset = self.startxref = self.stream.tell()
+        if self._base is not None:
+            self.stream.write(b"xref\n0 1\n0000000000 65535 f \n") # 习惯上每个交叉引用表都从 0 号对象开始
+            obj_ids = sorted(self._offsets)
+            run_start = 0
+            for idx, obj_id in enumerate(obj_ids): # 每段连续的对象号写一个子节
+                if idx + 1 == len(obj_ids) or obj_ids[idx + 1] != obj_id + 1:
+                    self.stream.write(f"{obj_ids[run_start]} {idx + 1 - run_start}\n".encode())
+                    for run_id in obj_ids[run_start:idx + 1]:
+                        self.stream.write(f"{self._offsets[run_id]:010d} 00000 n \n".encode())
+                    run_start = idx + 1
+            trailer[g.NameObject("/Size")] = g.NumberObject(self._next_id)
+            trailer[g.NameObject("/Prev")] = g.NumberObject(self._base.startxref)
+            self.stream.write(b"trailer\n")
+            g.DictionaryObject(trailer).write_to_stream(self.stream, None)
+            self.stream.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+            return
+        self.stream.write(f"xref\n0 {self._next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, self._next_id):
+            if obj_id in self._offsets:
+                self.stream.write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode())
+            else: # 已分配但未写出 (写出过程中出错) 的对象号
+                self.stream.write(b"0000000000 65535 f \n")
+        self.stream.write(f"trailer\n<< /Size {self._next_id} /Root {self.CATALOG_ID} 0 R >>\n".encode())
+        self.stream.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
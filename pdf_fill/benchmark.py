@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""pdf_fill 页码相关开销的基准测试。
+
+测量内容:
+    1. 启动时间: `pdf_fill.py --help` 的耗时 (字体在第一次添加页码时才注册)。
+    2. 字体加载: 第一次计算页码布局前获取字体度量的耗时，分别在没有和已有磁盘字体度量缓存时测量。
+    3. 每页页码布局耗时: layout_page_labels 与逐 0.5pt 缩小字号、反复调用 stringWidth 的旧做法对比。
+
+用法 (与 run.sh 一样在 pdf_fill 目录下运行，以便找到 Font/ 中的字体):
+    python3 benchmark.py [--files 20] [--pages 500] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import subprocess
+import tempfile
+import argparse
+
+import pdf_fill
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+
+
+def best_of(repeat, func):
+    """执行 func repeat 次，返回最短耗时 (秒)。"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_python(code_or_args, cwd):
+    return subprocess.run([sys.executable] + code_or_args, cwd=cwd, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+
+
+def measure_startup(repeat):
+    script_dir = os.path.dirname(os.path.abspath(pdf_fill.__file__))
+    return best_of(repeat, lambda: run_python(["pdf_fill.py", "--help"], script_dir))
+
+
+def measure_font_load(cache_dir):
+    """在新进程中测量 get_label_metrics() 的耗时 (秒)。"""
+    code = (
+        "import time, pdf_fill\n"
+        f"pdf_fill.CACHE_DIR = {cache_dir!r}\n"
+        f"pdf_fill.FONT_PATH = {os.path.abspath(pdf_fill.FONT_PATH)!r}\n"
+        "start = time.perf_counter()\n"
+        "pdf_fill.get_label_metrics()\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    script_dir = os.path.dirname(os.path.abspath(pdf_fill.__file__))
+    return float(run_python(["-c", code], script_dir).strip().splitlines()[-1])
+
+
+def legacy_layout(files_metadata, total_pages, font_name):
+    """旧版的左侧页码字号计算: 每页从 10pt 开始逐 0.5pt 缩小，每一步都重新测量宽度。"""
+    sizes = []
+    global_page_idx = 0
+    for file_name, file_pages in files_metadata:
+        for page_in_file in range(1, file_pages + 1):
+            global_page_idx += 1
+            part1 = f"[ {file_name} {page_in_file}/{file_pages} ]"
+            part2 = f"[ {global_page_idx}/{total_pages} ]"
+            x_position_part2 = A4[0] - pdfmetrics.stringWidth(part2, font_name, 10) - 5 * mm
+            max_width = x_position_part2 - 5 * mm - 10 * mm
+            font_size = 10
+            width = pdfmetrics.stringWidth(part1, font_name, font_size)
+            while width > max_width and font_size > 7:
+                font_size -= 0.5
+                width = pdfmetrics.stringWidth(part1, font_name, font_size)
+            sizes.append(font_size)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pdf_fill 页码开销基准测试")
+    parser.add_argument("--files", type=int, default=20, help="模拟合并的文件数（默认 20）")
+    parser.add_argument("--pages", type=int, default=500, help="每个文件的页数（默认 500）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量重复次数，取最短耗时（默认 5）")
+    args = parser.parse_args()
+
+    print(f"[启动] pdf_fill.py --help: {measure_startup(args.repeat) * 1000:.1f} ms")
+
+    # 一半文件使用会触发缩小字号的长文件名
+    files_metadata = [(f"第{idx:03d}章_" + ("很长的文件名" * 6 if idx % 2 else "短名"), args.pages)
+                      for idx in range(args.files)]
+    total_pages = args.files * args.pages
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = measure_font_load(cache_dir)
+        warm = measure_font_load(cache_dir)
+        font_name = pdf_fill.get_stamp_font()
+        print(f"[字体] 获取字体度量: 无缓存 {cold * 1000:.1f} ms, 有缓存 {warm * 1000:.1f} ms (字体: {font_name})")
+
+        pdf_fill.CACHE_DIR = cache_dir # 不在当前目录留下字体度量缓存
+        new_time = best_of(args.repeat, lambda: pdf_fill.layout_page_labels(
+            total_pages, total_pages, input_files_metadata=files_metadata))
+    old_time = best_of(args.repeat, lambda: legacy_layout(files_metadata, total_pages, font_name))
+    print(f"[布局] {total_pages} 页: 每页 {new_time / total_pages * 1e6:.2f} µs "
+          f"(旧做法仅字号计算每页 {old_time / total_pages * 1e6:.2f} µs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,42 @@
 import os
 import sys
 import glob
-from pypdf import PdfReader, PdfWriter, Transformation
+import re
+import math
+import shutil
+import zlib
+import atexit
+import tempfile
+import time
+import traceback
+import multiprocessing.util
+from pypdf import PdfReader, PdfWriter, Transformation, generic
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject,
+                           NumberObject, StreamObject)
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from io import BytesIO
+from io import BytesIO, StringIO
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from contextlib import contextmanager, nullcontext, redirect_stderr, redirect_stdout
 
-# 注册字体
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR)) # 与 pdfinsert 共用的 pdf_common 位于仓库根目录
+from pdf_common.cache import CACHE_DIR_NAME, CACHE_MAX_BYTES, ResultCache
+from pdf_common.merge_index import MERGE_INDEX_SUFFIX, MergeIndex
+from pdf_common.pipeline import Prefetcher, WriteBehind, write_later
+from pdf_common.profiling import TraceProfiler
+from pdf_common.progress import ProgressReporter
+from pdf_common.service import WorkerService, require_params
+from pdf_common.sizes import parse_size
+from pdf_common.stdio import STDIN_NAME, STDIO_PATH, StdoutOutput, detach_stdout, read_frames, write_frame
+from pdf_common.writer import StreamingPdfWriter, add_object, deduplicate_objects, write_compact_pdf
+
+# 页码字体 (在第一次添加页码时才注册，见 get_stamp_font)
+import json
+import reportlab
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont # 用于加载 TTF 字体
 
@@ -18,39 +46,314 @@ from reportlab.pdfbase.ttfonts import TTFont # 用于加载 TTF 字体
 FONT_NAME = "LXGWWenKaiMono"
 FONT_PATH = "Font/LXGWWenKaiMono-Regular.ttf" # 相对于脚本的路径
 
-try:
-    if os.path.exists(FONT_PATH):
-        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
-    else:
-        print(f"[警告] 字体文件未找到: {os.path.abspath(FONT_PATH)}")
-        print("[信息] 将尝试回退到 STSong-Light (如果可用)。中文字符可能无法按预期显示。")
-        # 尝试回退到 STSong-Light (如果之前注册代码还在，或者 ReportLab 默认包含)
-        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-        try:
-            pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
-            FONT_NAME = 'STSong-Light' # 更新 FONT_NAME 以便后续使用
-            print("[信息] 已回退到 STSong-Light 字体。")
-        except Exception as e_stsong:
-            print(f"[警告] 未能注册 STSong-Light 作为回退字体: {e_stsong}")
-            print("[信息] 页码中文字符可能无法正确显示。")
-            FONT_NAME = 'Helvetica' # 最终回退到 Helvetica
-            print("[信息] 已最终回退到 Helvetica 字体。")
-
-except Exception as e:
-    print(f"[警告] 注册字体 {FONT_NAME} 时发生错误: {e}")
-    print("[信息] 将尝试回退到 STSong-Light 或 Helvetica。中文字符可能无法按预期显示。")
+_stamp_font_name = None # 实际注册成功的页码字体名称
+_label_metrics = None   # (字体名称, 计算字符串在 1pt 字号下宽度的函数)
+_font_warnings = True   # 是否输出字体回退的警告；子进程中关闭，由主进程在创建进程池前输出一次
+
+
+def _register_stamp_font():
+    """注册页码字体并返回实际使用的字体名称: 优先 TTF，其次 STSong-Light，最后 Helvetica。"""
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    warn = print if _font_warnings else lambda message: None
+    try:
+        if os.path.exists(FONT_PATH):
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+            return FONT_NAME
+        warn(f"[警告] 字体文件未找到: {os.path.abspath(FONT_PATH)}")
+        warn("[信息] 将尝试回退到 STSong-Light (如果可用)。中文字符可能无法按预期显示。")
+    except Exception as e:
+        warn(f"[警告] 注册字体 {FONT_NAME} 时发生错误: {e}")
+        warn("[信息] 将尝试回退到 STSong-Light 或 Helvetica。中文字符可能无法按预期显示。")
+
     try:
-        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
         pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
-        FONT_NAME = 'STSong-Light'
-        print("[信息] 已回退到 STSong-Light 字体。")
-    except:
-        FONT_NAME = 'Helvetica' # 最终回退
-        print("[信息] 已最终回退到 Helvetica 字体。")
+        warn("[信息] 已回退到 STSong-Light 字体。")
+        return 'STSong-Light'
+    except Exception as e_stsong:
+        warn(f"[警告] 未能注册 STSong-Light 作为回退字体: {e_stsong}")
+        warn("[信息] 页码中文字符可能无法正确显示。")
+        warn("[信息] 已最终回退到 Helvetica 字体。")
+        return 'Helvetica'
+
+
+def get_stamp_font():
+    """返回页码使用的已注册字体名称。
+
+    字体在第一次调用时才注册：解析多 MB 的 CJK TTF 较慢，--help、全部命中结果缓存等
+    不需要绘制页码的运行因此不必付出这部分开销。
+    """
+    global _stamp_font_name
+    if _stamp_font_name is None:
+        _stamp_font_name = _register_stamp_font()
+    return _stamp_font_name
+
+
+def font_file_token():
+    """TTF 字体文件的标识 [路径, 大小, 修改时间]；文件不存在时返回 None。用于缓存键，不会注册字体。"""
+    try:
+        stat = os.stat(FONT_PATH)
+    except OSError:
+        return None
+    return [os.path.abspath(FONT_PATH), stat.st_size, stat.st_mtime_ns]
+
+
+def _char_width_func(char_widths, default_width):
+    """由字宽表 (码位 -> 1/1000 em) 构造宽度函数，与 reportlab 的 TTFont.stringWidth 计算方式相同。"""
+    get_width = char_widths.get
+    return lambda text: 0.001 * sum(get_width(ord(ch), default_width) for ch in text)
+
+
+def get_label_metrics():
+    """返回 (字体名称, width_of)，width_of(text) 为 text 在 1pt 字号下的宽度 (宽度与字号成正比)。
+
+    TTF 字体的字宽表缓存在 CACHE_DIR 中 (以字体文件和 reportlab 版本为键)，命中时
+    计算页码布局不需要解析字体文件；回退字体自带度量数据，直接使用 pdfmetrics。
+    """
+    global _label_metrics
+    if _label_metrics is not None:
+        return _label_metrics
+
+    token = font_file_token()
+    metrics_path = os.path.join(CACHE_DIR, f"font_metrics_{FONT_NAME}.json")
+    if token is not None:
+        token.append(reportlab.Version)
+        try:
+            with open(metrics_path, encoding="utf-8") as f:
+                metrics = json.load(f)
+            if metrics["font"] == token:
+                char_widths = {int(code): width for code, width in metrics["widths"].items()}
+                _label_metrics = (FONT_NAME, _char_width_func(char_widths, metrics["default"]))
+                return _label_metrics
+        except (OSError, ValueError, KeyError):
+            pass # 没有缓存或缓存已损坏，重新解析字体
+
+    font_name = get_stamp_font()
+    if font_name == FONT_NAME:
+        face = pdfmetrics.getFont(font_name).face
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            temp_path = f"{metrics_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"font": token, "default": face.defaultWidth, "widths": face.charWidths}, f)
+            os.replace(temp_path, metrics_path)
+        except OSError as e:
+            print(f"[警告] 无法写入字体度量缓存 {metrics_path}: {e}")
+        _label_metrics = (font_name, _char_width_func(face.charWidths, face.defaultWidth))
+    else:
+        _label_metrics = (font_name, lambda text: pdfmetrics.stringWidth(text, font_name, 1))
+    return _label_metrics
+
+
+def fit_font_size(text_width_1pt, max_width, base_size, min_size, step=0.5):
+    """返回不超过 base_size、使文本宽度不超过 max_width 的最大字号 (按 step 取整)，但不小于 min_size。
+
+    文本宽度与字号成正比，因此直接由宽度预算求解，而不是逐步缩小字号反复测量。
+    """
+    if text_width_1pt * base_size <= max_width:
+        return base_size
+    fitted_size = math.floor(max_width / text_width_1pt / step) * step
+    return max(min_size, min(base_size, fitted_size))
 
 
 TOP_MARGIN_RATIO = 0.10 # 页面顶部内容预留的边距比例
 
+SHARD_SIZE = 500        # 大文件分片处理时每个分片的页数
+SHARD_THRESHOLD = 2000  # 单个文件页数超过此值 (且 --jobs > 1) 时自动按页范围分片
+
+MEMORY_ESTIMATE_FACTOR = 2.5 # 普通合并的峰值内存约为输入文件总大小的倍数 (用于 --max-memory 估算)
+
+RASTER_JPEG_QUALITY = 85 # --image-format jpeg 的默认编码质量
+RASTER_MIN_SCALE = 1.05  # 图像边长超过目标像素数的这一倍数时才重采样，避免几乎没有收益的重新编码
+# 出现这些操作符的页面含有文字、矢量图形或内嵌图像，不是纯图像页 (空的 BT/ET 不算)
+PAINTING_OPERATORS = {b"Tj", b"TJ", b"'", b'"', b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*",
+                      b"sh", b"INLINE IMAGE"}
+
+CACHE_DIR = os.path.join(SCRIPT_DIR, CACHE_DIR_NAME) # 处理结果缓存目录，与工作目录无关
+CACHE_VERSION = 1 # 页面处理逻辑改变导致输出不同时递增，使旧缓存失效
+CACHE_PARAMS = (CACHE_VERSION, TOP_MARGIN_RATIO, tuple(A4)) # 影响所有缓存条目的处理参数
+
+WATCH_INTERVAL = 1.0 # --watch 检查输入目录的间隔 (秒)
+WATCH_DEBOUNCE = 1.0 # 检测到变化后，目录需保持这么多秒不再变化才开始重建，一批同时放入的文件只重建一次
+
+
+SERVICE_SOCKET_ENV = "PDF_FILL_SOCKET" # 覆盖 --serve --socket 和客户端默认 socket 路径的环境变量
+
+PREFETCH_DEPTH = 0 # 串行处理时后台预读 (以及延后写出) 的文件数，默认关闭；输入输出在慢速磁盘上时可设为 2
+
+
+_profiler = None # 启用 --profile 时当前进程的 TraceProfiler
+_NO_PROFILE = nullcontext()
+
+
+def profile_stage(name, **args):
+    """返回记录 name 阶段耗时的上下文管理器，args 作为事件参数；未启用 --profile 时什么也不做。"""
+    if _profiler is None:
+        return _NO_PROFILE
+    return _profiler.stage(name, args)
+
+
+def profile_count(name, value=1):
+    """累加 --profile 的计数器。"""
+    if _profiler is not None:
+        _profiler.counters[name] += value
+
+
+def profile_file_read(pdf_file):
+    """把 pdf_file 的大小计入 bytes_read 计数器。"""
+    if _profiler is not None:
+        _profiler.counters["bytes_read"] += os.path.getsize(pdf_file)
+
+
+def _init_worker(parts_dir, cprofile_path):
+    """(子进程) 进程池的 initializer。
+
+    进度事件只由主进程输出，fork 出的子进程继承的 _progress 因此清除。启用 --profile 时
+    (parts_dir 非空) 为本进程创建 TraceProfiler，并在进程退出时写出事件；fork 出的子进程
+    会继承主进程的记录器及其中已有的事件，因此总是重新创建。
+    """
+    global _profiler, _progress, _font_warnings
+    _progress = None
+    _profiler = None
+    _font_warnings = False
+    if parts_dir is not None:
+        _profiler = TraceProfiler(parts_dir, cprofile_path)
+        multiprocessing.util.Finalize(None, _profiler.dump_part, exitpriority=10)
+
+
+def process_pool(jobs):
+    """创建进程池；启用 --profile 时子进程同样记录各阶段耗时。
+
+    页码字体先在主进程中注册：回退时的警告因此只输出一次，fork 出的子进程也不必各自解析字体文件。
+    """
+    get_stamp_font()
+    profile_args = (_profiler.parts_dir, _profiler.cprofile_path) if _profiler is not None else (None, None)
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=profile_args)
+
+
+_request_cleanups = None # --serve 工作进程中当前请求结束时要执行的清理函数 [(func, args), ...]
+
+
+def register_cleanup(func, *args):
+    """注册退出时执行的清理函数；在 --serve 的工作进程中改为在当前请求结束时执行。"""
+    if _request_cleanups is not None:
+        _request_cleanups.append((func, args))
+    else:
+        atexit.register(func, *args)
+
+
+def enable_profiling(trace_path, cprofile_path=None):
+    """启用 --profile: 主进程开始记录，并在退出时写出 trace 文件和汇总。"""
+    global _profiler
+    _profiler = TraceProfiler(tempfile.mkdtemp(prefix="pdf_fill_profile_"), cprofile_path, "pdf_fill")
+
+    def finish():
+        totals, counters = _profiler.write_trace(trace_path)
+        print(f"[性能] 已写出 trace: {trace_path}" + (f", cProfile: {cprofile_path}" if cprofile_path else ""))
+        if totals:
+            print("[性能] 各阶段耗时（所有进程合计）: "
+                  + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in totals.most_common()))
+        if counters:
+            print("[性能] 计数: " + ", ".join(f"{name} {value}" for name, value in sorted(counters.items())))
+    register_cleanup(finish)
+
+
+_progress = None # --progress jsonl 时主进程的 ProgressReporter
+
+
+def enable_progress(fd):
+    """启用 --progress jsonl: 进度事件写入 fd，原来输出到标准输出的文字日志全部丢弃。
+
+    在文件描述符层面把标准输出重定向到空设备 (子进程，包括以 spawn 方式启动的子进程，
+    也会继承)，因此 fd 为 1 时事件流中不会混入任何文字日志；错误和警告仍输出到标准错误。
+    在 --serve 的工作进程中则忽略 fd：事件作为本次请求的标准输出返回给客户端，文字日志丢弃。
+    """
+    global _progress
+    if _service_caches is not None:
+        _progress = ProgressReporter(sys.stdout, "pdf_fill")
+        sys.stdout = StringIO() # 请求结束时由 _service_call 恢复
+        return
+    stream = os.fdopen(os.dup(fd), "w", encoding="utf-8")
+    sys.stdout.flush()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+    _progress = ProgressReporter(stream, "pdf_fill")
+
+
+# --- 标准输入/输出与分帧流 (-, --frames) ---
+_stdout_binary = None # -o - 时保存的标准输出 (见 enable_stdout_output)
+
+
+def enable_stdout_output():
+    """-o -: 在文件描述符层面保存标准输出供写出 PDF 使用，再把标准输出指向标准错误，
+    文字日志 (包括子进程的输出) 因此不会混入 PDF 数据。需要在 enable_progress 之前调用。"""
+    global _stdout_binary
+    _stdout_binary = detach_stdout()
+
+
+def open_output(output_path):
+    """以二进制写方式打开 output_path；output_path 为 "-" 时返回标准输出 (StdoutOutput)。"""
+    if output_path == STDIO_PATH:
+        return StdoutOutput(_stdout_binary if _stdout_binary is not None else sys.stdout.buffer)
+    return open(output_path, "wb")
+
+
+def write_bytes(output_path, data):
+    with open(output_path, "wb") as f:
+        f.write(data)
+
+
+def report_io_queues(prefetcher, write_behind=None):
+    """输出预读和延后写出队列的等待时间。"""
+    parts = []
+    if prefetcher is not None:
+        parts.append(f"{prefetcher.count} 个文件，等待读取 {prefetcher.wait_seconds:.2f} 秒")
+    if write_behind is not None:
+        parts.append(f"延后写出 {write_behind.count} 个文件，等待写出队列 {write_behind.wait_seconds:.2f} 秒")
+    if parts:
+        print(f"[预读] {'；'.join(parts)}")
+
+
+def prefetch_reader(pdf_file, cache=None, resident=None):
+    """(预读线程) 读入 pdf_file 并解析页面树，返回 (PdfReader, 页数, 读入的字节数)。
+
+    给定 cache 时顺便用读入的内容计算缓存键需要的内容哈希 (见 ResultCache.remember)；
+    resident 中已有该文件调整后的页面时不需要读取，返回 None。
+    """
+    if resident is not None and resident.get(pdf_file) is not None:
+        return None
+    with profile_stage("prefetch", file=os.path.basename(pdf_file)):
+        with open(pdf_file, "rb") as f:
+            data = f.read()
+        if cache is not None:
+            cache.remember(pdf_file, data)
+        reader = PdfReader(BytesIO(data))
+        return reader, len(reader.pages), len(data)
+
+
+@contextmanager
+def prefetch_pipeline(input_files, prefetch, load, write_behind=False):
+    """按顺序产出 (文件, load 的结果) 的迭代器以及延后写出队列 (write_behind 为 False 时为 None)。
+
+    prefetch 为 0 时 load 的结果总是 None、没有延后写出队列，与不预读时完全一样。
+    退出时等待全部写出完成并输出队列等待时间。
+    """
+    if prefetch <= 0:
+        yield ((pdf_file, None) for pdf_file in input_files), None
+        return
+    prefetcher = Prefetcher(input_files, load, prefetch, profile_stage)
+    writes = WriteBehind(prefetch, profile_stage) if write_behind else None
+    try:
+        yield prefetcher, writes
+    finally:
+        prefetcher.close()
+        try:
+            if writes is not None:
+                writes.close()
+                writes.raise_failures()
+        finally:
+            report_io_queues(prefetcher, writes)
+
 
 def resize_and_position_page(page):
     """调整 PDF 页面尺寸：宽度铺满 A4，高度等比缩放，内容顶部对齐（约偏移10%）。"""
@@ -78,7 +381,190 @@ def resize_and_position_page(page):
     return page
 
 
-def add_page_numbers(writer, total_global_pages, input_files_metadata=None, single_file_name=None):
+_service_caches = None # --serve 工作进程中常驻的 ResultCache: {(目录绝对路径, 大小上限): ResultCache}
+
+
+def open_result_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """返回处理结果缓存。
+
+    在 --serve 的工作进程中同一目录复用同一个实例，已计算的输入文件哈希在请求之间保留；
+    命中/未命中计数每次重新开始，使每个请求的统计与单独运行时一致。
+    """
+    if _service_caches is None:
+        return ResultCache(cache_dir, max_bytes, CACHE_PARAMS)
+    key = (os.path.abspath(cache_dir), max_bytes)
+    if key not in _service_caches:
+        _service_caches[key] = ResultCache(key[0], max_bytes, CACHE_PARAMS)
+    cache = _service_caches[key]
+    cache.hits = cache.misses = 0
+    return cache
+
+
+def resized_pages(reader, pdf_file, page_start, page_end, cache=None):
+    """返回 reader 中 [page_start, page_end) 经 resize_and_position_page 调整后的页面列表。
+
+    给定 cache 时先按 (文件内容, 页范围) 查找之前调整好的页面；未命中时调整后写入缓存。
+    这些页面还没有页码，合并时全局页码在组装之后统一添加，因此在其他文件增删后仍可复用。
+    """
+    profile_count("pages", page_end - page_start)
+    with profile_stage("resize", file=os.path.basename(pdf_file), pages=page_end - page_start):
+        if cache is None:
+            return [resize_and_position_page(reader.pages[page_idx]) for page_idx in range(page_start, page_end)]
+
+        key = cache.key(pdf_file, "resized", page_start, page_end)
+        cached_path = cache.get(key)
+        if cached_path is not None:
+            return list(PdfReader(cached_path).pages)
+
+        part = PdfWriter()
+        for page_idx in range(page_start, page_end):
+            part.add_page(resize_and_position_page(reader.pages[page_idx]))
+        packet = BytesIO()
+        part.write(packet)
+        cache.put(key, packet.getvalue())
+        return list(part.pages)
+
+
+class ResidentPages:
+    """--watch 常驻运行时保留在内存中的各输入文件调整尺寸后的页面。
+
+    以 (路径, 大小, 修改时间) 为键，文件变化后自然失效；PdfWriter.add_page 会复制页面，
+    因此同一组页面可以在每次重建时加入新的 writer。页码在组装后添加，不影响这些页面。
+    """
+
+    def __init__(self):
+        self._entries = {} # 路径 -> ((大小, 修改时间), 页面列表)
+
+    def get(self, pdf_file):
+        stat = os.stat(pdf_file)
+        entry = self._entries.get(os.path.abspath(pdf_file))
+        if entry is not None and entry[0] == (stat.st_size, stat.st_mtime_ns):
+            return entry[1]
+        return None
+
+    def put(self, pdf_file, pages):
+        stat = os.stat(pdf_file)
+        self._entries[os.path.abspath(pdf_file)] = ((stat.st_size, stat.st_mtime_ns), pages)
+
+    def prune(self, input_files):
+        """丢弃不在 input_files 中的文件 (已删除或改名) 的页面。"""
+        keep = {os.path.abspath(f) for f in input_files}
+        for path in [path for path in self._entries if path not in keep]:
+            del self._entries[path]
+
+
+_shared_pages = None # 批量运行 (batch/pdf_batch.py) 时同一组任务共用的 ResidentPages
+
+
+def share_inputs(enabled=True):
+    """(批量运行的工作进程) 开始或结束一组输入相同的任务。
+
+    开始后本进程中的合并 (串行、非流式) 把各输入文件调整尺寸后的页面保留在内存中，
+    同一组中后面的任务直接复用，不再重新解析；结束时释放这些页面。
+    """
+    global _shared_pages
+    _shared_pages = ResidentPages() if enabled else None
+
+
+STAMP_FONT_PREFIX = "PN" # 页码字体在页面资源中的名称前缀，避免与页面自身字体冲突
+
+
+def stamp_text_on_pages(writer, pages_draws, font_name):
+    """直接在页面内容流中追加文本绘制指令。
+
+    所有文本先通过同一个 reportlab 画布编码，该画布只保存并解析一次，得到一份覆盖
+    本次所有字形的字体子集；字体对象只加入 writer 一次，由所有页面共同引用。
+    页面原有内容不会被解析。
+
+    参数:
+        writer: PdfWriter 对象。
+        pages_draws: 与 writer.pages 一一对应的列表，每项为 [(文本, 字号, x, y), ...]。
+        font_name: 已注册的 reportlab 字体名称。
+    """
+    stamps, host_fonts = encode_stamps(pages_draws, font_name)
+    shared_fonts = {name: font_ref.get_object().clone(writer).indirect_reference
+                    for name, font_ref in host_fonts.items()}
+    apply_stamps(writer, writer.pages, stamps, shared_fonts)
+
+
+def encode_stamps(pages_draws, font_name):
+    """把每页的 [(文本, 字号, x, y), ...] 编码为页码内容流数据。
+
+    返回 (stamps, fonts)：stamps 与 pages_draws 一一对应，每项是一页的内容流数据 (以 "Q" 开头，
+    恢复页面原有内容之前保存的图形状态)；fonts 是 {页面资源中的字体名: 字体对象的间接引用}，
+    字体对象属于临时画布的 reader，由调用方复制到输出中。
+    """
+    host_packet = BytesIO()
+    host_canvas = canvas.Canvas(host_packet, pagesize=A4)
+    page_codes = []
+    for page_draws in pages_draws:
+        codes = []
+        for text, font_size, x, y in page_draws:
+            text_object = host_canvas.beginText(x, y)
+            text_object.setFont(font_name, font_size)
+            text_object.textOut(text)
+            codes.append(text_object.getCode())
+        page_codes.append("\n".join(codes))
+    host_canvas.showPage()
+    host_canvas.save()
+
+    # 整个运行只解析这一次，取出画布上用到的全部字体 (TTF 子集在此时才生成)
+    host_packet.seek(0)
+    host_fonts = PdfReader(host_packet).pages[0]["/Resources"]["/Font"].get_object()
+    fonts = {NameObject(f"/{STAMP_FONT_PREFIX}{rl_name[1:]}"): font_ref for rl_name, font_ref in host_fonts.items()}
+
+    font_name_pattern = re.compile(r"/(F\d+(?:\+\d+)?) ")
+    stamps = [b"\nQ\n" + font_name_pattern.sub(lambda m: f"/{STAMP_FONT_PREFIX}{m.group(1)} ", code).encode("latin-1")
+              + b"\n" for code in page_codes]
+    return stamps, fonts
+
+
+def apply_stamps(writer, pages, stamps, shared_fonts):
+    """把 encode_stamps 得到的页码内容流追加到 pages (属于 writer) 的内容之后。
+
+    页面原有内容前插入一个所有页面共用的 "q" 流，使页码不受页面内容遗留的图形状态影响；
+    shared_fonts ({字体名: 间接引用}) 加入每页的字体资源。资源字典和字体字典不在原处修改，
+    而是换成加入了页码字体的副本；原来共用同一资源字典的页面共用同一个副本。
+    """
+    push_stream = DecodedStreamObject()
+    push_stream.set_data(b"q\n")
+    push_ref = add_object(writer, push_stream) # 所有页面共用的 "q" 流
+    stamped_resources = {} # 原资源字典的对象号 -> 副本的间接引用
+
+    for page, stamp in zip(pages, stamps):
+        stamp_stream = DecodedStreamObject()
+        stamp_stream.set_data(stamp)
+        stamp_ref = add_object(writer, stamp_stream)
+
+        resources_ref = page.raw_get("/Resources") if "/Resources" in page else None
+        shared = isinstance(resources_ref, IndirectObject)
+        if not shared or resources_ref.idnum not in stamped_resources:
+            resources = DictionaryObject(resources_ref.get_object().items() if resources_ref is not None else ())
+            fonts = DictionaryObject(resources["/Font"].items() if "/Font" in resources else ())
+            fonts.update(shared_fonts)
+            resources[NameObject("/Font")] = fonts
+            if shared:
+                stamped_resources[resources_ref.idnum] = add_object(writer, resources)
+            else:
+                page[NameObject("/Resources")] = resources
+        if shared:
+            page[NameObject("/Resources")] = stamped_resources[resources_ref.idnum]
+
+        contents = page.get(NameObject("/Contents"))
+        if contents is None:
+            new_contents = ArrayObject()
+        elif isinstance(contents.get_object(), ArrayObject):
+            new_contents = ArrayObject([push_ref, *contents.get_object()])
+        else:
+            if not isinstance(contents, IndirectObject):
+                contents = add_object(writer, contents)
+            new_contents = ArrayObject([push_ref, contents])
+        new_contents.append(stamp_ref)
+        page[NameObject("/Contents")] = new_contents
+
+
+def add_page_numbers(writer, total_global_pages, input_files_metadata=None, single_file_name=None,
+                     global_page_offset=0, first_file_global_start=None):
     """
     将复杂的页码添加到 writer 对象的每一页。
     格式: [ 原始文件名 文件内页码/文件内总页数 ] [ 全局页码/全局总页数 ]
@@ -89,18 +575,39 @@ def add_page_numbers(writer, total_global_pages, input_files_metadata=None, sing
         input_files_metadata: 用于合并PDF时。一个元组列表，每个元组为 (原始文件基本名, 该文件的页数)。
                               例如: [("文件A", 10), ("文件B", 5)]
         single_file_name: 用于处理单个PDF时。该PDF文件的基本名。
+        global_page_offset: writer 第一页在最终输出中的全局索引 (0-based)。
+                            并行合并时每个进程只处理其中一个文件，借此保持全局页码不变。
+        first_file_global_start: input_files_metadata 中第一个文件的第一页在最终输出中的全局索引，
+                                 默认等于 global_page_offset；按页范围分片时 writer 可能从文件中间开始。
+    """
+    with profile_stage("layout_labels", pages=len(writer.pages)):
+        page_labels = layout_page_labels(len(writer.pages), total_global_pages, input_files_metadata,
+                                         single_file_name, global_page_offset, first_file_global_start)
+    if page_labels is not None:
+        with profile_stage("stamp", pages=len(page_labels)):
+            stamp_text_on_pages(writer, page_labels, get_stamp_font())
+        profile_count("overlays", len(page_labels))
+
+
+def layout_page_labels(page_count, total_global_pages, input_files_metadata=None, single_file_name=None,
+                       global_page_offset=0, first_file_global_start=None):
+    """计算 page_count 页的页码文本、字号和位置，返回 [[(文本, 字号, x, y), ...], ...]；信息不足时返回 None。
+
+    参数含义同 add_page_numbers。只使用字体度量数据 (见 get_label_metrics)，不涉及 PDF 对象。
+    文件名部分和总页数部分的宽度对每个文件只计算一次，每页只需再加上页码数字的宽度。
     """
-    
     file_info_iter = None
     current_file_name = None
     current_file_total_pages = 0
     # 追踪当前原始文件在全局页面中的起始索引 (0-based)
-    current_original_file_global_start_idx = 0
+    if first_file_global_start is None:
+        first_file_global_start = global_page_offset
+    current_original_file_global_start_idx = first_file_global_start
 
     if input_files_metadata:  # 合并PDF模式
         if not input_files_metadata: # 正常调用不应发生此情况
             print("[警告] add_page_numbers 在合并模式下被调用，但未提供元数据。")
-            return
+            return None
         file_info_iter = iter(input_files_metadata)
         current_file_name, current_file_total_pages = next(file_info_iter, (None, 0))
     elif single_file_name:  # 单个PDF模式
@@ -108,9 +615,23 @@ def add_page_numbers(writer, total_global_pages, input_files_metadata=None, sing
         current_file_total_pages = total_global_pages # 对于单个文件，其总页数即为全局总页数
     else:
         print("[警告] add_page_numbers 调用时未获得足够的页码信息。")
-        return # 或者可以回退到更简单的页码格式
+        return None # 或者可以回退到更简单的页码格式
 
-    for global_page_idx in range(total_global_pages):  # global_page_idx 是 0-indexed
+    width_of = get_label_metrics()[1] # 计算 1pt 字号下的字符串宽度
+    base_font_size = 10            # 基础字体大小 (原为 8)
+    min_font_size_part1 = 7        # 左侧部分页码的最小字体大小 (原为 5)
+    
+    y_position = 7 * mm 
+    left_margin_part1 = 10 * mm # 左侧部分页码的左边距 (从 5mm 增加)
+    right_margin_part2 = 5 * mm     # 右侧部分页码的右边距
+    gap_between_parts = 5 * mm      # 两部分页码之间的最小期望间隙
+
+    pages_draws = [] # 每页需要绘制的文本: [(文本, 字号, x, y), ...]
+    part1_fixed_widths = {} # (文件名, 文件总页数) -> "[ 文件名 " 与 "/总页数 ]" 的宽度之和
+    part2_fixed_width = width_of("[ ") + width_of(f"/{total_global_pages} ]")
+
+    last_global_page_idx = global_page_offset + page_count
+    for global_page_idx in range(global_page_offset, last_global_page_idx):  # global_page_idx 是 0-indexed
         page_in_original_file = 0
 
         if input_files_metadata:  # 合并PDF模式：确定当前原始文件及其中的页码
@@ -143,157 +664,1359 @@ def add_page_numbers(writer, total_global_pages, input_files_metadata=None, sing
         else:
             page_text_part1 = f"[ {current_file_name} {page_in_original_file}/{current_file_total_pages} ]"
         
-        packet = BytesIO()
-        c = canvas.Canvas(packet, pagesize=A4)
-        
-        base_font_name = FONT_NAME # 使用注册的字体名称
-        base_font_size = 10            # 基础字体大小 (原为 8)
-        min_font_size_part1 = 7        # 左侧部分页码的最小字体大小 (原为 5)
-        
-        y_position = 7 * mm 
-        left_margin_part1 = 10 * mm # 左侧部分页码的左边距 (从 5mm 增加)
-        right_margin_part2 = 5 * mm     # 右侧部分页码的右边距
-        gap_between_parts = 5 * mm      # 两部分页码之间的最小期望间隙
+        page_draws = []
 
         # 第二部分 (右对齐) - 首先计算其属性
-        c.setFont(base_font_name, base_font_size)
-        text_width_part2 = c.stringWidth(page_text_part2, base_font_name, base_font_size)
+        text_width_part2 = (part2_fixed_width + width_of(str(global_page_idx + 1))) * base_font_size
         x_position_part2 = A4[0] - text_width_part2 - right_margin_part2
         
         # 第一部分 (左对齐)
         if page_text_part1:
-            current_font_size_part1 = base_font_size
-            c.setFont(base_font_name, current_font_size_part1)
-            text_width_part1 = c.stringWidth(page_text_part1, base_font_name, current_font_size_part1)
+            fixed_key = (current_file_name, current_file_total_pages)
+            if fixed_key not in part1_fixed_widths:
+                part1_fixed_widths[fixed_key] = (width_of(f"[ {current_file_name} ")
+                                                 + width_of(f"/{current_file_total_pages} ]"))
+            text_width_part1_1pt = part1_fixed_widths[fixed_key] + width_of(str(page_in_original_file))
             
             # 第一部分允许的最大宽度是到第二部分开始前，减去间隙和其自身的边距
             max_allowed_width_for_part1 = (x_position_part2 - gap_between_parts) - left_margin_part1
             
-            # 如果第一部分太宽，则动态减小其字体大小
-            while text_width_part1 > max_allowed_width_for_part1 and current_font_size_part1 > min_font_size_part1:
-                current_font_size_part1 -= 0.5 # 减小字体大小
-                c.setFont(base_font_name, current_font_size_part1)
-                text_width_part1 = c.stringWidth(page_text_part1, base_font_name, current_font_size_part1)
+            # 如果第一部分太宽，则直接求出能放下的最大字号 (以 0.5pt 为步长，不小于最小字号)
+            current_font_size_part1 = fit_font_size(text_width_part1_1pt, max_allowed_width_for_part1,
+                                                    base_font_size, min_font_size_part1)
             
-            if text_width_part1 > max_allowed_width_for_part1 and current_font_size_part1 <= min_font_size_part1:
+            if text_width_part1_1pt * current_font_size_part1 > max_allowed_width_for_part1:
                 print(f"[警告] 页码左侧部分过长，即使已缩小至最小字体 ({min_font_size_part1}pt)，仍可能显示不全或与右侧重叠: '{page_text_part1[:30]}...'")
             
-            c.setFont(base_font_name, current_font_size_part1) # 确保设置了正确的字体大小
-            c.drawString(left_margin_part1, y_position, page_text_part1)
+            page_draws.append((page_text_part1, current_font_size_part1, left_margin_part1, y_position))
 
         # 绘制第二部分 (使用基础字体大小)
-        c.setFont(base_font_name, base_font_size)
-        c.drawString(x_position_part2, y_position, page_text_part2)
-        
-        c.save()
+        page_draws.append((page_text_part2, base_font_size, x_position_part2, y_position))
+        pages_draws.append(page_draws)
 
-        packet.seek(0)
-        watermark = PdfReader(packet)
-        watermark_page = watermark.pages[0]
+    return pages_draws
 
-        page_to_modify = writer.pages[global_page_idx]
-        page_to_modify.merge_page(watermark_page)
 
+def page_range_shards(page_count, shard_size=SHARD_SIZE, shard_threshold=SHARD_THRESHOLD):
+    """将页数为 page_count 的文件划分为 [(起始页, 结束页), ...] (左闭右开)。
 
-def process_pdf(input_path, output_path, add_nums=True):
-    """处理单个 PDF 文件。"""
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
+    页数不超过 shard_threshold 时不分片，整个文件作为一个范围返回。
+    """
+    if page_count <= shard_threshold or shard_size <= 0:
+        return [(0, page_count)]
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+
+def build_page_range(pdf_file, page_start, page_end, total_pages, file_global_start=0, merged=False,
+                     add_nums=True, cache=None, reader=None):
+    """调整 pdf_file 中 [page_start, page_end) 的页面并添加页码，返回包含这些页面的 PdfWriter。
+
+    total_pages 是最终输出的总页数，file_global_start 是该文件第一页在最终输出中的全局索引；
+    merged 为 True 时使用合并模式的页码格式。cache 用于复用调整尺寸后的页面 (见 resized_pages)。
+    reader 是已经解析好的 pdf_file (预读)，给定时不再读取文件。
+    """
+    base_name = os.path.splitext(os.path.basename(pdf_file))[0]
+    with profile_stage("file", file=base_name, page_start=page_start, page_end=page_end):
+        if reader is None:
+            with profile_stage("parse", file=base_name):
+                reader = PdfReader(pdf_file)
+            profile_file_read(pdf_file)
+        file_page_count = len(reader.pages)
+        writer = PdfWriter()
+        for page in resized_pages(reader, pdf_file, page_start, page_end, cache):
+            writer.add_page(page)
+
+        if add_nums and writer.pages:
+            if merged:
+                add_page_numbers(writer, total_pages, input_files_metadata=[(base_name, file_page_count)],
+                                 global_page_offset=file_global_start + page_start,
+                                 first_file_global_start=file_global_start)
+            else:
+                add_page_numbers(writer, total_pages, single_file_name=base_name, global_page_offset=page_start)
+    return writer
 
-    for page in reader.pages:
-        modified_page = resize_and_position_page(page)
-        writer.add_page(modified_page)
 
-    if add_nums: # 如果需要添加页码
+def _process_page_range(pdf_file, page_start, page_end, total_pages, file_global_start=0, merged=False,
+                        add_nums=True, cache=None):
+    """(子进程) 同 build_page_range，但返回序列化后的 PDF 字节以便传回主进程，
+    以及本次调用产生的缓存命中/未命中数 (子进程中的计数不会自动回到主进程)。"""
+    hits_before, misses_before = (cache.hits, cache.misses) if cache else (0, 0)
+    writer = build_page_range(pdf_file, page_start, page_end, total_pages, file_global_start, merged,
+                              add_nums, cache)
+    packet = BytesIO()
+    with profile_stage("write", target="part"):
+        writer.write(packet)
+    if cache is None:
+        return packet.getvalue(), 0, 0
+    return packet.getvalue(), cache.hits - hits_before, cache.misses - misses_before
+
+
+def _count_pages(pdf_file):
+    """(子进程) 返回 PDF 文件的页数。"""
+    with profile_stage("count_pages", file=os.path.basename(pdf_file)):
+        return len(PdfReader(pdf_file).pages)
+
+
+def process_pdf(input_path, output_path, add_nums=True, jobs=1, shard_size=SHARD_SIZE,
+                shard_threshold=SHARD_THRESHOLD, cache=None, compact=False, reader=None, write_behind=None):
+    """处理单个 PDF 文件。
+
+    jobs 大于 1 且页数超过 shard_threshold 时，按 shard_size 页一段拆分，
+    各分片在进程池中并行处理后再按顺序拼接，页码仍按整个文件连续编号。
+    给定 cache 时，内容和参数都未变化的文件直接复制上次的输出。
+    compact 为 True 时以紧凑格式写出 (见 write_compact_pdf)。
+    reader 是已经解析好的 input_path (预读)；给定 write_behind 时输出文件和缓存条目在后台写入。
+    """
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    if _progress is not None:
+        _progress.file_started(input_path)
+    with profile_stage("file", file=base_name):
+        if cache is not None:
+            cache_key = cache.key(input_path, "processed", base_name, add_nums, FONT_NAME, font_file_token(),
+                                  compact)
+            cached_path = cache.get(cache_key)
+            if cached_path is not None:
+                write_later(write_behind, base_name, shutil.copyfile, cached_path, output_path)
+                if _progress is not None:
+                    _progress.written(output_path, os.path.getsize(cached_path))
+                    _progress.file_finished(input_path, output=output_path, cached=True)
+                return output_path
+
+        if reader is None:
+            with profile_stage("parse", file=base_name):
+                reader = PdfReader(input_path)
+            profile_file_read(input_path)
         num_pages = len(reader.pages)
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        add_page_numbers(writer, num_pages, single_file_name=base_name)
+        writer = PdfWriter()
+        shards = page_range_shards(num_pages, shard_size, shard_threshold) if jobs > 1 else [(0, num_pages)]
+
+        if len(shards) > 1:
+            print(f"[分片] {os.path.basename(input_path)}: {num_pages} 页拆分为 {len(shards)} 个分片并行处理")
+            worker = partial(_process_page_range, input_path, total_pages=num_pages, add_nums=add_nums)
+            with process_pool(jobs) as pool:
+                for (page_start, page_end), (part, _, _) in zip(shards, pool.map(worker, *zip(*shards))):
+                    with profile_stage("merge", file=base_name):
+                        for page in PdfReader(BytesIO(part)).pages:
+                            writer.add_page(page)
+                    if _progress is not None:
+                        _progress.pages(input_path, page_end - page_start, num_pages)
+        else:
+            for page in resized_pages(reader, input_path, 0, num_pages):
+                writer.add_page(page)
+
+            if add_nums: # 如果需要添加页码
+                add_page_numbers(writer, num_pages, single_file_name=base_name)
+
+        write_pdf(writer, output_path, compact, write_behind)
+        if cache is not None:
+            write_later(write_behind, base_name, cache.put, cache_key, output_path)
+    if _progress is not None:
+        _progress.file_finished(input_path, num_pages, output=output_path)
 
+    return output_path
+
+
+def _process_pdf_worker(input_path, output_path, cache=None, compact=False):
+    """(子进程) 执行 process_pdf，并返回本次调用产生的缓存命中/未命中数。"""
+    if cache is None:
+        return process_pdf(input_path, output_path, compact=compact), 0, 0
+    hits_before, misses_before = cache.hits, cache.misses
+    output_path = process_pdf(input_path, output_path, cache=cache, compact=compact)
+    return output_path, cache.hits - hits_before, cache.misses - misses_before
+
+
+def report_dedup(merged_count, saved_bytes):
+    if merged_count:
+        print(f"[去重] 合并 {merged_count} 个重复的资源对象，节省 {saved_bytes / 1024 ** 2:.2f} MB")
+    else:
+        print("[去重] 未发现重复的资源对象")
+
+
+def write_pdf(writer, output_path, compact=False, write_behind=None):
+    """把 PdfWriter 写出到 output_path；compact 为 True 时使用紧凑格式 (write_compact_pdf)。
+
+    给定 write_behind 时在当前线程序列化到内存 (序列化会修改 writer)，写入文件交给 write_behind 完成。
+    output_path 为 "-" 时写到标准输出。
+    """
+    if output_path == STDIO_PATH:
+        write_behind = None
+    target = open_output(output_path) if write_behind is None else BytesIO()
+    with profile_stage("write", file=os.path.basename(output_path), compact=compact), target as f:
+        if compact:
+            write_compact_pdf(writer, f)
+        else:
+            writer.write(f)
+        if write_behind is not None:
+            write_behind.submit(os.path.basename(output_path), write_bytes, output_path, f.getvalue())
+        profile_count("bytes_written", f.tell())
+        if _progress is not None:
+            _progress.written(output_path, f.tell())
+
+
+def estimate_merge_memory(input_files):
+    """粗略估算普通 (非流式) 合并的峰值内存。"""
+    return int(sum(os.path.getsize(f) for f in input_files) * MEMORY_ESTIMATE_FACTOR)
+
+
+def add_file_bookmarks(writer, files_metadata):
+    """按 files_metadata ([(书签名, 页数), ...]) 的顺序为每个非空文件添加一个指向其第一页的书签。
+
+    pypdf 的 add_outline_item 在 parent 为 None 时每次都要在 writer 的全部对象中线性查找书签根，
+    逐个添加的总耗时与书签数 × 对象数成正比；这里只查找一次并作为 parent 传入。
+    书签在全部页面加入之后添加，因此指向页面对象而不是页索引。
+    """
+    parent = writer.get_outline_root() if isinstance(writer, PdfWriter) else None
+    page_index = 0
+    for bookmark_name, page_count in files_metadata:
+        if page_count:
+            writer.add_outline_item(bookmark_name, page_index, parent=parent) # 书签指向该文件的第一页
+        page_index += page_count
+
+
+def merge_pdfs(input_files, output_path, jobs=1, shard_size=SHARD_SIZE, shard_threshold=SHARD_THRESHOLD,
+               streaming=False, cache=None, compact=False, resident=None, prefetch=PREFETCH_DEPTH):
+    """合并多个 PDF 文件，添加书签和页码。
+
+    各页面经 resize_and_position_page 调整后直接加入最终的 writer，页数取自源 reader，
+    在最终 writer.write 之前不会写入任何中间文件。
+
+    jobs 大于 1 时，各文件的尺寸调整在进程池中并行完成 (每个输入只解析一次，页数随结果传回)，
+    再按输入顺序组装，页码和书签在主进程中统一添加，结果与串行合并一致。
+    页数超过 shard_threshold 的文件还会按 shard_size 页拆分为多个任务。
+
+    streaming 为 True 时使用 StreamingPdfWriter 逐个文件写出，峰值内存只取决于最大的单个输入；
+    每个文件各自嵌入一份页码字体子集。并行流式合并时各部分先写入临时目录，页码字体只写出一份。
+
+    cache 用于复用各文件调整尺寸后的页面，页码总是在组装时重新添加。
+    compact 为 True 时以紧凑格式写出 (对象流 + 交叉引用流，见 CompactObjectWriter)。
+    resident (ResidentPages) 在串行、非流式合并时把调整后的页面保留在内存中，供 --watch 的下一次重建使用。
+    prefetch 大于 0 时串行合并在后台线程中预读并解析接下来的 prefetch 个文件 (见 Prefetcher)。
+    返回各输入文件的页数 (按 input_files 的顺序)，供 --append 建立索引时使用。
+    """
+    if jobs > 1:
+        return _merge_pdfs_parallel(input_files, output_path, jobs, shard_size, shard_threshold, streaming, cache,
+                                    compact)
+    if streaming:
+        return _merge_pdfs_streaming(input_files, output_path, cache, compact, prefetch)
+
+    load = partial(prefetch_reader, cache=cache, resident=resident)
+    with prefetch_pipeline(input_files, prefetch, load) as (entries, _):
+        writer, files_metadata = _assemble_pages(entries, cache, resident)
+    _write_merged(writer, files_metadata, output_path, compact)
+    return [page_count for _, page_count in files_metadata]
+
+
+def _assemble_pages(entries, cache=None, resident=None):
+    """串行合并的组装阶段: 按顺序把各文件调整尺寸后的页面加入一个新的 PdfWriter。
+
+    entries 按顺序产出 (文件, 预读结果)，预读结果为 (PdfReader, 页数, 字节数) 或 None (此时读取该文件)。
+    返回 (writer, [(书签名, 页数), ...])。
+    """
+    writer = PdfWriter()
+    files_metadata = []
+    for pdf_file, prefetched in entries:
+        bookmark_name = os.path.splitext(os.path.basename(pdf_file))[0]
+        if _progress is not None:
+            _progress.file_started(pdf_file)
+        with profile_stage("file", file=bookmark_name):
+            pages = resident.get(pdf_file) if resident is not None else None
+            if pages is None:
+                if prefetched is not None:
+                    reader, page_count, nbytes = prefetched
+                    profile_count("bytes_read", nbytes)
+                else:
+                    with profile_stage("parse", file=bookmark_name):
+                        reader = PdfReader(pdf_file)
+                        page_count = len(reader.pages)
+                    profile_file_read(pdf_file)
+
+                pages = resized_pages(reader, pdf_file, 0, page_count, cache)
+                if resident is not None:
+                    resident.put(pdf_file, pages)
+            page_count = len(pages)
+            with profile_stage("merge", file=bookmark_name, pages=page_count):
+                for page in pages:
+                    writer.add_page(page)
+
+        files_metadata.append((bookmark_name, page_count))
+        if _progress is not None:
+            _progress.file_finished(pdf_file, page_count)
+    return writer, files_metadata
+
+
+def _write_merged(writer, files_metadata, output_path, compact=False):
+    """串行合并的收尾: 添加书签和全局页码，去重后写出到 output_path。"""
+    with profile_stage("outline", count=len(files_metadata)):
+        add_file_bookmarks(writer, files_metadata)
+
+    # 为最终合并的 PDF 添加页码
+    if _progress is not None:
+        _progress.stage("write")
+    add_page_numbers(writer, sum(page_count for _, page_count in files_metadata),
+                     input_files_metadata=files_metadata)
+
+    with profile_stage("dedup"):
+        dedup_result = deduplicate_objects(writer)
+    report_dedup(*dedup_result)
+    write_pdf(writer, output_path, compact)
+
+
+def _merge_pdfs_streaming(input_files, output_path, cache=None, compact=False, prefetch=PREFETCH_DEPTH):
+    """merge_pdfs 的流式实现: 每次只在内存中保留一个输入文件 (预读时另加 prefetch 个)。"""
+    # 先统计页数 (只读取页面树)，全局页码需要预先知道总页数
+    page_counts = [_count_pages(pdf_file) for pdf_file in input_files]
+    total_pages = sum(page_counts)
+
+    with open_output(output_path) as f:
+        writer = StreamingPdfWriter(f, generic, compact)
+        nonempty_files = [(pdf_file, page_count) for pdf_file, page_count in zip(input_files, page_counts)
+                          if page_count]
+        load = lambda entry: prefetch_reader(entry[0], cache)
+        with prefetch_pipeline(nonempty_files, prefetch, load) as (entries, _):
+            for (pdf_file, page_count), prefetched in entries:
+                bookmark_name = os.path.splitext(os.path.basename(pdf_file))[0]
+                reader = None
+                if prefetched is not None:
+                    reader, _, nbytes = prefetched
+                    profile_count("bytes_read", nbytes)
+                if _progress is not None:
+                    _progress.file_started(pdf_file)
+                writer.add_outline_item(bookmark_name, len(writer)) # 书签指向该文件的第一页
+                part = build_page_range(pdf_file, 0, page_count, total_pages, file_global_start=len(writer),
+                                        merged=True, cache=cache, reader=reader)
+                with profile_stage("merge", file=bookmark_name, pages=page_count):
+                    writer.add_pages(part.pages)
+                if _progress is not None:
+                    _progress.file_finished(pdf_file, page_count)
+        if _progress is not None:
+            _progress.stage("write")
+        with profile_stage("write", file=os.path.basename(output_path), compact=compact):
+            writer.close()
+        profile_count("bytes_written", f.tell())
+        if _progress is not None:
+            _progress.written(output_path, f.tell())
+    report_dedup(writer.dedup_count, writer.dedup_saved)
+    return page_counts
+
+
+def _resize_page_range(pdf_file, page_start=0, page_end=None, cache=None, max_pages=None, spool_dir=None):
+    """(子进程) 并行合并的任务: 调整 pdf_file 中 [page_start, page_end) 的页面尺寸，不添加页码。
+
+    page_end 为 None 时到文件末尾。返回 (part, 文件页数, 缓存命中数, 未命中数)：part 是这些页面序列化后的
+    PDF 字节，给定 spool_dir 时改为写入其中的临时文件的路径。文件页数超过 max_pages 时不调整，
+    part 为 None，由主进程按页范围分片后重新提交。
+    """
+    hits_before, misses_before = (cache.hits, cache.misses) if cache else (0, 0)
+    base_name = os.path.splitext(os.path.basename(pdf_file))[0]
+    with profile_stage("file", file=base_name, page_start=page_start):
+        with profile_stage("parse", file=base_name):
+            reader = PdfReader(pdf_file)
+            page_count = len(reader.pages)
+        profile_file_read(pdf_file)
+        if max_pages is not None and page_count > max_pages:
+            return None, page_count, 0, 0
+        writer = PdfWriter()
+        for page in resized_pages(reader, pdf_file, page_start, page_count if page_end is None else page_end, cache):
+            writer.add_page(page)
+        with profile_stage("write", target="part"):
+            if spool_dir is None:
+                packet = BytesIO()
+                writer.write(packet)
+                part = packet.getvalue()
+            else:
+                fd, part = tempfile.mkstemp(suffix=".pdf", dir=spool_dir)
+                with os.fdopen(fd, "wb") as f:
+                    writer.write(f)
+    if cache is None:
+        return part, page_count, 0, 0
+    return part, page_count, cache.hits - hits_before, cache.misses - misses_before
+
+
+def _iter_resized_parts(pool, input_files, shard_size, shard_threshold, cache=None, spool_dir=None):
+    """在 pool 中调整 input_files 的页面尺寸，按输入顺序产出 (文件, 起始页, 结束页, 文件页数, part)。
+
+    每个文件先作为一个任务提交，子进程解析时统计页数并随结果传回，输入只解析一次；
+    页数超过 shard_threshold 的文件交回主进程，按 shard_size 页拆分后提交到同一个进程池。
+    part 的含义见 _resize_page_range。
+    """
+    max_pages = shard_threshold if shard_size > 0 else None
+    futures = [pool.submit(_resize_page_range, pdf_file, cache=cache, max_pages=max_pages, spool_dir=spool_dir)
+               for pdf_file in input_files]
+    for pdf_file, future in zip(input_files, futures):
+        part, page_count, hits, misses = future.result()
+        if part is not None:
+            ranges = [((0, page_count), future)]
+        else:
+            ranges = [((page_start, page_end), pool.submit(_resize_page_range, pdf_file, page_start, page_end, cache,
+                                                           spool_dir=spool_dir))
+                      for page_start, page_end in page_range_shards(page_count, shard_size, shard_threshold)]
+            print(f"[分片] {os.path.basename(pdf_file)}: {page_count} 页拆分为 {len(ranges)} 个分片并行处理")
+        for (page_start, page_end), range_future in ranges:
+            if range_future is not future:
+                part, _, hits, misses = range_future.result()
+            if cache is not None:
+                cache.hits += hits
+                cache.misses += misses
+            if _progress is not None:
+                if page_end == page_count: # 文件的最后一个页范围
+                    _progress.file_finished(pdf_file, page_count)
+                else:
+                    _progress.pages(pdf_file, page_end - page_start, page_count)
+            yield pdf_file, page_start, page_end, page_count, part
+
+
+def _merge_pdfs_parallel(input_files, output_path, jobs, shard_size, shard_threshold, streaming=False, cache=None,
+                         compact=False):
+    """merge_pdfs 的进程池实现。
+
+    子进程只调整页面尺寸 (见 _iter_resized_parts)，页码和书签与串行合并一样在主进程中统一添加，
+    整个输出只嵌入一份页码字体子集。流式合并时总页数要在写出第一页之前确定，各部分因此先写入临时目录，
+    全部完成后再按顺序逐个加上页码写出。
+    """
+    spool = tempfile.TemporaryDirectory(prefix="pdf_fill_parts_") if streaming else nullcontext()
+    with process_pool(jobs) as pool, spool as spool_dir:
+        parts = _iter_resized_parts(pool, input_files, shard_size, shard_threshold, cache, spool_dir)
+        if streaming:
+            parts = list(parts)
+            _write_spooled_parts(parts, output_path, compact)
+            return [page_count for _, _, page_end, page_count, _ in parts if page_end == page_count]
+
+        writer = PdfWriter()
+        files_metadata = []
+        for pdf_file, _, page_end, page_count, part in parts:
+            with profile_stage("merge"):
+                for page in PdfReader(BytesIO(part)).pages:
+                    writer.add_page(page)
+            if page_end == page_count:
+                files_metadata.append((os.path.splitext(os.path.basename(pdf_file))[0], page_count))
+
+    _write_merged(writer, files_metadata, output_path, compact)
+    return [page_count for _, page_count in files_metadata]
+
+
+def _write_spooled_parts(parts, output_path, compact=False):
+    """并行流式合并的写出阶段: parts 是 _iter_resized_parts 产出的全部结果 (part 为临时文件路径)。
+
+    全部页码一次编码，字体子集只写出一份 (与 append_merged 相同)；每个部分复制到一个临时的
+    PdfWriter 中加上页码后交给 StreamingPdfWriter 写出，写出后即删除。
+    """
+    files_metadata = [(os.path.splitext(os.path.basename(pdf_file))[0], page_count)
+                      for pdf_file, _, page_end, page_count, _ in parts if page_end == page_count]
+    total_pages = sum(page_count for _, page_count in files_metadata)
+    if _progress is not None:
+        _progress.stage("write")
+    with profile_stage("layout_labels", pages=total_pages):
+        pages_draws = layout_page_labels(total_pages, total_pages, input_files_metadata=files_metadata)
+    with profile_stage("stamp", pages=total_pages):
+        stamps, host_fonts = encode_stamps(pages_draws, get_stamp_font()) if pages_draws else ([], {})
+    profile_count("overlays", len(stamps))
+
+    with open_output(output_path) as f:
+        writer = StreamingPdfWriter(f, generic, compact)
+        shared_fonts = {name: writer.add_object(font_ref) for name, font_ref in host_fonts.items()}
+        page_index = 0
+        for bookmark_name, page_count in files_metadata:
+            if page_count:
+                writer.add_outline_item(bookmark_name, page_index) # 书签指向该文件的第一页
+            page_index += page_count
+        for _, page_start, page_end, _, part_path in parts:
+            part = PdfWriter()
+            with profile_stage("merge"):
+                for page in PdfReader(part_path).pages:
+                    part.add_page(page)
+            if stamps:
+                with profile_stage("stamp", pages=len(part.pages)):
+                    part_start = len(writer)
+                    apply_stamps(part, part.pages, stamps[part_start:part_start + len(part.pages)], shared_fonts)
+            writer.add_pages(part.pages)
+            os.remove(part_path)
+        with profile_stage("write", file=os.path.basename(output_path), compact=compact):
+            writer.close()
+        profile_count("bytes_written", f.tell())
+        if _progress is not None:
+            _progress.written(output_path, f.tell())
+    report_dedup(writer.dedup_count, writer.dedup_saved)
+
+
+def _restamp_page(writer, reader, page_id, stamp, shared_fonts, rewritten):
+    """--append: 把合并结果中已有页面 page_id 的页码换成 stamp (见 apply_stamps)。
+
+    页码内容流 (页面 /Contents 的最后一项) 按原对象号重写；页面资源中原来的页码字体换成 shared_fonts，
+    改写的是直接包含字体字典的那个对象 (页面、资源字典或字体字典本身)，页面内容和图像不受影响。
+    rewritten 记录已改写的对象号，多个页面共用的资源只改写一次。
+    """
+    page = reader.get_object(page_id)
+    contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if not isinstance(contents, ArrayObject) or not contents or not isinstance(contents[-1], IndirectObject):
+        raise ValueError(f"页面对象 {page_id} 没有可替换的页码内容流")
+    stamp_stream = DecodedStreamObject()
+    stamp_stream.set_data(stamp)
+    writer.replace_object(contents[-1].idnum, stamp_stream)
+
+    resources_ref = page.raw_get("/Resources") if "/Resources" in page else DictionaryObject()
+    resources = resources_ref.get_object()
+    fonts_ref = resources.raw_get("/Font") if "/Font" in resources else DictionaryObject()
+    fonts = DictionaryObject((name, font) for name, font in fonts_ref.get_object().items()
+                             if not name.startswith(f"/{STAMP_FONT_PREFIX}"))
+    fonts.update(shared_fonts)
+    if isinstance(fonts_ref, IndirectObject):
+        target_id, updated = fonts_ref.idnum, fonts
+    else:
+        updated = DictionaryObject(resources.items())
+        updated[NameObject("/Font")] = fonts
+        if isinstance(resources_ref, IndirectObject):
+            target_id = resources_ref.idnum
+        else:
+            target_id = page_id
+            updated, resources = DictionaryObject(page.items()), updated
+            updated[NameObject("/Resources")] = resources
+    if target_id not in rewritten:
+        rewritten.add(target_id)
+        writer.replace_object(target_id, updated)
+
+
+def append_merged(index, new_files, source_files=None, cache=None):
+    """--append: 把 new_files 作为 PDF 增量更新追加到 index 对应的合并结果末尾，并更新索引。
+
+    新文件的页面和书签直接写在文件末尾，原有内容不改变、不重新读取。[ 全局页码/总页数 ] 中的
+    总页数随之改变，因此原有页面的页码也要更新，但只重写每页很小的页码内容流和字体资源字典
+    (见 _restamp_page)，写出量与原有页面中的内容和图像无关。新文件在主进程中串行处理。
+    source_files 用于记录身份 (默认即 new_files；--dpi 时为重采样前的原始文件)。
+    中途出错时把合并结果截断回原来的长度，索引保持有效。
+    """
+    output_path = index.pdf_path
+    page_counts = [_count_pages(pdf_file) for pdf_file in new_files]
+    files_metadata = [(os.path.splitext(entry["file"])[0], entry["pages"]) for entry in index.files]
+    files_metadata += [(os.path.splitext(os.path.basename(pdf_file))[0], page_count)
+                       for pdf_file, page_count in zip(new_files, page_counts)]
+    total_pages = sum(page_count for _, page_count in files_metadata)
+    with profile_stage("layout_labels", pages=total_pages):
+        page_labels = layout_page_labels(total_pages, total_pages, files_metadata)
+        stamps, host_fonts = encode_stamps(page_labels, get_stamp_font())
+
+    base_stat = os.stat(output_path)
+    try:
+        with open(output_path, "rb") as base_file, open(output_path, "ab") as f:
+            base_reader = PdfReader(base_file)
+            writer = StreamingPdfWriter(f, generic, index.compact, base=index, base_reader=base_reader)
+            shared_fonts = {name: writer.add_object(font_ref) for name, font_ref in host_fonts.items()}
+            with profile_stage("restamp", pages=len(index.page_ids)):
+                rewritten = set()
+                for page_id, stamp in zip(index.page_ids, stamps):
+                    _restamp_page(writer, base_reader, page_id, stamp, shared_fonts, rewritten)
+
+            for pdf_file, page_count in zip(new_files, page_counts):
+                bookmark_name = os.path.splitext(os.path.basename(pdf_file))[0]
+                if _progress is not None:
+                    _progress.file_started(pdf_file)
+                with profile_stage("file", file=bookmark_name):
+                    part = PdfWriter()
+                    for page in resized_pages(PdfReader(pdf_file), pdf_file, 0, page_count, cache):
+                        part.add_page(page)
+                    profile_file_read(pdf_file)
+                    page_start = len(writer)
+                    apply_stamps(part, part.pages, stamps[page_start:page_start + page_count], shared_fonts)
+                    if page_count:
+                        writer.add_outline_item(bookmark_name, page_start) # 书签指向该文件的第一页
+                    with profile_stage("merge", file=bookmark_name, pages=page_count):
+                        writer.add_pages(part.pages)
+                if _progress is not None:
+                    _progress.file_finished(pdf_file, page_count)
+            if _progress is not None:
+                _progress.stage("write")
+            with profile_stage("write", file=os.path.basename(output_path), compact=index.compact):
+                writer.close()
+            appended_bytes = f.tell() - base_stat.st_size
+    except BaseException:
+        os.truncate(output_path, base_stat.st_size)
+        os.utime(output_path, ns=(base_stat.st_atime_ns, base_stat.st_mtime_ns))
+        raise
+    profile_count("bytes_written", appended_bytes)
+    if _progress is not None:
+        _progress.written(output_path, appended_bytes)
+    report_dedup(writer.dedup_count, writer.dedup_saved)
+
+    index.record_append(writer, source_files or new_files, page_counts)
+    return appended_bytes
+
+
+def _multiply_matrix(m, n):
+    """返回 PDF 变换矩阵 [a b c d e f] 的乘积 m × n (先应用 m，再应用 n)。"""
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2, c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def find_page_images(page):
+    """如果 page 是纯图像页 (只绘制图像 XObject)，返回 {图像对象号: (宽, 高)}，即每张图像经
+    resize_and_position_page 调整到 A4 宽度后的最大显示尺寸 (点)；否则返回 None。"""
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    contents = page.get_contents()
+    if xobjects is None or contents is None:
+        return None
+    xobjects = xobjects.get_object()
+    scale = A4[0] / float(page.mediabox.width)
+
+    images = {}
+    ctm = (1, 0, 0, 1, 0, 0)
+    saved_ctms = []
+    for operands, operator in contents.operations:
+        if operator == b"q":
+            saved_ctms.append(ctm)
+        elif operator == b"Q":
+            ctm = saved_ctms.pop() if saved_ctms else ctm
+        elif operator == b"cm":
+            ctm = _multiply_matrix(tuple(float(value) for value in operands), ctm)
+        elif operator == b"Do":
+            ref = xobjects.get(operands[0])
+            if not isinstance(ref, IndirectObject):
+                return None
+            image = ref.get_object()
+            if image.get("/Subtype") != "/Image" or image.get("/ImageMask") or "/Decode" in image:
+                return None # 表单、模板蒙版等无法简单重采样
+            width = math.hypot(ctm[0], ctm[1]) * scale
+            height = math.hypot(ctm[2], ctm[3]) * scale
+            shown_width, shown_height = images.get(ref.idnum, (0, 0))
+            images[ref.idnum] = (max(shown_width, width), max(shown_height, height))
+        elif operator in PAINTING_OPERATORS:
+            return None
+    return images or None
+
+
+def _decode_image(xobject):
+    """把图像 XObject 解码为 Pillow 图像，带 /SMask 时附加为透明通道 (LA/RGBA)。
+
+    截图常见的 8 位灰度/RGB 图像直接由解码后的像素构造，每个流只解码一次；
+    其他颜色空间和位深交给 pypdf 的 decode_as_image (它会多次解码并在内部转成 PNG，较慢)。
+    """
+    from PIL import Image
+
+    colorspace = xobject.get("/ColorSpace")
+    colorspace = colorspace.get_object() if colorspace is not None else None
+    if isinstance(colorspace, ArrayObject) and colorspace[0] == "/ICCBased":
+        colorspace = {1: "/DeviceGray", 3: "/DeviceRGB"}.get(colorspace[1].get_object().get("/N"))
+    mode = {"/DeviceGray": "L", "/DeviceRGB": "RGB"}.get(colorspace)
+    filters = xobject.get("/Filter")
+    last_filter = filters[-1] if isinstance(filters, ArrayObject) and filters else filters
+    if mode is None or xobject.get("/BitsPerComponent") != 8 or last_filter in ("/JPXDecode", "/CCITTFaxDecode",
+                                                                                   "/JBIG2Decode"):
+        return xobject.decode_as_image()
+
+    size = (int(xobject["/Width"]), int(xobject["/Height"]))
+    if last_filter == "/DCTDecode":
+        image = Image.open(BytesIO(xobject.get_data()))
+        image = image.convert(mode) if image.mode != mode else image
+    else:
+        image = Image.frombytes(mode, size, xobject.get_data())
+    if "/SMask" in xobject:
+        alpha = _decode_image(xobject["/SMask"].get_object())
+        if alpha.mode != "L" or alpha.size != image.size:
+            return xobject.decode_as_image()
+        image.putalpha(alpha)
+    return image
+
+
+_raster_reader = (None, None) # (文件, PdfReader)：同一进程连续处理同一文件的图像时复用
+
+
+def _resample_image(pdf_file, idnum, target_size, image_format, quality):
+    """(子进程) 把 pdf_file 中对象号为 idnum 的图像缩小到不小于 target_size (像素) 并重新编码。
+
+    返回 (idnum, 原图像字节数, 新图像)。新图像为 (宽, 高, 颜色空间, 过滤器, 数据, 透明度数据或 None)；
+    不需要缩小、颜色模式不支持 (如 CMYK) 或重新编码后反而更大时为 None，保留原图像。
+    """
+    from PIL import Image
+
+    global _raster_reader
+    if _raster_reader[0] != pdf_file:
+        _raster_reader = (pdf_file, PdfReader(pdf_file))
+    xobject = _raster_reader[1].get_object(idnum)
+    original_bytes = len(xobject._data)
+    if "/SMask" in xobject:
+        original_bytes += len(xobject["/SMask"].get_object()._data)
+
+    width, height = int(xobject["/Width"]), int(xobject["/Height"])
+    ratio = max(target_size[0] / width, target_size[1] / height)
+    if ratio * RASTER_MIN_SCALE >= 1:
+        return idnum, original_bytes, None
+    new_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+
+    image = _decode_image(xobject)
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif image.mode == "1":
+        image = image.convert("L")
+    if image.mode not in ("L", "LA", "RGB", "RGBA"):
+        return idnum, original_bytes, None
+
+    alpha = None
+    if image.mode in ("LA", "RGBA"):
+        alpha = image.getchannel("A")
+        image = image.convert(image.mode[:-1])
+        if alpha.getextrema() == (255, 255): # 完全不透明，不需要透明度蒙版
+            alpha = None
+    # 按面积平均缩小：截图中的抗锯齿文字用 LANCZOS 等插值会产生振铃，无损压缩后反而比原图更大
+    image = image.resize(new_size, Image.BOX)
+    if image_format == "jpeg":
+        packet = BytesIO()
+        image.save(packet, "JPEG", quality=quality, optimize=True)
+        filter_name, data = "/DCTDecode", packet.getvalue()
+    else:
+        filter_name, data = "/FlateDecode", zlib.compress(image.tobytes())
+    alpha_data = zlib.compress(alpha.resize(new_size, Image.BOX).tobytes()) if alpha is not None else None
+
+    if len(data) + len(alpha_data or b"") >= original_bytes:
+        return idnum, original_bytes, None
+    colorspace = "/DeviceGray" if image.mode == "L" else "/DeviceRGB"
+    return idnum, original_bytes, (new_size[0], new_size[1], colorspace, filter_name, data, alpha_data)
+
+
+def _image_stream(width, height, colorspace, filter_name, data):
+    stream = StreamObject()
+    stream.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(width),
+        NameObject("/Height"): NumberObject(height),
+        NameObject("/ColorSpace"): NameObject(colorspace),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject(filter_name),
+    })
+    stream.set_data(data)
+    return stream
+
+
+def write_resampled_pdf(input_path, output_path, resampled):
+    """把 input_path 中的图像按 resampled ({对象号: 新图像}) 替换后写出到 output_path。"""
+    reader = PdfReader(input_path)
+    writer = PdfWriter()
+    new_refs = {}
+    for page in reader.pages:
+        resources = page.get("/Resources")
+        xobjects = resources.get_object().get("/XObject") if resources is not None else None
+        if xobjects is not None:
+            xobjects = xobjects.get_object()
+            for name, ref in list(xobjects.items()):
+                if not isinstance(ref, IndirectObject) or ref.idnum not in resampled:
+                    continue
+                if ref.idnum not in new_refs:
+                    width, height, colorspace, filter_name, data, alpha_data = resampled[ref.idnum]
+                    image = _image_stream(width, height, colorspace, filter_name, data)
+                    if alpha_data is not None:
+                        image[NameObject("/SMask")] = add_object(writer, 
+                            _image_stream(width, height, "/DeviceGray", "/FlateDecode", alpha_data))
+                    new_refs[ref.idnum] = add_object(writer, image)
+                # 属于 writer 的引用在 add_page 复制页面时保持不变，原图像因此不会被复制
+                xobjects[NameObject(name)] = new_refs[ref.idnum]
+        writer.add_page(page)
     with open(output_path, "wb") as f:
         writer.write(f)
 
+
+def downsample_inputs(input_files, work_dir, dpi, image_format="lossless", quality=RASTER_JPEG_QUALITY,
+                      jobs=1, cache=None):
+    """栅格阶段：把每个输入文件纯图像页中的图像重采样到其在 A4 最终尺寸下的 dpi。
+
+    截图生成的 PDF 每页嵌入一张原始分辨率的图像，resize_and_position_page 只改变变换矩阵，
+    原图像会原样进入输出。这里先找出纯图像页 (find_page_images)，计算每张图像的目标像素数，
+    再把所有文件的图像放到进程池中并行重采样 (jobs > 1 时)，最后写出到 work_dir 下的同名文件。
+    没有需要重采样的图像的文件保持原路径。返回新的输入文件列表，顺序与 input_files 一致。
+    """
+    params = ("raster", dpi, image_format, quality if image_format == "jpeg" else None)
+    outputs = list(input_files)
+    cached_count = 0
+    tasks = []
+    task_files = {}
+    for idx, pdf_file in enumerate(input_files):
+        output_path = os.path.join(work_dir, os.path.basename(pdf_file))
+        if cache is not None:
+            cached_path = cache.get(cache.key(pdf_file, *params))
+            if cached_path is not None:
+                shutil.copyfile(cached_path, output_path)
+                outputs[idx] = output_path
+                cached_count += 1
+                continue
+        images = {}
+        with profile_stage("find_images", file=os.path.basename(pdf_file)):
+            for page in PdfReader(pdf_file).pages:
+                for idnum, (width, height) in (find_page_images(page) or {}).items():
+                    shown_width, shown_height = images.get(idnum, (0, 0))
+                    images[idnum] = (max(shown_width, width), max(shown_height, height))
+        for idnum, (width, height) in images.items():
+            target_size = (math.ceil(width / 72 * dpi), math.ceil(height / 72 * dpi))
+            tasks.append((pdf_file, idnum, target_size, image_format, quality))
+        task_files[pdf_file] = (idx, output_path, {})
+
+    if tasks:
+        with profile_stage("resample", images=len(tasks)):
+            if jobs > 1:
+                with process_pool(jobs) as pool:
+                    results = list(pool.map(_resample_image, *zip(*tasks)))
+            else:
+                results = [_resample_image(*task) for task in tasks]
+    else:
+        results = []
+
+    input_bytes = output_bytes = resampled_count = 0
+    for (pdf_file, *_), (idnum, original_bytes, image) in zip(tasks, results):
+        input_bytes += original_bytes
+        if image is None:
+            output_bytes += original_bytes
+        else:
+            output_bytes += len(image[4]) + len(image[5] or b"")
+            resampled_count += 1
+            task_files[pdf_file][2][idnum] = image
+
+    for pdf_file, (idx, output_path, resampled) in task_files.items():
+        if not resampled:
+            continue
+        with profile_stage("write_resampled", file=os.path.basename(pdf_file)):
+            write_resampled_pdf(pdf_file, output_path, resampled)
+        if cache is not None:
+            cache.put(cache.key(pdf_file, *params), output_path)
+        outputs[idx] = output_path
+
+    total_before = sum(os.path.getsize(f) for f in input_files)
+    total_after = sum(os.path.getsize(f) for f in outputs)
+    print(f"[栅格] 重采样 {resampled_count}/{len(tasks)} 张图像到 {dpi} DPI"
+          f"（{'JPEG' if image_format == 'jpeg' else '无损'}）: 图像 {input_bytes / 1024 ** 2:.2f} MB -> "
+          f"{output_bytes / 1024 ** 2:.2f} MB, 输入文件 {total_before / 1024 ** 2:.2f} MB -> "
+          f"{total_after / 1024 ** 2:.2f} MB" + (f"（{cached_count} 个文件复用缓存）" if cached_count else ""))
+    return outputs
+
+
+def separate_output_path(input_file, output_path, single_file=False):
+    """不合并时 input_file 的输出路径：output_path 是文件名 (只有一个输入时) 或目录。"""
+    if single_file and not output_path.endswith("/"):
+        return output_path
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return os.path.join(output_path, f"{base_name}_processed.pdf")
+
+
+def merged_output_path(input_dir, output_path):
+    """合并模式的输出文件：output_path 是目录时为 <输入目录名>_merged.pdf。"""
+    if output_path.endswith("/"):
+        folder_name = os.path.basename(os.path.normpath(input_dir))
+        return os.path.join(output_path, f"{folder_name}_merged.pdf")
     return output_path
 
 
-def merge_pdfs(input_files, output_path):
-    """合并多个 PDF 文件，添加书签和页码。"""
-    writer = PdfWriter()
-    total_pages = 0
-    page_counts = []
-    processed_files = []
+def process_separately(input_files, output_files, args, jobs, cache):
+    """不合并：逐个处理 input_files，结果写到对应的 output_files。"""
+    shard_options = dict(jobs=jobs, shard_size=args.shard_size, shard_threshold=args.shard_threshold, cache=cache,
+                         compact=args.compact)
+    serial_files = list(zip(input_files, output_files))
+    if jobs > 1 and len(input_files) > 1:
+        with process_pool(jobs) as pool:
+            page_counts = list(pool.map(_count_pages, input_files))
+            # 大文件留给下面的分片流程，其余文件在进程池中逐文件并行处理
+            serial_files = [(i, o) for i, o, n in zip(input_files, output_files, page_counts)
+                            if n > args.shard_threshold]
+            pooled_files = [(i, o) for i, o, n in zip(input_files, output_files, page_counts)
+                            if n <= args.shard_threshold]
+            if pooled_files:
+                print(f"[处理中] 使用 {jobs} 个进程处理 {len(pooled_files)} 个文件")
+                pooled_inputs, pooled_outputs = zip(*pooled_files)
+                worker = partial(_process_pdf_worker, cache=cache, compact=args.compact)
+                for input_file, (output_file, hits, misses) in zip(pooled_inputs,
+                                                                   pool.map(worker, pooled_inputs, pooled_outputs)):
+                    if cache is not None:
+                        cache.hits += hits
+                        cache.misses += misses
+                    if _progress is not None:
+                        output_bytes = os.path.getsize(output_file)
+                        _progress.written(output_file, output_bytes)
+                        _progress.file_finished(input_file, page_counts[input_files.index(input_file)],
+                                                output=output_file)
+                    print(f"[完成] {os.path.basename(input_file)} -> 输出文件: {os.path.basename(output_file)}")
+
+    load = lambda entry: prefetch_reader(entry[0], cache)
+    with prefetch_pipeline(serial_files, args.prefetch, load, write_behind=True) as (entries, write_behind):
+        for (input_file, output_file), prefetched in entries:
+            print(f"[处理中] {os.path.basename(input_file)}")
+            reader = prefetched[0] if prefetched is not None else None
+            if prefetched is not None:
+                profile_count("bytes_read", prefetched[2])
+            process_pdf(input_file, output_file, reader=reader, write_behind=write_behind,
+                        **shard_options) # 默认 add_nums=True，此处正确
+            print(f"[完成] 输出文件: {os.path.basename(output_file)}")
+
+
+def merge_inputs(input_files, output_file, args, jobs, cache, resident=None, source_files=None):
+    """合并 input_files 到 output_file；预计内存超出 --max-memory 时改用流式合并。
+
+    --append 时如果合并结果的索引有效，且 input_files 只是在末尾新增了文件，则只追加这些文件
+    (见 append_merged)；否则完整重写并建立索引。source_files 是 input_files 重采样前的原始文件，
+    用作索引中的文件身份。
+    """
+    source_files = source_files or input_files
+    if args.append:
+        index = None if args.rebuild else MergeIndex.load(output_file)
+        if index is not None and index.matches_prefix(source_files):
+            new_count = len(input_files) - len(index.files)
+            if not new_count:
+                print(f"[追加] 没有新文件，{output_file} 已是最新")
+                return
+            print(f"[处理中] 追加 {new_count} 个文件到 {output_file}")
+            try:
+                appended_bytes = append_merged(index, input_files[-new_count:], source_files[-new_count:], cache)
+            except Exception as e:
+                print(f"[追加] 增量追加失败 ({e})，改为完整重写")
+            else:
+                print(f"[完成] 已追加 {new_count} 个文件 ({appended_bytes / 1024 ** 2:.1f} MB)，"
+                      f"共 {len(index.page_ids)} 页: {output_file}")
+                return
+        elif args.rebuild:
+            print(f"[追加] --rebuild: 完整重写 {output_file}")
+        elif index is not None:
+            print("[追加] 已合并的文件有修改、删除，或新文件没有排在末尾，完整重写")
+        else:
+            print(f"[追加] 没有可用的索引 {MergeIndex.path_for(output_file)}，完整重写")
+
+    streaming = args.stream
+    if not streaming and args.max_memory is not None:
+        estimated_memory = estimate_merge_memory(input_files)
+        if estimated_memory > args.max_memory:
+            streaming = True
+            print(f"[内存] 预计峰值 {estimated_memory / 1024 ** 2:.0f} MB 超过预算 "
+                  f"{args.max_memory / 1024 ** 2:.0f} MB，使用流式合并")
+
+    print(f"[处理中] 合并 {len(input_files)} 个文件" + ("（流式）" if streaming else ""))
+    page_counts = merge_pdfs(input_files, output_file, jobs=jobs, shard_size=args.shard_size,
+                             shard_threshold=args.shard_threshold, streaming=streaming, cache=cache,
+                             compact=args.compact, resident=None if streaming else resident, prefetch=args.prefetch)
+    print(f"[完成] 合并输出文件: {output_file}")
+    print(f"[书签] 已添加 {len(input_files)} 个书签")
+    index_path = MergeIndex.path_for(output_file)
+    if args.append:
+        with profile_stage("index"):
+            index = MergeIndex.build(output_file, source_files, page_counts, PdfReader)
+        if index is not None:
+            index.save()
+    elif os.path.exists(index_path): # 完整重写后原来的索引不再有效
+        os.remove(index_path)
+
+
+def process_stream_input(source, output_path, frames=False, compact=False):
+    """输入为 "-" (标准输入) 或 --frames 时的处理，不读写任何目录，也不生成临时文件。
+
+    frames 为 False 时 source 是一个 PDF，输出调整尺寸并添加页码后的 PDF (同 process_pdf)；
+    为 True 时 source 是分帧流 (见 read_frames)，其中的 PDF 按流中的顺序串行合并 (同 merge_pdfs)，
+    书签和页码使用帧中的文件名。
+    """
+    with (nullcontext(sys.stdin.buffer) if source == STDIO_PATH else open(source, "rb")) as stream:
+        if not frames:
+            with profile_stage("read", file=STDIN_NAME):
+                data = stream.read()
+            print(f"[PDF] 从标准输入读取 {len(data) / 1024 ** 2:.2f} MB")
+            with profile_stage("parse", file=STDIN_NAME):
+                reader = PdfReader(BytesIO(data))
+            profile_count("bytes_read", len(data))
+            process_pdf(STDIN_NAME, output_path, reader=reader, compact=compact)
+            print(f"[完成] 输出文件: {output_path}")
+            return
+        with profile_stage("read", file=os.path.basename(source)):
+            documents = list(read_frames(stream))
+
+    print(f"[PDF] 从分帧流读取 {len(documents)} 个 PDF 文件")
+
+    def entries():
+        for name, data in documents:
+            with profile_stage("parse", file=name):
+                reader = PdfReader(BytesIO(data))
+            yield name, (reader, len(reader.pages), len(data))
+
+    print(f"[处理中] 合并 {len(documents)} 个文件")
+    writer, files_metadata = _assemble_pages(entries())
+    _write_merged(writer, files_metadata, output_path, compact)
+    print(f"[完成] 合并输出文件: {output_path}")
+    print(f"[书签] 已添加 {len(documents)} 个书签")
+
+
+def report_cache(cache):
+    """输出缓存命中统计，并淘汰超出上限的条目。"""
+    if cache is None:
+        return
+    print(f"[缓存] {cache.report()}")
+    removed, freed = cache.evict()
+    if removed:
+        print(f"[缓存] 超出上限，已淘汰 {removed} 个最久未使用的条目 ({freed / 1024 ** 2:.1f} MB)")
+
+
+def snapshot_pdfs(directory):
+    """返回目录中各 PDF 文件的 {路径: (大小, 修改时间)}。"""
+    snapshot = {}
+    for path in glob.glob(os.path.join(directory, "*.pdf")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError: # 列出目录后被删除
+            continue
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
 
+def watch_changes(directory, interval=WATCH_INTERVAL, debounce=WATCH_DEBOUNCE):
+    """每隔 interval 秒轮询目录，产出 (新增或修改的文件, 删除的文件)，均按路径排序。
+
+    第一次立即产出目录中已有的全部文件。检测到变化后等待目录连续 debounce 秒不再变化再产出，
+    因此正在复制的文件 (大小或修改时间仍在变化) 不会被读取，一批文件也只产出一次。
+    """
+    previous = {}
+    current = snapshot_pdfs(directory)
+    while True:
+        if current != previous:
+            changed = sorted(path for path, state in current.items() if previous.get(path) != state)
+            deleted = sorted(path for path in previous if path not in current)
+            previous = current
+            yield changed, deleted
+        time.sleep(interval)
+        current = snapshot_pdfs(directory)
+        while current != previous:
+            time.sleep(debounce)
+            latest = snapshot_pdfs(directory)
+            if latest == current:
+                break
+            current = latest
+
+
+def watch_directory(input_dir, output_path, args, jobs, cache, raster_dir=None):
+    """--watch: 常驻运行，input_dir 中的 PDF 新增、修改或删除后只重新处理受影响的文件并刷新输出。
+
+    合并模式下每次变化都重新组装合并结果 (全局页码和书签依赖全部文件)，但页码字体和布局数据
+    常驻内存，未变化文件调整尺寸后的页面也保留在内存中 (串行、非流式合并时，见 ResidentPages)，
+    不再重新解析；其余情况由处理结果缓存复用。不合并模式下只处理变化的文件，并删除已删除文件的输出。
+    单次重建失败 (如放入了损坏的 PDF) 只输出错误，继续监视。按 Ctrl+C 退出。
+    """
+    global _progress
+    merged_file = None if args.no_merge else merged_output_path(input_dir, output_path)
+    resident = ResidentPages() if merged_file is not None and jobs == 1 else None
+    sources = {} # 文件名 -> 实际处理的文件 (--dpi 时为重采样后的文件)
+    print(f"[监视] 监视目录 {input_dir}（每 {args.watch_interval:g} 秒检查一次），按 Ctrl+C 退出")
     try:
-        # 预处理每个 PDF (调整尺寸，但不立即添加页码)
-        for pdf_file in input_files:
-            tmp_output = f"tmp_{os.path.basename(pdf_file)}"
-            process_pdf(pdf_file, tmp_output, add_nums=False) # 不为临时文件添加页码
-            processed_files.append(tmp_output)
-
-            reader_temp = PdfReader(tmp_output) # 为清晰起见，使用不同变量名
-            page_count = len(reader_temp.pages)
-            page_counts.append(page_count)
-            total_pages += page_count
-
-        # 合并所有处理后的 PDF
-        current_page = 0
-        for i, processed_file_path in enumerate(processed_files):
-            bookmark_name = os.path.splitext(os.path.basename(input_files[i]))[0]
-            writer.add_outline_item(bookmark_name, current_page)
-
-            reader_processed = PdfReader(processed_file_path) # 使用不同变量名
-            for page in reader_processed.pages:
-                writer.add_page(page)
+        for changed, deleted in watch_changes(input_dir, args.watch_interval):
+            print(f"\n[监视] {time.strftime('%H:%M:%S')} 新增/修改 {len(changed)} 个，删除 {len(deleted)} 个文件")
+            if _progress is not None: # 每次重建输出一组 start ... done 事件
+                _progress = ProgressReporter(_progress.stream, "pdf_fill")
+            if cache is not None:
+                cache.hits = cache.misses = 0
+            try:
+                for pdf_file in deleted:
+                    sources.pop(os.path.basename(pdf_file), None)
+                    if merged_file is None:
+                        output_file = separate_output_path(pdf_file, output_path)
+                        if os.path.exists(output_file):
+                            os.remove(output_file)
+                            print(f"[删除] 输出文件: {os.path.basename(output_file)}")
+                targets = changed if merged_file is None else [os.path.join(input_dir, name) for name in sorted(
+                    set(sources) | {os.path.basename(f) for f in changed})]
+                if _progress is not None:
+                    _progress.begin(targets)
+                if raster_dir is not None and changed:
+                    if _progress is not None:
+                        _progress.stage("downsample")
+                    processed = downsample_inputs(changed, raster_dir, args.dpi, args.image_format,
+                                                  args.jpeg_quality, jobs, cache)
+                else:
+                    processed = changed
+                for pdf_file, source in zip(changed, processed):
+                    sources[os.path.basename(pdf_file)] = source
+                if _progress is not None:
+                    _progress.stage("process")
 
-            current_page += page_counts[i]
-            # os.remove(processed_file_path) # 移至 finally 块处理
+                if merged_file is None:
+                    process_separately([sources[os.path.basename(f)] for f in changed],
+                                       [separate_output_path(f, output_path) for f in changed], args, jobs, cache)
+                elif sources:
+                    input_files = [sources[name] for name in sorted(sources)]
+                    merge_inputs(input_files, merged_file, args, jobs, cache, resident)
+                    if resident is not None:
+                        resident.prune(input_files)
+                else:
+                    print(f"[监视] 目录中没有 PDF 文件，保留上一次的合并结果 {merged_file}")
+                report_cache(cache)
+                if _progress is not None:
+                    _progress.finish()
+            except Exception as e:
+                print(f"[错误] 重建失败: {e}", file=sys.stderr)
+                if _progress is not None:
+                    _progress.finish(ok=False, error=str(e))
+    except KeyboardInterrupt:
+        print("\n[监视] 已停止")
 
-        # 为最终合并的 PDF 添加页码
-        files_metadata = []
-        for i, input_file_path in enumerate(input_files):
-            base_name = os.path.splitext(os.path.basename(input_file_path))[0]
-            num_p = page_counts[i]
-            files_metadata.append((base_name, num_p))
-        
-        add_page_numbers(writer, total_pages, input_files_metadata=files_metadata)
 
-        with open(output_path, "wb") as f:
-            writer.write(f)
-    finally:
-        # 清理临时文件
-        for pf_path in processed_files:
-            if os.path.exists(pf_path):
+def default_socket_path():
+    """--serve --socket 和 pdf_fill_client.py 默认使用的 socket 路径 (可由 PDF_FILL_SOCKET 环境变量覆盖)。"""
+    return os.environ.get(SERVICE_SOCKET_ENV) or os.path.join(tempfile.gettempdir(), f"pdf_fill-{os.getuid()}.sock")
+
+
+def _init_service_worker():
+    """(--serve 工作进程) 进程池的 initializer: 预先注册页码字体、加载页码度量，并常驻处理结果缓存。
+
+    标准输出在文件描述符层面改为指向标准错误：stdin 模式下服务进程的标准输出是 JSON-RPC 通道，
+    工作进程及其子进程中不经过 sys.stdout 的输出不能混入其中。
+    """
+    global _service_caches, _font_warnings
+    os.dup2(2, 1)
+    _service_caches = {}
+    _font_warnings = False # 回退警告由服务或批量运行的主进程输出 (见 serve)
+    get_label_metrics()
+    get_stamp_font()
+
+
+def _service_run(params):
+    """run: 以 params["argv"] 为命令行参数执行与 pdf_fill.py 相同的处理 (客户端 pdf_fill_client.py 使用)。"""
+    argv = params.get("argv", [])
+    if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+        raise ValueError("argv 必须是字符串列表")
+    try:
+        main(argv)
+    except SystemExit as e: # argparse 的参数错误和 --help
+        return {"exit_code": e.code if isinstance(e.code, int) else int(e.code is not None)}
+    return {"exit_code": 0}
+
+
+def _service_process_pdf(params):
+    """process_pdf: 处理 params["input"]，写出到 params["output"]。"""
+    require_params(params, "input", "output")
+    os.makedirs(os.path.dirname(os.path.abspath(params["output"])), exist_ok=True)
+    cache = None if params.get("no_cache") else open_result_cache()
+    output_path = process_pdf(params["input"], params["output"], params.get("add_nums", True), params.get("jobs", 1),
+                              cache=cache, compact=params.get("compact", False))
+    return {"output": os.path.abspath(output_path)}
+
+
+def _service_merge_pdfs(params):
+    """merge_pdfs: 按顺序合并 params["inputs"]，写出到 params["output"]。"""
+    require_params(params, "inputs", "output")
+    os.makedirs(os.path.dirname(os.path.abspath(params["output"])), exist_ok=True)
+    cache = None if params.get("no_cache") else open_result_cache()
+    merge_pdfs(params["inputs"], params["output"], params.get("jobs", 1), streaming=params.get("stream", False),
+               cache=cache, compact=params.get("compact", False))
+    return {"output": os.path.abspath(params["output"])}
+
+
+# --serve 交给工作进程执行的方法 (见 pdf_common.service.WorkerService)，参数均可另加 cwd:
+#     run          argv: 与命令行运行 pdf_fill.py 相同，返回 exit_code
+#     process_pdf  input, output, add_nums, jobs, compact, no_cache: 返回 output
+#     merge_pdfs   inputs, output, jobs, stream, compact, no_cache: 返回 output
+SERVICE_METHODS = {"run": _service_run, "process_pdf": _service_process_pdf, "merge_pdfs": _service_merge_pdfs}
+
+
+def _service_call(method, params):
+    """(--serve 工作进程) 在 params["cwd"] 下执行一个请求。返回 (结果, 错误信息, 标准输出, 标准错误)。
+
+    请求期间的输出全部被收集并返回给客户端；请求结束后执行 register_cleanup 注册的清理函数，
+    并清除 --profile/--progress 的状态，不影响同一工作进程处理的下一个请求。
+    """
+    global _request_cleanups, _profiler, _progress
+    stdout, stderr = StringIO(), StringIO()
+    result, error = None, None
+    _request_cleanups = []
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(params["cwd"])
+            result = SERVICE_METHODS[method](params)
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            for func, args in reversed(_request_cleanups):
                 try:
-                    os.remove(pf_path)
-                except OSError as e:
-                    print(f"[警告] 无法删除临时文件 {pf_path}: {e}")
+                    func(*args)
+                except Exception:
+                    traceback.print_exc()
+            _request_cleanups = None
+            _profiler = None
+            _progress = None
+    return result, error, stdout.getvalue(), stderr.getvalue()
 
 
-def main():
+def serve(socket_path=None, workers=None):
+    """--serve: 启动 WorkerService，socket_path 为 None 时通过标准输入/输出通信。服务自身的日志写到标准错误。"""
+    workers = workers or os.cpu_count() or 1
+    with redirect_stdout(sys.stderr):
+        get_stamp_font() # 字体回退的警告只在这里输出一次
+    service = WorkerService(workers, _service_call, _init_service_worker, SERVICE_METHODS)
+    where = socket_path or "标准输入/输出"
+    print(f"[服务] pdf_fill 服务已启动: {where}, {workers} 个工作进程 (进程号 {os.getpid()})", file=sys.stderr)
+    try:
+        if socket_path is None:
+            service.serve_stdio()
+        else:
+            service.serve_socket(socket_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        print(f"[服务] 已停止, 共处理 {service.requests} 个请求", file=sys.stderr)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="将 PDF 页面调整为 A4 顶部对齐，添加页码和书签")
-    parser.add_argument("input", nargs='?', default="./PDFS", help="输入 PDF 文件或目录（默认 ./PDFS）")
-    parser.add_argument("-o", "--output", help="输出文件路径或目录", default=None)
+    parser.add_argument("input", nargs='?', default="./PDFS",
+                        help="输入 PDF 文件或目录（默认 ./PDFS），- 表示从标准输入读取一个 PDF")
+    parser.add_argument("-o", "--output", default=None,
+                        help="输出文件路径或目录，- 表示写到标准输出（此时文字日志输出到标准错误）")
     parser.add_argument("--no-merge", action="store_true", help="不合并，分别处理每个文件")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="并行处理的进程数（默认 1 即串行，0 表示使用全部 CPU 核心）")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE,
+                        help=f"大文件按页范围分片并行处理时每个分片的页数（默认 {SHARD_SIZE}）")
+    parser.add_argument("--shard-threshold", type=int, default=SHARD_THRESHOLD,
+                        help=f"页数超过此值的文件在 --jobs > 1 时自动分片（默认 {SHARD_THRESHOLD}）")
+    parser.add_argument("--frames", action="store_true",
+                        help="输入（- 表示标准输入）是分帧流：每帧为 4 字节文件名长度、UTF-8 文件名、8 字节数据长度和 PDF 数据"
+                             "（长度均为大端），其中的 PDF 按顺序合并后写到 -o（默认 - 即标准输出）")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH, metavar="N",
+                        help="串行处理和合并时在后台线程中预读并解析接下来的 N 个文件，--no-merge 的输出在后台线程中写出"
+                             f"（默认 {PREFETCH_DEPTH} 即关闭；输入、输出位于网络盘或慢速磁盘时可设为 2）；"
+                             "结束时报告等待预读和写出队列的时间")
+    parser.add_argument("--stream", action="store_true",
+                        help="合并时逐个文件流式写出，峰值内存只取决于最大的单个输入文件")
+    parser.add_argument("--max-memory", type=parse_size, default=None,
+                        help="合并的内存预算（如 512M、4G）；预计峰值超出时自动使用 --stream 模式")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用处理结果缓存，重新处理所有文件（也不写入缓存）")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"处理结果缓存目录（默认为脚本所在目录下的 {CACHE_DIR_NAME}，与工作目录无关）")
+    parser.add_argument("--cache-size", type=parse_size, default=CACHE_MAX_BYTES,
+                        help="缓存总大小上限（如 500M、4G，默认 2G）；超出时淘汰最久未使用的条目")
+    parser.add_argument("--compact", action="store_true",
+                        help="以紧凑格式写出：压缩内容流，小对象打包进对象流，使用交叉引用流（PDF 1.5+）")
+    parser.add_argument("--dpi", type=int, default=None,
+                        help="将纯图像页中的图像按 A4 最终尺寸重采样到此分辨率（如 150；默认不重采样，需要 Pillow）")
+    parser.add_argument("--image-format", choices=("lossless", "jpeg"), default="lossless",
+                        help="重采样后图像的编码方式：lossless（默认，Flate）或 jpeg")
+    parser.add_argument("--jpeg-quality", type=int, default=RASTER_JPEG_QUALITY,
+                        help=f"--image-format jpeg 的编码质量 1-95（默认 {RASTER_JPEG_QUALITY}）")
+    parser.add_argument("--profile", metavar="TRACE.json", default=None,
+                        help="记录各阶段和各文件的耗时及计数，写出 Chrome trace-event 格式的 JSON（可用 Perfetto 打开）")
+    parser.add_argument("--cprofile", metavar="FILE.prof", default=None,
+                        help="配合 --profile，同时把 cProfile 统计写入此文件（子进程写入 FILE.prof.<进程号>）")
+    parser.add_argument("--progress", choices=("text", "jsonl"), default="text",
+                        help="进度输出格式：text（默认，文字日志）或 jsonl（每行一个 JSON 事件，不再输出文字日志）")
+    parser.add_argument("--progress-fd", type=int, default=1, metavar="FD",
+                        help="--progress jsonl 的事件写入的文件描述符（默认 1 即标准输出）")
+    parser.add_argument("--watch", action="store_true",
+                        help="常驻运行：监视输入目录，PDF 新增、修改或删除后只重新处理受影响的文件并刷新输出")
+    parser.add_argument("--watch-interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS",
+                        help=f"--watch 检查输入目录的间隔秒数（默认 {WATCH_INTERVAL:g}）")
+    parser.add_argument("--append", action="store_true",
+                        help="合并结果已存在且只在末尾新增了文件时，以 PDF 增量更新的方式只追加新文件"
+                             f"（依赖合并结果旁的 {MERGE_INDEX_SUFFIX} 索引，没有索引时完整重写并建立索引）")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="配合 --append：忽略索引完整重写合并结果，清除历次追加留下的旧版本对象")
+    parser.add_argument("--serve", action="store_true",
+                        help="作为常驻服务运行：通过标准输入/输出（或 --socket）接收 JSON-RPC 请求，"
+                             "工作进程预先加载字体和缓存，客户端见 pdf_fill_client.py")
+    parser.add_argument("--socket", nargs="?", const="", default=None, metavar="PATH",
+                        help=f"配合 --serve：在 Unix socket 上监听（省略 PATH 时为 ${SERVICE_SOCKET_ENV} 或临时目录下的"
+                             "默认路径）")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="配合 --serve：工作进程数，即可同时处理的请求数（默认 0 表示 CPU 核心数）")
+
+    args = parser.parse_args(argv)
+    if args.serve:
+        if _service_caches is not None:
+            parser.error("--serve 不能通过服务运行")
+        socket_path = None
+        if args.socket is not None:
+            socket_path = args.socket or default_socket_path()
+        serve(socket_path, args.workers)
+        return
+    if args.socket is not None:
+        parser.error("--socket 需要同时指定 --serve")
+    if args.watch and _service_caches is not None:
+        parser.error("--watch 不能通过服务运行，请直接运行 pdf_fill.py")
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    cache = None if args.no_cache else open_result_cache(args.cache_dir, args.cache_size)
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile 需要同时指定 --profile")
+    if args.watch and not os.path.isdir(args.input):
+        parser.error("--watch 需要输入目录")
+    if args.append and (args.no_merge or not os.path.isdir(args.input)):
+        parser.error("--append 用于合并模式，需要输入目录")
+    if args.rebuild and not args.append:
+        parser.error("--rebuild 需要同时指定 --append")
+    if args.prefetch < 0:
+        parser.error("--prefetch 不能为负数")
+    stdin_input = args.input == STDIO_PATH or args.frames
+    if stdin_input and args.output is None:
+        args.output = STDIO_PATH
+    stdio = stdin_input or args.output == STDIO_PATH
+    if stdio and _service_caches is not None:
+        parser.error("标准输入/输出（-）和 --frames 不能通过服务运行，请直接运行 pdf_fill.py")
+    if stdio and (args.watch or args.append or args.dpi):
+        parser.error("标准输入/输出（-）和 --frames 不能与 --watch、--append、--dpi 同时使用")
+    if args.frames and args.no_merge:
+        parser.error("--frames 总是合并输入的 PDF，不能与 --no-merge 同时使用")
+    if args.output == STDIO_PATH and args.progress == "jsonl" and args.progress_fd == 1:
+        parser.error("-o - 时标准输出用于写出 PDF，--progress jsonl 需要用 --progress-fd 指定其他文件描述符")
+    if stdio:
+        cache = None # 处理结果缓存会写入缓存目录
+    if args.output == STDIO_PATH:
+        enable_stdout_output()
+    if args.profile:
+        enable_profiling(args.profile, args.cprofile)
+    if args.progress == "jsonl":
+        enable_progress(args.progress_fd)
 
-    args = parser.parse_args()
+    def fail(message):
+        print(message)
+        if _progress is not None:
+            _progress.finish(ok=False, error=message)
+
+    if stdin_input:
+        if _progress is not None:
+            _progress.stage("process")
+        try:
+            process_stream_input(args.input, args.output, args.frames, args.compact)
+        except Exception as e:
+            fail(f"[错误] 处理 {'分帧流' if args.frames else '标准输入'} 失败: {e}")
+            sys.exit(1)
+        if _progress is not None:
+            _progress.finish()
+        return
 
     if os.path.isdir(args.input):
         input_files = sorted(glob.glob(os.path.join(args.input, "*.pdf")))
-        if not input_files:
-            print(f"[错误] 在目录 {args.input} 中未找到 PDF 文件")
+        if not input_files and not args.watch:
+            fail(f"[错误] 在目录 {args.input} 中未找到 PDF 文件")
             return
         print(f"[PDF] 找到 {len(input_files)} 个 PDF 文件")
     else:
         if not os.path.exists(args.input):
-            print(f"[错误] 文件 {args.input} 不存在")
+            fail(f"[错误] 文件 {args.input} 不存在")
             return
         if not args.input.endswith(".pdf"):
-            print("[错误] 输入文件必须是 PDF 格式")
+            fail("[错误] 输入文件必须是 PDF 格式")
             return
         input_files = [args.input]
         print(f"[PDF] 处理单个文件: {args.input}")
 
+    if args.dpi:
+        try:
+            import PIL # noqa: F401 (pypdf 解码图像同样需要 Pillow)
+        except ImportError:
+            fail("[错误] --dpi 需要 Pillow，请先运行 pip install Pillow")
+            return
+        raster_dir = tempfile.mkdtemp(prefix="pdf_fill_raster_")
+        register_cleanup(shutil.rmtree, raster_dir, True)
+    else:
+        raster_dir = None
+    source_files = input_files
+    if raster_dir is not None and not args.watch:
+        if _progress is not None:
+            _progress.begin(input_files)
+            _progress.stage("downsample")
+        # 重采样后的文件与原文件同名，书签和页码中的文件名保持不变
+        input_files = downsample_inputs(input_files, raster_dir, args.dpi, args.image_format, args.jpeg_quality,
+                                        jobs, cache)
+
     if args.output is None:
-        if len(input_files) == 1 and not args.no_merge:
+        if len(input_files) == 1 and not args.no_merge and not args.watch and not args.append:
             base_name = os.path.splitext(os.path.basename(input_files[0]))[0]
             output_path = f"./output/{base_name}_processed.pdf"
         else:
@@ -301,33 +2024,34 @@ def main():
     else:
         output_path = args.output
 
+    if output_path == STDIO_PATH and len(input_files) > 1 and args.no_merge:
+        fail("[错误] 不合并时 -o - 只能用于单个输入文件")
+        return
     output_dir = os.path.dirname(output_path) if output_path.endswith(".pdf") else output_path
-    if output_dir and not os.path.exists(output_dir):
+    if output_path != STDIO_PATH and output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"[目录] 创建输出目录: {output_dir}")
 
-    if args.no_merge or len(input_files) == 1:
-        for input_file in input_files:
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-            if output_path.endswith("/"):
-                output_file = os.path.join(output_path, f"{base_name}_processed.pdf")
-            else:
-                output_file = output_path if len(input_files) == 1 else f"{output_path.rstrip('/')}/{base_name}_processed.pdf"
+    if args.watch:
+        watch_directory(args.input, output_path, args, jobs, cache, raster_dir)
+        return
 
-            print(f"[处理中] {os.path.basename(input_file)}")
-            process_pdf(input_file, output_file) # 默认 add_nums=True，此处正确
-            print(f"[完成] 输出文件: {os.path.basename(output_file)}")
+    if _progress is not None:
+        if raster_dir is None:
+            _progress.begin(input_files)
+        _progress.stage("process")
+
+    if args.no_merge or (len(input_files) == 1 and not args.append):
+        output_files = [separate_output_path(input_file, output_path, len(input_files) == 1)
+                        for input_file in input_files]
+        process_separately(input_files, output_files, args, jobs, cache)
     else:
-        if output_path.endswith("/"):
-            folder_name = os.path.basename(os.path.normpath(args.input))
-            output_file = os.path.join(output_path, f"{folder_name}_merged.pdf")
-        else:
-            output_file = output_path
+        merge_inputs(input_files, merged_output_path(args.input, output_path), args, jobs, cache, _shared_pages,
+                     source_files=source_files)
 
-        print(f"[处理中] 合并 {len(input_files)} 个文件")
-        merge_pdfs(input_files, output_file)
-        print(f"[完成] 合并输出文件: {output_file}")
-        print(f"[书签] 已添加 {len(input_files)} 个书签")
+    report_cache(cache)
+    if _progress is not None:
+        _progress.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""pdf_fill.py --serve 的轻量客户端，用法与 pdf_fill.py 完全相同。
+
+命令行参数连同当前目录作为一个 run 请求发送给已在运行的服务 (pdf_fill.py --serve --socket)，
+再原样输出服务返回的标准输出和标准错误，并以相同的退出码退出。只使用标准库，启动时不导入
+pypdf/reportlab，也不注册字体。连接不到服务时直接运行 pdf_fill.py，因此可以替代 run.sh。
+使用标准输入/输出 (-) 或 --frames 时 PDF 数据需要经过本进程的标准输入/输出，也直接运行 pdf_fill.py。
+socket 路径与服务相同：PDF_FILL_SOCKET 环境变量，或临时目录下的默认路径。
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+
+SERVICE_SOCKET_ENV = "PDF_FILL_SOCKET"
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_fill.py")
+
+
+def default_socket_path():
+    return os.environ.get(SERVICE_SOCKET_ENV) or os.path.join(tempfile.gettempdir(), f"pdf_fill-{os.getuid()}.sock")
+
+
+def uses_stdio(argv):
+    """参数中是否把标准输入/输出用作 PDF 的输入或输出 (-、-o -、--frames)。"""
+    return any(arg in ("-", "--frames", "-o-", "--output=-") for arg in argv)
+
+
+def main():
+    argv = sys.argv[1:]
+    if uses_stdio(argv):
+        os.execv(sys.executable, [sys.executable, SCRIPT_PATH] + argv)
+    try:
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(default_socket_path())
+    except OSError:
+        # 服务没有运行: 直接运行 pdf_fill.py
+        os.execv(sys.executable, [sys.executable, SCRIPT_PATH] + argv)
+
+    request = {"jsonrpc": "2.0", "id": 1, "method": "run", "params": {"argv": argv, "cwd": os.getcwd()}}
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        f.flush()
+        line = f.readline()
+    if not line:
+        print("[错误] 服务在返回结果前断开了连接", file=sys.stderr)
+        sys.exit(1)
+
+    response = json.loads(line)
+    if "error" in response:
+        error = response["error"]
+        data = error.get("data", {})
+        sys.stdout.write(data.get("stdout", ""))
+        sys.stderr.write(data.get("stderr", ""))
+        print(f"[错误] 服务返回错误: {error['message']}", file=sys.stderr)
+        sys.exit(1)
+    result = response["result"]
+    sys.stdout.write(result["stdout"])
+    sys.stderr.write(result["stderr"])
+    sys.exit(result["exit_code"])
+
+
+if __name__ == "__main__":
+    main()
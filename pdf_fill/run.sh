@@ -4,4 +4,5 @@
 source venv/bin/activate
 
 # Run the PDF processor with all arguments passed to this script
-python pdf_fill.py "$@" 
\ No newline at end of file
+# (forwarded to a running "pdf_fill.py --serve --socket" if there is one)
+python pdf_fill_client.py "$@" 
\ No newline at end of file
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""pdfinsert 书签复制的基准测试。
+
+生成一个带多层书签的大文档 (默认 5000 页、10000 个书签)，分别测量:
+    1. 处理单个文件: 将原始书签映射到处理后的文件 (原始页 i 对应第 2i 页)，书签挂在顶层。
+    2. 合并: 将书签挂在合并文件中该文件的顶层书签之下，页索引加上偏移量。
+每项都与旧版逐个书签调用 reader.get_page_number、逐层递归并以 parent=None 添加顶层书签的做法对比。
+
+用法 (在 pdf_insert 目录下运行):
+    python3 benchmark.py [--pages 5000] [--bookmarks 10000] [--repeat 3]
+"""
+
+import time
+import argparse
+from io import BytesIO
+
+import pdfinsert
+from PyPDF2 import PdfReader, PdfWriter
+
+PAGE_SIZE = (612, 792)
+OUTLINE_DEPTH = 4 # 每个书签之下最多嵌套的层数
+
+
+def best_of(repeat, func, setup=None):
+    """执行 func repeat 次 (每次之前调用 setup 并把其结果传给 func)，返回最短耗时 (秒)。"""
+    timings = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg) if setup is not None else func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def build_document(pages, bookmarks):
+    """生成 pages 页、bookmarks 个书签的 PDF 字节。书签按章/节/小节逐层嵌套，依次指向后面的页。"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(*PAGE_SIZE)
+    parents = [writer.get_outline_root()]
+    for idx in range(bookmarks):
+        depth = idx % OUTLINE_DEPTH # 0 为章，之后逐层嵌套在上一个书签之下
+        del parents[depth + 1:]
+        parents.append(writer.add_outline_item(f"第 {idx} 节", idx * pages // bookmarks, parent=parents[depth]))
+    packet = BytesIO()
+    writer.write(packet)
+    return packet.getvalue()
+
+
+def target_writer(pages):
+    """合并/输出用的目标 writer，页面先于书签加入 (与 pdfinsert 一致)。"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(*PAGE_SIZE)
+    return writer
+
+
+def legacy_add_nested_outline(reader, source_items, target_writer, target_parent, page_idx_transform_func):
+    """旧版的递归书签复制: 逐个书签调用 get_page_number，嵌套列表挂在同一个父项下。"""
+    for item in source_items:
+        if isinstance(item, list):
+            legacy_add_nested_outline(reader, item, target_writer, target_parent, page_idx_transform_func)
+            continue
+        source_page_index = reader.get_page_number(item.page)
+        target_writer.add_outline_item(item.title, page_idx_transform_func(source_page_index), parent=target_parent)
+
+
+def count_outline(writer):
+    """统计 writer 中的书签数和最大嵌套深度 (顶层为 0)。"""
+    count, max_depth = 0, -1
+    stack = [(writer.get_outline_root().get("/First"), 0)]
+    while stack:
+        ref, depth = stack.pop()
+        while ref is not None:
+            item = ref.get_object()
+            count += 1
+            max_depth = max(max_depth, depth)
+            if "/First" in item:
+                stack.append((item.raw_get("/First"), depth + 1))
+            ref = item.raw_get("/Next") if "/Next" in item else None
+    return count, max_depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pdfinsert 书签复制基准测试")
+    parser.add_argument("--pages", type=int, default=5000, help="文档页数（默认 5000）")
+    parser.add_argument("--bookmarks", type=int, default=10000, help="书签数（默认 10000）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量重复次数，取最短耗时（默认 3）")
+    args = parser.parse_args()
+
+    data = build_document(args.pages, args.bookmarks)
+    print(f"[文档] {args.pages} 页, {args.bookmarks} 个书签, {len(data) / 1024 / 1024:.1f} MB")
+
+    # 每次测量都使用新的 reader (与实际处理一样包含书签对象的解析)，目标 writer 中已加入全部页面
+    def fresh(pages, bookmark=False):
+        writer = target_writer(pages)
+        parent = writer.add_outline_item("文件", 0, parent=writer.get_outline_root()) if bookmark else None
+        return PdfReader(BytesIO(data)), writer, parent
+
+    def engine(transform):
+        return lambda target: pdfinsert.transfer_outline(
+            pdfinsert.OutlineIndex(target[0]), target[1], target[2], transform)
+
+    def legacy(transform):
+        return lambda target: legacy_add_nested_outline(target[0], target[0].outline, target[1], target[2], transform)
+
+    # 1. 处理单个文件: 书签挂在顶层，原始页 i 对应第 2i 页
+    double = lambda orig_idx: orig_idx * 2
+    new_time = best_of(args.repeat, engine(double), setup=lambda: fresh(args.pages * 2))
+    old_time = best_of(args.repeat, legacy(double), setup=lambda: fresh(args.pages * 2))
+    target = fresh(args.pages * 2)
+    engine(double)(target)
+    count, depth = count_outline(target[1])
+    print(f"[处理] {new_time * 1000:.1f} ms, 旧做法 {old_time * 1000:.1f} ms ({count} 个书签, 最大深度 {depth})")
+
+    # 2. 合并: 书签挂在该文件的顶层书签之下，页索引加上前面文件的页数
+    offset = args.pages
+    shifted = lambda idx_in_source: idx_in_source * 2 + offset
+    new_time = best_of(args.repeat, engine(shifted), setup=lambda: fresh(offset + args.pages * 2, bookmark=True))
+    old_time = best_of(args.repeat, legacy(shifted), setup=lambda: fresh(offset + args.pages * 2, bookmark=True))
+    print(f"[合并] {new_time * 1000:.1f} ms, 旧做法 {old_time * 1000:.1f} ms")
+
+    # 合并时复用处理阶段已建立的索引 (内存中的处理结果)，只剩添加书签本身
+    reader = PdfReader(BytesIO(data))
+    index = pdfinsert.OutlineIndex(reader)
+    reuse_time = best_of(args.repeat, lambda target: pdfinsert.transfer_outline(index, target[1], target[2], shifted),
+                         setup=lambda: fresh(offset + args.pages * 2, bookmark=True))
+    print(f"[合并] 复用索引: {reuse_time * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
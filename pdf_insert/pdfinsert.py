@@ -3,33 +3,64 @@
 """
 处理流程:
 1.  读取原始 PDF (位于 pdfs/ 或命令行指定)，备份至 backup/.
-2.  为原始 PDF 的每一页添加 1.5cm 上下边距，生成中间文件。
-3.  读取带边距的中间文件，在每一页后面添加一个与该页宽度相同的正方形空白页，生成另一个中间文件。
+2.  为原始 PDF 的每一页添加 1.5cm 上下边距。
+3.  在每一页后面添加一个与该页宽度相同的正方形空白页。
 4.  为所有页面（包括空白页）添加页码 (格式: "当前原始页码 / 原始总页码")，页码位于右下角。
+    步骤 2-4 在内存中一次完成，不生成中间文件。
 5.  保留原始 PDF 的书签结构，并将其附加到处理后的 PDF 文件中 (位于 output/)。
-6.  (默认模式) 将 output/ 目录中所有处理后的 PDF 文件合并到项目根目录的 merged_output.pdf。
+6.  (默认模式) 将所有处理后的 PDF 文件合并到项目根目录的 merged_output.pdf。处理结果直接在内存中交给合并，
+    不再从 output/ 重新读取。
 7.  (默认模式) 在合并后的 PDF 中创建层级式书签：顶层书签是原始文件名，其下嵌套该 PDF 文件原有的书签结构。
 
 默认行为:
 -   若无命令行参数，处理 pdfs/ 目录下的所有 PDF 文件，并执行合并。
 -   每次运行脚本时，会自动清理 output/, backup/ 目录及 merged_output.pdf。
+-   每个文件的处理结果按 (内容哈希, 处理参数) 缓存在 .cache/，未变化的文件直接复用，只重新合并。
 
 命令行参数:
--   `--clean`: 除了默认清理外，还会额外清空 pdfs/ 目录中的 PDF 文件。
+-   `--clean`: 除了默认清理外，还会额外清空 pdfs/ 目录中的 PDF 文件和 .cache/ 缓存。
+-   `--append`: 不清理上次的结果，只处理新增或修改过的文件，并以增量更新的方式追加到 merged_output.pdf。
+-   `--no-cache`: 不使用处理结果缓存，重新处理所有文件。
+-   `--merged-only`: 只生成 merged_output.pdf，不把各文件的处理结果写出到 output/。
+-   `--prefetch N`: 串行处理和合并时在后台线程中预读接下来的 N 个文件，并在后台写出处理结果 (默认 0 即关闭，适用于慢速磁盘)。
+-   `--serve [--socket]`: 作为常驻服务运行，通过 JSON-RPC 接收请求 (客户端见 pdfinsert_client.py)。
 -   `[inputs...]`: 可以指定一个或多个 PDF 文件或包含 PDF 的目录。若指定，则只处理这些输入，**不执行合并**。
+-   `- [-o PATH]` / `--frames`: 标准输入/输出模式，从标准输入 (或一个文件) 读取一个 PDF 或分帧流，
+    处理 (分帧流还会合并) 后写到标准输出 (或 PATH)，不读写任何目录。`<目录> -o PATH` 合并目录中的 PDF。
 """
 
 import os
 import sys
 import shutil
+import time
+import atexit
+import tempfile
+import weakref
+import multiprocessing.util
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter, Transformation
+from PyPDF2 import PageObject, PdfReader, PdfWriter, Transformation, generic
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject,
+                            NameObject, NumberObject)
 from reportlab.pdfgen import canvas
-from io import BytesIO
+from io import BytesIO, StringIO
 import traceback
 import re
 import argparse
-from typing import Optional, List, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import BinaryIO, Optional, List, Tuple, Union
+from contextlib import nullcontext, redirect_stderr, redirect_stdout
+from dataclasses import dataclass
+
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # 与 pdf_fill 共用的 pdf_common 位于仓库根目录
+from pdf_common.cache import CACHE_DIR_NAME, CACHE_MAX_BYTES, ResultCache
+from pdf_common.merge_index import MERGE_INDEX_SUFFIX, MergeIndex
+from pdf_common.pipeline import Prefetcher, WriteBehind, write_later
+from pdf_common.profiling import TraceProfiler
+from pdf_common.progress import ProgressReporter
+from pdf_common.service import WorkerService, require_params
+from pdf_common.sizes import parse_size
+from pdf_common.stdio import STDIN_NAME, STDIO_PATH, StdoutOutput, detach_stdout, read_frames, write_frame
+from pdf_common.writer import StreamingPdfWriter, add_object, deduplicate_objects, write_compact_pdf
 
 # --- 常量定义 --- 
 PROJECT_DIR = Path(__file__).resolve().parent
@@ -38,12 +69,28 @@ OUTPUT_DIR = PROJECT_DIR / "output"
 BACKUP_DIR = PROJECT_DIR / "backup"
 MERGED_FILENAME = "merged_output.pdf"
 MERGED_FILE_PATH = PROJECT_DIR / MERGED_FILENAME
+CACHE_DIR = PROJECT_DIR / CACHE_DIR_NAME # 处理结果缓存，不随每次运行的默认清理删除
 
 CM_TO_POINTS = 28.3464567 # 厘米到 PDF 点的转换因子
 MARGIN_CM = 1.5           # 边距大小 (厘米)
 TOP_MARGIN_PTS = MARGIN_CM * CM_TO_POINTS
 BOTTOM_MARGIN_PTS = MARGIN_CM * CM_TO_POINTS
 
+SHARD_SIZE = 500        # 大文件分片处理时每个分片包含的原始页数
+SHARD_THRESHOLD = 2000  # 原始页数超过此值 (且 --jobs > 1) 时自动按页范围分片
+CACHE_VERSION = 1 # 处理逻辑改变导致输出不同时递增，使旧缓存失效
+MEMORY_ESTIMATE_FACTOR = 6 # 普通合并的峰值内存约为原始输入总大小的倍数 (处理后文件约为原始的 2 倍；用于 --max-memory 估算)
+WATCH_INTERVAL = 1.0 # --watch 检查 pdfs/ 的间隔 (秒)
+WATCH_DEBOUNCE = 1.0 # 检测到变化后 pdfs/ 需保持这么多秒不再变化才开始处理，一批同时放入的文件只处理一次
+MERGE_INDEX_PATH = PROJECT_DIR / (MERGED_FILENAME + MERGE_INDEX_SUFFIX)
+SERVICE_SOCKET_ENV = "PDFINSERT_SOCKET" # 覆盖 --serve --socket 和客户端默认 socket 路径的环境变量
+PREFETCH_DEPTH = 0 # 串行处理时后台预读 (以及延后写出) 的文件数，默认关闭；输入输出在慢速磁盘上时可设为 2
+
+
+def display_path(path: Path) -> Path:
+    """日志中显示的路径: PROJECT_DIR 下的路径显示为相对路径，其他路径 (如 --serve 指定的目录) 原样显示。"""
+    return path.relative_to(PROJECT_DIR) if path.is_relative_to(PROJECT_DIR) else path
+
 # --- 清理函数 --- 
 def cleanup_generated_files():
     """清空 output/, backup/ 目录以及合并后的 PDF 文件。"""
@@ -61,6 +108,13 @@ def cleanup_generated_files():
             MERGED_FILE_PATH.unlink()
         except Exception as e:
             print(f"    [!] 警告: 删除 {MERGED_FILENAME} 失败: {e}")
+    MERGE_INDEX_PATH.unlink(missing_ok=True)
+
+def cleanup_result_cache():
+    """清空处理结果缓存目录 (--clean 参数触发)。"""
+    print(f"[*] 清理处理结果缓存 {CACHE_DIR.name}/ (--clean 激活)...")
+    if CACHE_DIR.exists():
+        shutil.rmtree(CACHE_DIR)
 
 def cleanup_input_files():
     """清空 pdfs/ 目录中的 PDF 文件 (--clean 参数触发)。"""
@@ -84,276 +138,982 @@ def cleanup_input_files():
     else:
         print(f"    [*] 目录 {INPUT_DIR.relative_to(PROJECT_DIR)}/ 不存在, 跳过清理.")
 
-# --- PDF 处理辅助函数 --- 
+# --- 性能分析 (--profile) --- 
+_profiler: Optional[TraceProfiler] = None # 启用 --profile 时当前进程的 TraceProfiler
+_NO_PROFILE = nullcontext()
+
+
+def profile_stage(name: str, **args):
+    """返回记录 name 阶段耗时的上下文管理器，args 作为事件参数；未启用 --profile 时什么也不做。"""
+    if _profiler is None:
+        return _NO_PROFILE
+    return _profiler.stage(name, args)
+
+
+def profile_count(name: str, value: int = 1):
+    """累加 --profile 的计数器。"""
+    if _profiler is not None:
+        _profiler.counters[name] += value
+
+
+def profile_file_read(pdf_file: Path):
+    """把 pdf_file 的大小计入 bytes_read 计数器。"""
+    if _profiler is not None:
+        _profiler.counters["bytes_read"] += pdf_file.stat().st_size
+
+
+def _init_worker(parts_dir: Optional[Path], cprofile_path: Optional[str]):
+    """(子进程) 进程池的 initializer。
 
-# 修改：递归添加嵌套书签的辅助函数
-def add_nested_outline(reader, source_items, target_writer, target_parent, page_idx_transform_func):
+    进度事件只由主进程输出，fork 出的子进程继承的 _progress 因此清除。启用 --profile 时
+    (parts_dir 非空) 为本进程创建 TraceProfiler，并在进程退出时写出事件；fork 出的子进程
+    会继承主进程的记录器及其中已有的事件，因此总是重新创建。
     """
-    递归地将源书签项添加到目标写入器中，作为指定父项的子项。
+    global _profiler, _progress
+    _progress = None
+    _profiler = None
+    if parts_dir is not None:
+        _profiler = TraceProfiler(parts_dir, cprofile_path)
+        multiprocessing.util.Finalize(None, _profiler.dump_part, exitpriority=10)
 
-    Args:
-        reader: 源 PdfReader 对象，用于解析页码对象到源索引。
-        source_items: 从源 reader 获取的书签项列表 (reader.outline 或 item.children)。
-        target_writer: 目标 PdfWriter 对象。
-        target_parent: 在 target_writer 中，这些书签应该附加到的父书签项。
-        page_idx_transform_func: 一个函数，接收源文件中的0-based页索引，
-                                 返回目标写入器中对应的0-based页索引。
+
+def process_pool(jobs: int) -> ProcessPoolExecutor:
+    """创建进程池；启用 --profile 时子进程同样记录各阶段耗时。"""
+    profile_args = (_profiler.parts_dir, _profiler.cprofile_path) if _profiler is not None else (None, None)
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=profile_args)
+
+
+_request_cleanups: Optional[list] = None # --serve 工作进程中当前请求结束时要执行的清理函数 [(func, args), ...]
+
+
+def register_cleanup(func, *args):
+    """注册退出时执行的清理函数；在 --serve 的工作进程中改为在当前请求结束时执行。"""
+    if _request_cleanups is not None:
+        _request_cleanups.append((func, args))
+    else:
+        atexit.register(func, *args)
+
+
+def enable_profiling(trace_path: Path, cprofile_path: Optional[str] = None):
+    """启用 --profile: 主进程开始记录，并在退出时写出 trace 文件和汇总。"""
+    global _profiler
+    _profiler = TraceProfiler(tempfile.mkdtemp(prefix="pdfinsert_profile_"), cprofile_path, "pdfinsert")
+
+    def finish():
+        totals, counters = _profiler.write_trace(trace_path)
+        print(f"[性能] 已写出 trace: {trace_path}" + (f", cProfile: {cprofile_path}" if cprofile_path else ""))
+        if totals:
+            print("[性能] 各阶段耗时 (所有进程合计): "
+                  + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in totals.most_common()))
+        if counters:
+            print("[性能] 计数: " + ", ".join(f"{name} {value}" for name, value in sorted(counters.items())))
+    register_cleanup(finish)
+
+
+# --- 进度输出 (--progress jsonl) --- 
+_progress: Optional[ProgressReporter] = None # --progress jsonl 时主进程的 ProgressReporter
+
+
+def enable_progress(fd: int):
+    """启用 --progress jsonl: 进度事件写入 fd，原来输出到标准输出的文字日志全部丢弃。
+
+    在文件描述符层面把标准输出重定向到空设备 (子进程也会继承)，因此 fd 为 1 时事件流中
+    不会混入任何文字日志；traceback 等仍输出到标准错误。
+    在 --serve 的工作进程中则忽略 fd：事件作为本次请求的标准输出返回给客户端，文字日志丢弃。
     """
-    from PyPDF2.generic import OutlineItem # 确保类型检查可用
+    global _progress
+    if _in_service:
+        _progress = ProgressReporter(sys.stdout, "pdfinsert")
+        sys.stdout = StringIO() # 请求结束时由 _service_call 恢复
+        return
+    stream = os.fdopen(os.dup(fd), "w", encoding="utf-8")
+    sys.stdout.flush()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+    _progress = ProgressReporter(stream, "pdfinsert")
+
+
+def report_error(message: str):
+    """输出错误信息；启用 --progress jsonl 时同时输出 error 事件。"""
+    print(message)
+    if _progress is not None:
+        _progress.error(message)
+
+
+def report_file_finished(pdf_file: Path, output_file: Optional[Path], pages: Optional[int], ok: bool = True,
+                         output_size: Optional[int] = None, **fields):
+    """把 process_pdf 的结果报告给 --progress；output_file 为 None 表示没有写出处理结果 (--merged-only)。
+    output_size 是交给延后写出、可能尚未写完的 output_file 的大小。"""
+    if _progress is None:
+        return
+    if not ok:
+        _progress.file_finished(pdf_file, pages, ok=False)
+        return
+    if output_file is not None:
+        _progress.written(output_file, output_size if output_size is not None else output_file.stat().st_size)
+        fields["output"] = str(output_file)
+    _progress.file_finished(pdf_file, pages, **fields)
+
+
+# --- 预读与延后写出 (--prefetch) --- 
+def write_file(path: Path, data: bytes, stat_source: Optional[Path] = None):
+    """把 data 写入 path；给定 stat_source 时同时复制其修改时间等元数据 (同 shutil.copy2)。"""
+    path.write_bytes(data)
+    if stat_source is not None:
+        shutil.copystat(stat_source, path)
+
+
+def report_io_queues(prefetcher: Optional[Prefetcher], write_behind: Optional[WriteBehind] = None):
+    """打印预读和延后写出队列的等待时间，并报告延后写出失败的任务。"""
+    parts = []
+    if prefetcher is not None:
+        parts.append(f"预读 {prefetcher.count} 个文件, 等待读取 {prefetcher.wait_seconds:.2f} 秒")
+    if write_behind is not None:
+        parts.append(f"延后写出 {write_behind.count} 个文件, 等待写出队列 {write_behind.wait_seconds:.2f} 秒")
+        for label, e in write_behind.failures:
+            report_error(f"[!] 错误: 延后写出 {label} 失败: {e}")
+    if parts:
+        print(f"[*] {'; '.join(parts)}")
 
-    for item in source_items:
+
+# --- PDF 处理辅助函数 --- 
+
+class OutlineIndex:
+    """一个 PdfReader 的书签树，展开为按先序排列的 entries: [(父书签位置, 标题, 源页索引), ...]。
+
+    页面对象号 -> 页索引的映射只建立一次，书签树直接按 /First、/Next 链用显式栈迭代遍历，
+    不经过 reader.outline (逐层递归并为每个书签构造 Destination)，也不逐个书签调用 reader.get_page_number。
+    父书签位置为 -1 表示顶层书签；无法解析页码的书签连同其子书签一起跳过。
+    """
+
+    def __init__(self, reader: PdfReader):
+        self.entries: List[Tuple[int, str, int]] = []
         try:
-            if isinstance(item, list):
-                add_nested_outline(reader, item, target_writer, target_parent, page_idx_transform_func)
+            self._walk(reader)
+        except Exception as e:
+            print(f"    [!] 警告: 读取书签时出错: {e}. 只保留已读取的 {len(self.entries)} 个书签。")
+
+    def _walk(self, reader: PdfReader):
+        page_count = len(reader.pages)
+        page_indices = {page.indirect_reference.idnum: idx for idx, page in enumerate(reader.pages)}
+        named_destinations = None # 只在遇到命名目标时读取
+
+        outlines = reader.trailer["/Root"].get("/Outlines")
+        outlines = outlines.get_object() if outlines is not None else None
+        if not isinstance(outlines, DictionaryObject) or "/First" not in outlines:
+            return
+        stack = [(outlines.raw_get("/First"), -1)] # (书签的引用, 父书签位置)
+        visited = set() # 防止损坏文件中的 /Next 或 /First 链成环
+        while stack:
+            ref, parent_pos = stack.pop()
+            if isinstance(ref, IndirectObject):
+                if ref.idnum in visited:
+                    continue
+                visited.add(ref.idnum)
+            item = ref.get_object()
+            if not isinstance(item, DictionaryObject):
+                print(f"    [!] 警告: 书签不是字典对象 (可能结构不标准): {item}. 跳过此书签。")
                 continue
+            if "/Next" in item:
+                stack.append((item.raw_get("/Next"), parent_pos))
 
-            title = item.title
-            page_object = item.page
+            title = item["/Title"] if "/Title" in item else ""
+            dest = item["/Dest"] if "/Dest" in item else None
+            if dest is None and "/A" in item:
+                action = item["/A"]
+                if action.get("/S") == "/GoTo" and "/D" in action:
+                    dest = action["/D"]
+            if isinstance(dest, (str, bytes)): # 命名目标
+                if named_destinations is None:
+                    named_destinations = reader.named_destinations
+                dest = named_destinations.get(dest if isinstance(dest, str) else dest.decode("latin-1"))
+                page = dest.raw_get("/Page") if dest is not None and "/Page" in dest else None
+            else:
+                page = dest[0] if isinstance(dest, ArrayObject) and dest else None
 
-            try:
-                 source_page_index = reader.get_page_number(page_object)
-            except Exception as page_err:
-                 print(f"    [!] 警告: 无法解析书签 '{title}' 的页码对象: {page_err}. 跳过此书签。")
-                 continue
-
-            # 使用转换函数计算目标页码
-            target_page_index = page_idx_transform_func(source_page_index)
-
-            new_item = target_writer.add_outline_item(
-                title,
-                target_page_index,
-                parent=target_parent
-            )
+            if isinstance(page, IndirectObject):
+                source_page_index = page_indices.get(page.idnum)
+            elif isinstance(page, int) and 0 <= page < page_count:
+                source_page_index = int(page) # 合并时页面尚未加入而写成页索引的旧书签
+            else:
+                source_page_index = None
+            if source_page_index is None:
+                print(f"    [!] 警告: 无法解析书签 '{title}' 的页码对象: {page}. 跳过此书签。")
+                continue
 
-            # 检查子书签 - 确保 children 是可迭代的列表或元组
-            if hasattr(item, 'children') and isinstance(item.children, (list, tuple)) and item.children:
-                 add_nested_outline(reader, item.children, target_writer, new_item, page_idx_transform_func)
+            position = len(self.entries)
+            self.entries.append((parent_pos, title, source_page_index))
+            if "/First" in item: # 先于同层的下一个书签出栈，保持先序
+                stack.append((item.raw_get("/First"), position))
 
-        except AttributeError as ae:
-            print(f"    [!] 警告: 处理书签时遇到属性错误 (可能结构不标准): {ae}. 书签内容: {item}")
-        except Exception as e:
-            print(f"    [!] 警告: 处理书签 '{getattr(item, 'title', '未知标题')}' 时出错: {e}")
+    def __len__(self) -> int:
+        return len(self.entries)
 
 
-def add_page_numbers(input_pdf: Path, 
-                     output_pdf: Path, 
-                     font_name: str = "Helvetica", 
-                     font_size: int = 10, 
-                     original_outline_struct: Optional[List] = None, 
-                     outline_source_reader: Optional[PdfReader] = None):
-    """为PDF添加页码(右下角)，并可选择性地添加调整后的原始书签。
-    
+_OUTLINE_INDEXES: "weakref.WeakKeyDictionary[PdfReader, OutlineIndex]" = weakref.WeakKeyDictionary()
+_OUTLINE_ROOTS: "weakref.WeakKeyDictionary[PdfWriter, IndirectObject]" = weakref.WeakKeyDictionary()
+
+
+def outline_index(reader: PdfReader, index: Optional[OutlineIndex] = None) -> OutlineIndex:
+    """返回 reader 的书签索引，每个 reader 只建立一次 (处理时和合并时共用同一个原始 reader)。
+    给定 index (预读线程中建立的索引) 时把它登记为 reader 的索引。
+    流式合并会就地改写页面对象，因此必须在页面加入 StreamingPdfWriter 之前调用。"""
+    if index is not None:
+        _OUTLINE_INDEXES[reader] = index
+        return index
+    index = _OUTLINE_INDEXES.get(reader)
+    if index is None:
+        index = _OUTLINE_INDEXES[reader] = OutlineIndex(reader)
+    return index
+
+
+def outline_root(writer: Union[PdfWriter, "StreamingPdfWriter"]) -> Optional[IndirectObject]:
+    """返回添加顶层书签时使用的 parent。
+
+    PdfWriter.add_outline_item 在 parent 为 None 时每次都要在全部对象中线性查找书签根，
+    逐个添加顶层书签的总耗时与书签数 × 对象数成正比；这里每个 writer 只查找一次。
+    StreamingPdfWriter 的顶层书签不需要 parent，返回 None。
+    """
+    if not isinstance(writer, PdfWriter):
+        return None
+    root = _OUTLINE_ROOTS.get(writer)
+    if root is None:
+        root = _OUTLINE_ROOTS[writer] = writer.get_outline_root()
+    return root
+
+
+def transfer_outline(index: OutlineIndex, target_writer: Union[PdfWriter, "StreamingPdfWriter"],
+                     target_parent, page_idx_transform_func) -> int:
+    """
+    将书签索引中的书签按原有层级添加到目标写入器中，作为指定父项的子项。
+
     Args:
-        input_pdf (Path): 输入的PDF文件路径 (通常是包含边距和空白页的临时文件)。
-        output_pdf (Path): 最终输出的文件路径 (位于 output/ 目录)。
-        font_name (str): 页码字体名称。
-        font_size (int): 页码字体大小。
-        original_outline_struct (Optional[List]): 从原始输入PDF读取的书签结构。
-        outline_source_reader (Optional[PdfReader]): 用于解析原始书签页码对象的 PdfReader。
+        index: 源 reader 的书签索引 (outline_index)。
+        target_writer: 目标 PdfWriter 或 StreamingPdfWriter 对象。
+        target_parent: 在 target_writer 中，这些书签应该附加到的父书签项；None 表示顶层。
+        page_idx_transform_func: 一个函数，接收源文件中的0-based页索引，
+                                 返回目标写入器中对应的0-based页索引。
 
     Returns:
-        Optional[Path]: 成功时返回 output_pdf 路径，失败时返回 None。
+        int: 添加的书签数。
     """
-    try:
-        reader = PdfReader(str(input_pdf)) # 读取包含边距和空白页的文件
-        writer = PdfWriter()
-        total_pages_in_temp_file = len(reader.pages)
-        original_total_pages = total_pages_in_temp_file // 2
-        
-        # 页数检查与警告
-        if total_pages_in_temp_file % 2 != 0:
-             print(f"    [!] 警告: 文件 '{input_pdf.name}' 进行页码编号时发现奇数页 ({total_pages_in_temp_file})。")
-             print(f"              这可能表示之前的处理步骤（边距或空白页添加）未完全成功。")
-             print(f"              将尝试基于 {original_total_pages} 个原始页进行编号，但总数可能不准确。")
-        elif original_total_pages == 0 and total_pages_in_temp_file > 0:
-             print(f"    [!] 警告: 页码编号时发现总页数为 {total_pages_in_temp_file} 但计算出的原始页数为 0。")
-             original_total_pages = total_pages_in_temp_file // 2
-
-        margin_bottom = 30 # 页码距离底部的边距 (points)
-        margin_right = 30  # 页码距离右侧的边距 (points)
-
-        # 添加页码覆盖层
-        for i in range(total_pages_in_temp_file):
-            page = reader.pages[i]
-            current_original_page_num = (i // 2) + 1 # 原始文档中的页码
-            page_width = float(page.mediabox.width)
-            page_height = float(page.mediabox.height)
-            
-            packet = BytesIO()
-            c = canvas.Canvas(packet, pagesize=(page_width, page_height))
+    if target_parent is None:
+        target_parent = outline_root(target_writer)
+    handles = []
+    for parent_pos, title, source_page_index in index.entries:
+        handles.append(target_writer.add_outline_item(
+            title,
+            page_idx_transform_func(source_page_index),
+            parent=handles[parent_pos] if parent_pos >= 0 else target_parent
+        ))
+    return len(handles)
+
+
+# --- 页码覆盖层缓存 --- 
+PAGE_NUMBER_MARGIN_BOTTOM = 30 # 页码距离底部的边距 (points)
+PAGE_NUMBER_MARGIN_RIGHT = 30  # 页码距离右侧的边距 (points)
+PAGE_NUMBER_FONT = "Helvetica"
+PAGE_NUMBER_FONT_SIZE = 10
+
+class OverlayCache:
+    """页码覆盖层缓存。
+
+    覆盖层只包含右下角的页码文本，其位置只取决于页面宽度，因此以
+    (页码文本, 页面宽度, 字体, 字号) 为键：原始页与其后的同宽空白页共用一个覆盖层，
+    不同文件中相同的页码与宽度组合也会复用。未缓存的键在 prepare() 中
+    通过一个多页画布一次性渲染，并且只解析一次。
+
+    统计: 每个键第一次被使用记为未命中 (misses)，之后的使用记为命中 (hits)；rendered 是实际渲染的覆盖层数。
+    工作进程各有一份缓存，统计经 stats()/since() 取出增量后由主进程 add() 汇总。
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self._served = set()
+        self.hits = 0
+        self.misses = 0
+        self.rendered = 0
+
+    def prepare(self, keys, font_name: str, font_size: int):
+        """批量渲染尚未缓存的 (页码文本, 页面宽度) 覆盖层。"""
+        missing = []
+        for text, width in keys:
+            cache_key = (text, width, font_name, font_size)
+            if cache_key not in self._pages and cache_key not in missing:
+                missing.append(cache_key)
+        if not missing:
+            return
+
+        packet = BytesIO()
+        c = canvas.Canvas(packet, pageCompression=0) # 空白页直接引用覆盖层的内容流，不压缩以便 --compact 统一压缩
+        for text, width, _, _ in missing:
+            c.setPageSize((width, width))
             c.setFont(font_name, font_size)
-            page_number_text = f"{current_original_page_num} / {original_total_pages}"
-            x_coordinate = page_width - margin_right
-            y_coordinate = margin_bottom
-            c.drawRightString(x_coordinate, y_coordinate, page_number_text)
-            c.save()
-            packet.seek(0)
-            
+            c.drawRightString(width - PAGE_NUMBER_MARGIN_RIGHT, PAGE_NUMBER_MARGIN_BOTTOM, text)
+            c.showPage()
+        c.save()
+        packet.seek(0)
+
+        overlay_reader = PdfReader(packet)
+        for cache_key, overlay_page in zip(missing, overlay_reader.pages):
+            self._pages[cache_key] = overlay_page
+        self.rendered += len(missing)
+
+    def get(self, key, font_name: str, font_size: int):
+        """返回 (页码文本, 页面宽度) 对应的覆盖层页面。"""
+        text, width = key
+        cache_key = (text, width, font_name, font_size)
+        if cache_key not in self._pages:
+            self.prepare([key], font_name, font_size)
+        if cache_key in self._served:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._served.add(cache_key)
+        return self._pages[cache_key]
+
+    def stats(self) -> Tuple[int, int, int]:
+        return self.hits, self.misses, self.rendered
+
+    def since(self, before: Tuple[int, int, int]) -> Tuple[int, int, int]:
+        """自 before (此前 stats() 的返回值) 以来的统计增量。"""
+        return tuple(now - then for now, then in zip(self.stats(), before))
+
+    def add(self, delta: Tuple[int, int, int]):
+        """汇总工作进程传回的统计增量。"""
+        self.hits, self.misses, self.rendered = (now + more for now, more in zip(self.stats(), delta))
+
+    def reset_stats(self):
+        self.hits = self.misses = self.rendered = 0
+
+    def report(self) -> str:
+        return f"页码覆盖层缓存: 命中 {self.hits}, 未命中 {self.misses} (渲染 {self.rendered} 个)"
+
+OVERLAY_CACHE = OverlayCache()
+
+
+# --- 处理结果缓存 --- 
+def open_result_cache(max_bytes: int = CACHE_MAX_BYTES) -> ResultCache:
+    """返回项目目录下的处理结果缓存 (每个文件最终的处理结果)。
+
+    默认清理会清空 output/，但内容与处理参数 (边距、页码位置、字体等) 都未变化的文件
+    可以直接从缓存复制上次的结果，只需重新合并。
+    """
+    return ResultCache(CACHE_DIR, max_bytes, (CACHE_VERSION, MARGIN_CM, PAGE_NUMBER_MARGIN_BOTTOM,
+                                              PAGE_NUMBER_MARGIN_RIGHT, PAGE_NUMBER_FONT, PAGE_NUMBER_FONT_SIZE))
+
+
+def report_caches(result_cache: Optional[ResultCache] = None):
+    """打印缓存统计，并在结果缓存超出上限时淘汰旧条目。"""
+    print(f"[*] {OVERLAY_CACHE.report()}")
+    if result_cache is not None:
+        print(f"[*] {result_cache.report()}")
+        removed, freed = result_cache.evict()
+        if removed:
+            print(f"[*] 处理结果缓存超出上限，已淘汰 {removed} 个最久未使用的条目 ({freed / 1024 ** 2:.1f} MB)")
+
+
+def build_processed_pages(original_input_reader: PdfReader, page_start: int, page_end: int,
+                          original_total_pages: int, writer: PdfWriter, filename: str = "",
+                          font_name: str = PAGE_NUMBER_FONT, font_size: int = PAGE_NUMBER_FONT_SIZE):
+    """对原始页 [page_start, page_end) 在内存中一次完成步骤 2-4 (书签除外)，页面依次加入 writer。
+
+    每个原始页合并到一个上下各加 MARGIN_CM 边距的新页面，其后插入一个与其同宽的正方形空白页，
+    两页都叠加右下角的页码覆盖层 "当前原始页码 / original_total_pages"。不写出任何中间文件。
+    空白页不经过 merge_page，见 _shared_blank_page。
+    """
+    original_page_count = page_end - page_start
+    profile_count("pages", original_page_count)
+
+    # 预先收集所有页面需要的覆盖层，未缓存的在一次画布渲染中批量生成 (空白页与其前的原始页同宽，共用一个覆盖层)
+    with profile_stage("overlay_render", file=filename):
+        overlay_keys = [(f"{i + 1} / {original_total_pages}", float(original_input_reader.pages[i].mediabox.width))
+                        for i in range(page_start, page_end)]
+        OVERLAY_CACHE.prepare(overlay_keys, font_name, font_size)
+
+    transform = Transformation().translate(tx=0, ty=BOTTOM_MARGIN_PTS)
+    shared_objects: dict = {} # 本 writer 中空白页共享的 Resources 和各宽度的 MediaBox
+    with profile_stage("build_pages", file=filename, pages=original_page_count * 2):
+        for i, overlay_key in zip(range(page_start, page_end), overlay_keys):
+            original_page = original_input_reader.pages[i]
+            width = overlay_key[1]
+            height = float(original_page.mediabox.height) + TOP_MARGIN_PTS + BOTTOM_MARGIN_PTS
+            overlay_page = OVERLAY_CACHE.get(overlay_key, font_name, font_size)
+
+            # 先合并，再变换
+            margin_page = PageObject.create_blank_page(None, width, height)
+            margin_page.merge_page(original_page)
+            margin_page.add_transformation(transform)
             try:
-                overlay_reader = PdfReader(packet)
-                overlay_page = overlay_reader.pages[0]
-                page.merge_page(overlay_page)
+                margin_page.merge_page(overlay_page)
             except Exception as e:
-                print(f"    [!] 警告: 合并页码失败 (页 {i+1} / 文件 {input_pdf.name}): {e}")
-            writer.add_page(page)
-
-        # 添加原始书签（调整后）
-        if original_outline_struct and outline_source_reader:
-            print(f"    -> 为 {output_pdf.name} 添加处理后的原始书签...")
-            # 页面映射函数: 原始0索引 -> 当前写入器中的0索引 (每页后加一页空白，索引*2)
-            page_map_func = lambda orig_idx: orig_idx * 2
-            add_nested_outline(
-                reader=outline_source_reader, 
-                source_items=original_outline_struct, 
-                target_writer=writer, 
-                target_parent=None,   # 添加到根级别
-                page_idx_transform_func=page_map_func
+                print(f"    [!] 警告: 合并页码失败 (原始页 {i + 1} / 文件 {filename}): {e}")
+            # merge_page 生成的 ContentStream 每次取数据都由操作列表重新序列化；页面在写出、合并和去重时
+            # 会被多次序列化，这里只生成一次，换成普通的流对象
+            contents = DecodedStreamObject()
+            contents.set_data(margin_page.get_contents().get_data())
+            margin_page[NameObject("/Contents")] = contents
+            writer.add_page(margin_page)
+            writer.add_page(_shared_blank_page(writer, width, overlay_page, shared_objects))
+    profile_count("overlays", original_page_count * 2)
+
+
+def _shared_blank_page(writer: PdfWriter, width: float, overlay_page: PageObject, shared_objects: dict) -> PageObject:
+    """返回宽 width 的正方形空白页，直接以覆盖层页面的内容流作为页面内容。
+
+    空白页上只有页码，合并到空页面 (merge_page) 只会多包一层裁剪并复制一份资源字典。这里
+    writer 中所有空白页引用同一个 Resources 对象，同宽的空白页再共用一个 MediaBox 数组，
+    每页只有页面字典和自己的页码内容流 (加入 writer 时从覆盖层 reader 复制，同一覆盖层只复制一次)。
+    """
+    if "/Resources" not in shared_objects:
+        # reportlab 把 /Font 等子字典写成间接对象，这里展开为直接对象，使之成为合并时可去重的资源字典
+        resources = DictionaryObject({key: value.get_object() for key, value in overlay_page["/Resources"].items()})
+        shared_objects["/Resources"] = add_object(writer, resources)
+    if width not in shared_objects:
+        shared_objects[width] = add_object(writer, ArrayObject(
+            [NumberObject(0), NumberObject(0), FloatObject(width), FloatObject(width)]))
+    blank_page = PageObject(writer)
+    blank_page.update({
+        NameObject("/Type"): NameObject("/Page"),
+        NameObject("/MediaBox"): shared_objects[width],
+        NameObject("/Resources"): shared_objects["/Resources"],
+        NameObject("/Contents"): overlay_page.raw_get("/Contents"),
+    })
+    return blank_page
+
+
+def add_original_outline(original_outline: OutlineIndex, output_writer: PdfWriter, filename: str):
+    """将原始书签添加到处理后的文件 (原始页 i 对应输出中的第 2i 页)。"""
+    if original_outline:
+        print(f"    -> 为 {filename} 添加处理后的原始书签...")
+        with profile_stage("outline", file=filename, items=len(original_outline)):
+            transfer_outline(
+                index=original_outline,
+                target_writer=output_writer,
+                target_parent=None,
+                page_idx_transform_func=lambda orig_idx: orig_idx * 2
             )
 
-        # 写入最终输出文件
-        with open(output_pdf, "wb") as fp:
-            writer.write(fp)
-        return output_pdf # 成功
-            
-    except Exception as e:
-        print(f"[!] 错误: 添加页码或书签时出错 {input_pdf.relative_to(PROJECT_DIR)} -> {output_pdf.relative_to(PROJECT_DIR)}")
-        traceback.print_exc()
-        try:
-            # 尝试复制中间文件作为调试线索
-            shutil.copy2(str(input_pdf), str(output_pdf))
-            print(f"    [*] 信息: 因页码/书签添加错误，已复制中间文件到输出: {output_pdf.relative_to(PROJECT_DIR)}")
-        except Exception as copy_e:
-            print(f"[!] 错误: 复制中间文件失败: {copy_e}")
-        return None # 失败
 
+def page_range_shards(page_count: int, shard_size: int = SHARD_SIZE,
+                      shard_threshold: int = SHARD_THRESHOLD) -> List[Tuple[int, int]]:
+    """将原始页划分为 [(起始页, 结束页), ...] (左闭右开)；页数不超过阈值时不分片。"""
+    if page_count <= shard_threshold or shard_size <= 0:
+        return [(0, page_count)]
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+
+def _process_pdf_shard(input_file: Path, page_start: int, page_end: int,
+                       original_total_pages: int) -> Tuple[bytes, Tuple[int, int, int]]:
+    """(子进程) 对原始页 [page_start, page_end) 执行步骤 2-4。
+
+    Returns:
+        Tuple[bytes, Tuple[int, int, int]]: (分片结果 PDF 的内容 (不含书签), 覆盖层缓存统计的增量 (见 OverlayCache.since))。
+    """
+    filename = input_file.name
+    overlay_before = OVERLAY_CACHE.stats()
+    with profile_stage("parse", file=filename, page_start=page_start, page_end=page_end):
+        original_input_reader = PdfReader(str(input_file), strict=False)
+    profile_file_read(input_file)
+    shard_writer = PdfWriter()
+    build_processed_pages(original_input_reader, page_start, page_end, original_total_pages, shard_writer, filename)
+    packet = BytesIO()
+    with profile_stage("write", file=filename, page_start=page_start):
+        shard_writer.write(packet)
+    return packet.getvalue(), OVERLAY_CACHE.since(overlay_before)
+
+
+class PrefetchedInput:
+    """预读线程为一个 PDF 预先完成的工作：文件内容、由内容解析的 PdfReader (已读取页面树) 及其书签索引。
+    解析失败时 reader 为 None，使用方改为按原来的方式解析并报告错误。"""
+
+    def __init__(self, data: bytes, reader: Optional[PdfReader], outline: Optional[OutlineIndex]):
+        self.data = data
+        self.reader = reader
+        self.outline = outline
+
+    @staticmethod
+    def load(pdf_file: Path, stage: str = "prefetch", max_pages: Optional[int] = None) -> "PrefetchedInput":
+        """(预读线程) 读入 pdf_file 并预先解析，耗时记为 stage 阶段。
+        页数超过 max_pages 时只读取页面树，不建立书签索引 (outline 为 None)。"""
+        with profile_stage(stage, file=pdf_file.name):
+            data = pdf_file.read_bytes()
+            try:
+                reader = PdfReader(BytesIO(data), strict=False)
+                if max_pages is not None and len(reader.pages) > max_pages:
+                    return PrefetchedInput(data, reader, None)
+                outline = OutlineIndex(reader)
+            except Exception:
+                reader, outline = None, None
+        return PrefetchedInput(data, reader, outline)
+
+
+class ProcessedPdf:
+    """process_pdf 的结果：一个文件是否处理成功、写出的 output/ 文件，以及合并时使用的文档。
+
+    合并时使用的文档 (document) 是以下之一:
+    -   (PdfWriter, 原始 PdfReader): 刚在内存中处理完的文件。合并直接取 writer 中的页面，书签从
+        原始 reader 映射 (原始页 i 对应第 2i 页)，不必再解析写出到 output/ 的文件。
+    -   Path / bytes: 命中缓存的结果、子进程传回的结果或处理失败时代替它合并的原始文件，合并时才解析。
+    -   PdfReader: 已由预读线程解析的 output/ 中的文件 (merge_pdfs_with_bookmarks)。
+    -   None: 没有可合并的内容 (空文件、子进程崩溃)。
+    """
+
+    def __init__(self, input_file: Path, ok: bool, output_file: Optional[Path] = None,
+                 document: Union[None, Path, bytes, PdfReader, Tuple[PdfWriter, PdfReader]] = None):
+        self.input_file = input_file
+        self.ok = ok
+        self.output_file = output_file # 写出到 output/ 的处理结果；--merged-only 或失败时为 None
+        self.document = document
+
+    @property
+    def name(self) -> str:
+        return self.input_file.name
 
-def process_pdf(input_file: Path, output_dir: Path, backup_dir: Path) -> Optional[Path]:
-    """处理单个PDF文件: 1. 备份 2. 加边距 3. 加空白页 4. 加页码和书签"""
-    relative_input_path = input_file.relative_to(PROJECT_DIR) if input_file.is_relative_to(PROJECT_DIR) else input_file
+    def describe(self) -> str:
+        """合并日志中显示的来源。"""
+        if isinstance(self.document, Path):
+            return str(display_path(self.document))
+        return f"{self.name} (内存)"
+
+    def open(self, readers: Optional["ResidentReaders"] = None) -> Tuple[Union[PdfReader, PdfWriter], PdfReader, int]:
+        """返回 (页面来源, 书签来源 reader, 书签页索引的倍数)。
+        Path 文档优先复用 readers 中未变化文件的 reader，新读取的 reader 也放入其中。"""
+        if isinstance(self.document, tuple):
+            writer, original_reader = self.document
+            return writer, original_reader, 2
+        if isinstance(self.document, PdfReader):
+            return self.document, self.document, 1
+        reader = readers.get(self.document) if readers is not None and isinstance(self.document, Path) else None
+        if reader is None:
+            with profile_stage("parse", file=self.name):
+                if isinstance(self.document, bytes):
+                    reader = PdfReader(BytesIO(self.document), strict=False)
+                    profile_count("bytes_read", len(self.document))
+                else:
+                    reader = PdfReader(str(self.document), strict=False)
+                    profile_file_read(self.document)
+            if readers is not None and isinstance(self.document, Path):
+                readers.put(self.document, reader)
+        return reader, reader, 1
+
+    def detached(self) -> "ProcessedPdf":
+        """(子进程) 返回可以传回主进程的结果：内存中的文档改为写出的 output/ 文件，未写出时改为其字节内容。"""
+        if not isinstance(self.document, tuple):
+            return self
+        if self.output_file is not None:
+            return ProcessedPdf(self.input_file, self.ok, self.output_file, self.output_file)
+        packet = BytesIO()
+        self.document[0].write(packet)
+        return ProcessedPdf(self.input_file, self.ok, None, packet.getvalue())
+
+
+def process_pdf(input_file: Path, output_dir: Optional[Path], backup_dir: Path, jobs: int = 1,
+                shard_size: int = SHARD_SIZE, shard_threshold: int = SHARD_THRESHOLD,
+                result_cache: Optional[ResultCache] = None, prefetched: Optional[PrefetchedInput] = None,
+                write_behind: Optional[WriteBehind] = None, shard_futures: Optional[list] = None) -> ProcessedPdf:
+    """处理单个PDF文件: 1. 备份 2. 加边距 3. 加空白页 4. 加页码和书签
+
+    步骤 2-4 在内存中对原始 reader 一次完成 (见 build_processed_pages)，只在最后写出一次输出文件。
+    jobs 大于 1 且原始页数超过 shard_threshold 时，按 shard_size 页拆分为多个分片，
+    在进程池中分别执行步骤 2-4，再按顺序拼接，并将原始书签映射到拼接后的页码上；shard_futures 是
+    iter_processed_in_order 已经提交的各分片的 _process_pdf_shard 任务 (与 page_range_shards 的结果一一对应)，
+    未给定时临时创建一个进程池。
+    给定 result_cache 时，内容和处理参数都未变化的文件直接复制缓存的结果，跳过步骤 2-4。
+    output_dir 为 None (--merged-only) 时不写出处理结果，只保留在返回的 ProcessedPdf 中供合并使用。
+    给定 prefetched (见 iter_processed_serially) 时使用预读的文件内容和 reader，不再读取 input_file；
+    给定 write_behind 时备份、处理结果和缓存条目都交给它在后台写出。
+    """
+    relative_input_path = display_path(input_file)
     filename = input_file.name
-    output_file = output_dir / filename
+    output_file = output_dir / filename if output_dir is not None else None
     backup_file = backup_dir / filename
-    temp_margin_file = output_dir / f"temp_margin_{filename}"
-    temp_blank_file = output_dir / f"temp_blank_{filename}"
-    
-    success = True
+
     original_input_reader = None
+    original_page_count = None
+    output_size = None
+    if _progress is not None:
+        _progress.file_started(input_file)
+
+    with profile_stage("file", file=filename):
+        try:
+            # 1. 备份
+            backup_dir.mkdir(parents=True, exist_ok=True)
+            if prefetched is not None:
+                write_later(write_behind, backup_file.name, write_file, backup_file, prefetched.data, input_file)
+            else:
+                write_later(write_behind, backup_file.name, shutil.copy2, str(input_file), str(backup_file))
+            print(f"[*] 处理: {relative_input_path} -> Backup: {display_path(backup_file)}")
+
+            if result_cache is not None:
+                if prefetched is not None:
+                    result_cache.remember(input_file, prefetched.data)
+                cache_key = result_cache.key(input_file)
+                cached_file = result_cache.get(cache_key)
+                if cached_file is not None:
+                    if output_file is None:
+                        print(f"[+] 完成 (缓存): {filename}")
+                        report_file_finished(input_file, None, None, cached=True)
+                        # 合并前可能被 report_caches 淘汰，因此立即读入
+                        return ProcessedPdf(input_file, True, document=cached_file.read_bytes())
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    write_later(write_behind, filename, shutil.copyfile, cached_file, output_file)
+                    print(f"[+] 完成 (缓存): {display_path(output_file)}")
+                    report_file_finished(input_file, output_file, None, output_size=cached_file.stat().st_size,
+                                         cached=True)
+                    return ProcessedPdf(input_file, True, output_file, output_file)
+
+            # 读取原始文件一次，获取页面和书签
+            with profile_stage("parse", file=filename):
+                if prefetched is not None and prefetched.reader is not None:
+                    original_input_reader = prefetched.reader
+                    original_outline = outline_index(original_input_reader, prefetched.outline)
+                else:
+                    original_input_reader = PdfReader(BytesIO(prefetched.data) if prefetched is not None
+                                                      else str(input_file), strict=False)
+                    original_outline = outline_index(original_input_reader)
+                original_page_count = len(original_input_reader.pages)
+            if prefetched is not None:
+                profile_count("bytes_read", len(prefetched.data))
+            else:
+                profile_file_read(input_file)
+            if original_page_count == 0:
+                 print(f"    [!] 警告: 文件 {filename} 为空，跳过处理。")
+                 report_file_finished(input_file, None, 0, ok=False)
+                 return ProcessedPdf(input_file, False) # 空文件无法处理
+
+            shards = page_range_shards(original_page_count, shard_size, shard_threshold) if jobs > 1 else []
+            output_writer = PdfWriter()
+            if len(shards) > 1:
+                # 2-4. 分片并行处理，然后按顺序拼接
+                print(f"    -> {original_page_count} 页拆分为 {len(shards)} 个分片并行处理...")
+                shard_args = [(input_file, start, end, original_page_count) for start, end in shards]
+                with nullcontext() if shard_futures is not None else process_pool(jobs) as shard_pool, \
+                        profile_stage("merge", file=filename, shards=len(shards)):
+                    if shard_futures is not None:
+                        shard_results = (future.result() for future in shard_futures)
+                    else:
+                        shard_results = shard_pool.map(_process_pdf_shard, *zip(*shard_args))
+                    for (start, end), (shard_data, overlay_stats) in zip(shards, shard_results):
+                        OVERLAY_CACHE.add(overlay_stats)
+                        for page in PdfReader(BytesIO(shard_data)).pages:
+                            output_writer.add_page(page)
+                        if _progress is not None:
+                            _progress.pages(input_file, end - start, original_page_count)
+            else:
+                # 2-4. 添加边距、空白页和页码
+                build_processed_pages(original_input_reader, 0, original_page_count, original_page_count,
+                                      output_writer, filename)
+
+            add_original_outline(original_outline, output_writer, filename)
+
+            if write_behind is not None and (output_file is not None or result_cache is not None):
+                # 在主线程中序列化 (合并还要读取 output_writer)，写入文件交给后台线程
+                with profile_stage("write", file=filename):
+                    packet = BytesIO()
+                    output_writer.write(packet)
+                    output_data = packet.getvalue()
+                if output_file is not None:
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    write_behind.submit(filename, write_file, output_file, output_data)
+                    profile_count("bytes_written", len(output_data))
+                    output_size = len(output_data)
+                if result_cache is not None:
+                    write_behind.submit(filename, result_cache.put, cache_key, output_data)
+            elif output_file is not None:
+                output_dir.mkdir(parents=True, exist_ok=True)
+                with profile_stage("write", file=filename), open(output_file, "wb") as fp:
+                    output_writer.write(fp)
+                    profile_count("bytes_written", fp.tell())
+            if result_cache is not None and write_behind is None:
+                result_cache.put(cache_key, output_file if output_file is not None else output_writer)
+            if output_file is not None:
+                print(f"[+] 完成: {display_path(output_file)}")
+            else:
+                print(f"[+] 完成: {filename} (仅保留在内存中)")
+            result = ProcessedPdf(input_file, True, output_file, (output_writer, original_input_reader))
+
+        except Exception as e:
+            print(f"[!] 错误处理 {relative_input_path}: {str(e)}")
+            traceback.print_exc()
+            # 合并时用原始文件代替处理结果
+            result = ProcessedPdf(input_file, False, document=input_file if output_dir is None else None)
+            if output_dir is not None:
+                try:
+                    # 尝试复制原始文件作为参考
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    dest_path = output_dir / filename
+                    shutil.copy2(str(input_file), str(dest_path))
+                    print(f"    [*] 信息: 因错误已复制原始文件到输出: {display_path(dest_path)}")
+                    result.document = dest_path
+                except Exception as copy_e:
+                    print(f"[!] 错误: 复制原始文件失败: {copy_e}")
+
+    report_file_finished(input_file, result.output_file, original_page_count, result.ok, output_size)
+    return result
+
+
+# --- 重复资源去重 --- 
+def report_dedup(merged_count: int, saved_bytes: int):
+    if merged_count:
+        print(f"[*] 去重: 合并 {merged_count} 个重复的资源对象, 节省 {saved_bytes / 1024 ** 2:.2f} MB")
+    else:
+        print("[*] 去重: 未发现重复的资源对象")
+
+
+# --- 流式合并 --- 
+def estimate_merge_memory(pdf_files: List[Path]) -> int:
+    """估算用普通 PdfWriter 处理并合并 pdf_files 时的峰值内存 (字节)。"""
+    return int(sum(f.stat().st_size for f in pdf_files) * MEMORY_ESTIMATE_FACTOR)
+
+
+def choose_streaming(pdf_files: List[Path], streaming: bool = False, max_memory: Optional[int] = None) -> bool:
+    """给定 max_memory (字节) 且普通合并的预计峰值内存超出时改用流式合并。"""
+    if max_memory is not None and not streaming:
+        estimated_memory = estimate_merge_memory(pdf_files)
+        streaming = estimated_memory > max_memory
+        print(f"[内存] 预计峰值 {estimated_memory / 1024 ** 2:.0f}MB, 上限 {max_memory / 1024 ** 2:.0f}MB"
+              f" -> {'流式合并' if streaming else '普通合并'}")
+    return streaming
+
+
+def open_merged_writer(streaming: bool = False, final_pdf_filename: str = MERGED_FILENAME,
+                       compact: bool = False) -> Union[PdfWriter, StreamingPdfWriter]:
+    """创建合并写入器。streaming 为 True 时直接打开最终文件，页面在追加时即写出。"""
+    if streaming:
+        print("[*] 使用流式合并: 每个文件追加后立即写出，峰值内存不随文件总数增长.")
+        return StreamingPdfWriter(open_output(merged_file_path(final_pdf_filename)), generic, compact)
+    return PdfWriter()
+
 
+def get_sort_key(pdf_path: Path) -> Tuple[float, str]:
+    """合并排序键: 以文件名开头的数字排序，无数字的文件排在最后。"""
+    match = re.match(r"^\s*(\d+)", pdf_path.name)
+    if match:
+        return (int(match.group(1)), pdf_path.name)
+    return (float('inf'), pdf_path.name) 
+
+
+class ResidentReaders:
+    """--watch 常驻运行时保留在内存中的已处理文件 (output/ 中) 的 PdfReader。
+
+    以 (路径, 大小, 修改时间) 为键，文件重新处理后自然失效。PdfWriter.add_page 复制页面而不改动
+    reader，因此未变化文件的 reader 可以在每次重新合并时直接复用；StreamingPdfWriter 会就地改写
+    reader 中的对象，流式合并时不使用。
+    """
+
+    def __init__(self):
+        self._entries: dict = {} # 路径 -> ((大小, 修改时间), PdfReader)
+
+    def get(self, pdf_file: Path) -> Optional[PdfReader]:
+        stat = pdf_file.stat()
+        entry = self._entries.get(pdf_file)
+        if entry is not None and entry[0] == (stat.st_size, stat.st_mtime_ns):
+            return entry[1]
+        return None
+
+    def put(self, pdf_file: Path, reader: PdfReader):
+        stat = pdf_file.stat()
+        self._entries[pdf_file] = ((stat.st_size, stat.st_mtime_ns), reader)
+
+    def prune(self, pdf_files: List[Path]):
+        """丢弃不在 pdf_files 中的文件 (对应的原始文件已删除) 的 reader。"""
+        keep = set(pdf_files)
+        for path in [path for path in self._entries if path not in keep]:
+            del self._entries[path]
+
+
+class ResidentDocuments:
+    """批量运行 (batch/pdf_batch.py) 时同一组任务共用的、在内存中处理完的输入文件 (process_pdf_data 的结果)。
+
+    以 (路径, 大小, 修改时间) 为键。与 ResidentReaders 一样，PdfWriter.add_page 复制页面而不改动处理结果，
+    因此可以供同一组中后面的任务直接合并或写出；流式合并会就地改写页面来源中的对象，不使用。
+    """
+
+    def __init__(self):
+        self._entries: dict = {} # 绝对路径 -> ((大小, 修改时间), ProcessedPdf)
+
+    def get(self, pdf_file: Path) -> Optional[ProcessedPdf]:
+        stat = pdf_file.stat()
+        entry = self._entries.get(pdf_file.resolve())
+        if entry is not None and entry[0] == (stat.st_size, stat.st_mtime_ns):
+            return entry[1]
+        return None
+
+    def put(self, pdf_file: Path, processed: ProcessedPdf):
+        stat = pdf_file.stat()
+        self._entries[pdf_file.resolve()] = ((stat.st_size, stat.st_mtime_ns), processed)
+
+
+_shared_documents: Optional[ResidentDocuments] = None # 批量运行时同一组任务共用的处理结果
+
+
+def share_inputs(enabled: bool = True):
+    """(批量运行的工作进程) 开始或结束一组输入相同的任务。
+
+    开始后本进程中标准输入/输出模式的文件和目录输入 (非流式) 处理后保留在内存中，同一组中后面的
+    任务直接复用，不再重新解析和处理；结束时释放。
+    """
+    global _shared_documents
+    _shared_documents = ResidentDocuments() if enabled else None
+
+
+def append_processed_pdf(merged_writer: Union[PdfWriter, StreamingPdfWriter], processed: Union[Path, ProcessedPdf],
+                         current_page_in_merged_pdf: int, idx: int, total_files_to_merge: int,
+                         readers: Optional[ResidentReaders] = None) -> int:
+    """将一个已处理的 PDF (output/ 中的文件或 process_pdf 的结果) 追加到合并写入器中，并添加层级书签。
+    给定 readers 时优先复用其中未变化文件的 reader，新读取的 reader 也放入其中。
+
+    Returns:
+        int: 追加的页数；空文件或出错时返回 0。
+    """
+    if isinstance(processed, Path):
+        processed = ProcessedPdf(processed, True, processed, processed)
+    source_label = processed.describe()
+    
     try:
-        # 1. 备份
-        backup_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(str(input_file), str(backup_file))
-        print(f"[*] 处理: {relative_input_path} -> Backup: {backup_file.relative_to(PROJECT_DIR)}")
-        
-        # 读取原始文件一次，获取页面和书签
-        original_input_reader = PdfReader(str(input_file), strict=False)
-        original_outline_structure = original_input_reader.outline
-        original_page_count = len(original_input_reader.pages)
-        if original_page_count == 0:
-             print(f"    [!] 警告: 文件 {filename} 为空，跳过处理。")
-             return None # 空文件无法处理
-
-        # 2. 添加边距
-        margin_writer = PdfWriter()
-        for i in range(original_page_count):
-            original_page_for_dims = original_input_reader.pages[i]
-            original_width = float(original_page_for_dims.mediabox.width)
-            original_height = float(original_page_for_dims.mediabox.height)
-            new_height = original_height + TOP_MARGIN_PTS + BOTTOM_MARGIN_PTS
-
-            _temp_writer = PdfWriter()
-            new_page_obj = _temp_writer.add_blank_page(original_width, new_height)
-            
-            # 先合并，再变换
-            original_page_to_merge = original_input_reader.pages[i] 
-            new_page_obj.merge_page(original_page_to_merge)
-            transform = Transformation().translate(tx=0, ty=BOTTOM_MARGIN_PTS)
-            new_page_obj.add_transformation(transform)
-            margin_writer.add_page(new_page_obj)
-        
-        output_dir.mkdir(parents=True, exist_ok=True)
-        with open(temp_margin_file, "wb") as fp:
-            margin_writer.write(fp)
-        
-        # 3. 添加空白页
-        margin_reader = PdfReader(str(temp_margin_file))
-        blank_writer = PdfWriter()
-        pages_with_margins_count = len(margin_reader.pages)
-        if pages_with_margins_count != original_page_count:
-             print(f"    [!] 警告: 添加边距后页数不匹配 ({original_page_count} vs {pages_with_margins_count}). 检查 {temp_margin_file.name}")
-
-        for page_with_margin in margin_reader.pages:
-            blank_writer.add_page(page_with_margin)
-            width = float(page_with_margin.mediabox.width)
-            blank_writer.add_blank_page(width, width)
-            
-        with open(temp_blank_file, "wb") as fp:
-            blank_writer.write(fp)
-
-        # 4. 添加页码并将原始书签添加到输出文件
-        processed_output_file = add_page_numbers(
-            temp_blank_file, 
-            output_file, # 直接使用最终输出路径
-            original_outline_struct=original_outline_structure, 
-            outline_source_reader=original_input_reader
-        )
+        print(f"    -> 读取页面和书签 ({idx+1}/{total_files_to_merge}): {source_label}")
+        page_source, outline_reader, outline_page_factor = processed.open(readers)
+        num_pages = len(page_source.pages)
+        if num_pages == 0:
+            print(f"    [!] 跳过空文件 ({idx+1}/{total_files_to_merge}): {source_label}")
+            return 0
+
+        # 书签索引必须在页面加入之前建立: 流式合并的 add_pages 会就地改写页面来源中的对象
+        source_outline = outline_index(outline_reader)
+
+        # --- 使用 add_page() 逐页添加 --- 
+        print(f"        -> 逐页添加 {num_pages} 页内容...")
+        with profile_stage("merge", file=processed.name, pages=num_pages):
+            if isinstance(merged_writer, StreamingPdfWriter):
+                # add_pages 会就地改写页面来源中的对象并立即写出
+                merged_writer.add_pages(list(page_source.pages))
+            else:
+                for page_num in range(num_pages):
+                    page = page_source.pages[page_num]
+                    merged_writer.add_page(page)
+                # PdfWriter 按 id(reader) 记录已复制的对象；reader 释放后 id 可能被下一个文件的 reader 复用，
+                # 使其页面错误地指向本文件已复制的对象，因此在这里清除该 reader (或内存中的 writer) 的映射
+                merged_writer.reset_translation(page_source.pages[0].indirect_reference)
+        # --- 页面添加结束 ---
+
+        # --- 书签处理逻辑 --- 
+        # 页面已加入，PdfWriter 中的书签因此指向页面对象而不是页索引
+        bookmark_title = processed.input_file.stem
+        try:
+            parent_bookmark = merged_writer.add_outline_item(
+                bookmark_title, 
+                current_page_in_merged_pdf, # 顶层指向此部分内容的开始页
+                parent=outline_root(merged_writer)
+            )
+            if source_outline:
+                 print(f"        -> 从处理后文件发现并尝试添加原有书签...")
+                 # 页面映射: 书签来源 reader 中的页索引 -> 最终合并文件内的页索引
+                 page_map_func = lambda idx_in_source: idx_in_source * outline_page_factor + current_page_in_merged_pdf
+                 with profile_stage("outline", file=processed.name, items=len(source_outline)):
+                     transfer_outline(
+                         index=source_outline,
+                         target_writer=merged_writer,
+                         target_parent=parent_bookmark,
+                         page_idx_transform_func=page_map_func
+                     )
+            else:
+                 # 如果处理后的文件没有书签，可能原始文件就没有，或者复制书签时出错
+                 print(f"        -> 处理后文件 '{processed.name}' 未包含书签." )
+        except Exception as e:
+            # 页面已经加入，书签出错不影响返回的页数
+            print(f"    [!] 警告: 为 {processed.name} 添加书签时出错: {e}")
+        # --- 书签处理结束 --- 
         
-        if processed_output_file:
-            print(f"[+] 完成: {output_file.relative_to(PROJECT_DIR)}")
-            # output_file 变量已被正确设置
-        else:
-            success = False
-            output_file = None # add_page_numbers 失败，确保返回 None
-            print(f"[!] 错误: 未能生成最终文件 {output_file.name if output_file else filename}")
+        print(f"    -> ({idx+1}/{total_files_to_merge}) {processed.name} ({num_pages}页) | 下一页偏移: {current_page_in_merged_pdf + num_pages}")
+        if _progress is not None:
+            _progress.file_merged(processed.input_file, num_pages, current_page_in_merged_pdf + num_pages)
+        return num_pages
 
     except Exception as e:
-        success = False
-        print(f"[!] 错误处理 {relative_input_path}: {str(e)}")
+        print(f"    [!] 错误合并文件 ({idx+1}/{total_files_to_merge}) {source_label}: {e}")
         traceback.print_exc()
-        try:
-            # 尝试复制原始文件作为参考
-            output_dir.mkdir(parents=True, exist_ok=True)
-            # 检查 output_file 是否因异常而未定义
-            dest_path = output_dir / filename
-            shutil.copy2(str(input_file), str(dest_path))
-            print(f"    [*] 信息: 因错误已复制原始文件到输出: {dest_path.relative_to(PROJECT_DIR)}")
-        except Exception as copy_e:
-            print(f"[!] 错误: 复制原始文件失败: {copy_e}")
-        output_file = None # 确保返回 None
-            
-    finally:
-        # 清理临时文件 (更健壮)
-        for temp_file in [temp_margin_file, temp_blank_file]:
-            if temp_file.exists():
-                try:
-                    temp_file.unlink()
-                except OSError as e:
-                    print(f"    [!] 警告: 清理临时文件 {temp_file.name} 失败: {e}")
-                 
-    return output_file if success else None
+        return 0
+
+
+def write_merged_pdf(merged_writer: Union[PdfWriter, StreamingPdfWriter], merged_page_count: int,
+                     files_merged_count: int, total_files_to_merge: int, final_pdf_filename: str = MERGED_FILENAME,
+                     compact: bool = False):
+    """写入最终合并的 PDF (流式写入器则写出页面树、书签和交叉引用表并关闭文件)。
+    compact 为 True 时以紧凑格式写出 (见 write_compact_pdf；流式写入器在创建时指定)。
+
+    Returns:
+        bool: 是否成功写出。
+    """
+    final_pdf_path = merged_file_path(final_pdf_filename)
+    streaming = isinstance(merged_writer, StreamingPdfWriter)
+    if merged_page_count == 0:
+        report_error("[!] 错误: 没有页面被成功合并. 未创建输出文件.")
+        if streaming:
+            merged_writer.stream.close()
+            if final_pdf_filename != STDIO_PATH:
+                final_pdf_path.unlink(missing_ok=True)
+        return False
+
+    relative_final_path = display_path(final_pdf_path)
+
+    if _progress is not None:
+        _progress.stage("write")
+    try:
+        if streaming:
+            with profile_stage("write", file=final_pdf_filename, compact=compact), merged_writer.stream:
+                merged_writer.close()
+                profile_count("bytes_written", merged_writer.stream.tell())
+                if _progress is not None:
+                    _progress.written(final_pdf_path, merged_writer.stream.tell())
+            report_dedup(merged_writer.dedup_count, merged_writer.dedup_saved)
+        else:
+            with profile_stage("dedup"):
+                dedup_result = deduplicate_objects(merged_writer)
+            report_dedup(*dedup_result)
+            with profile_stage("write", file=final_pdf_filename, compact=compact), open_output(final_pdf_path) as fp:
+                if compact:
+                    write_compact_pdf(merged_writer, fp)
+                else:
+                    merged_writer.write(fp)
+                profile_count("bytes_written", fp.tell())
+                if _progress is not None:
+                    _progress.written(final_pdf_path, fp.tell())
+        print(f"[+] 合并完成: {relative_final_path} ({files_merged_count}/{total_files_to_merge} 文件, {merged_page_count} 页)")
+        return True
+    except Exception as e:
+        report_error(f"[!] 错误写入最终 PDF {relative_final_path}: {e}")
+        traceback.print_exc()
+        return False
 
 
-def merge_pdfs_with_bookmarks(output_dir: Path, final_pdf_filename: str = MERGED_FILENAME):
+def merge_pdfs_with_bookmarks(output_dir: Path, final_pdf_filename: str = MERGED_FILENAME, streaming: bool = False,
+                              compact: bool = False, readers: Optional[ResidentReaders] = None,
+                              append: bool = False, rebuild: bool = False, prefetch: int = PREFETCH_DEPTH):
     """将 output_dir 中的所有 PDF 文件合并成一个 PDF 文件,
     并根据原始文件名（按数字排序）添加【层级式】书签：
     文件名作为顶层，其下嵌套该文件【已处理文件自身】的书签结构。
+    streaming 为 True 时使用 StreamingPdfWriter，逐个文件写出，峰值内存取决于最大的单个文件。
+    compact 为 True 时压缩内容流，并用对象流和交叉引用流写出 (见 CompactObjectWriter)。
+    readers (ResidentReaders) 供 --watch 在多次合并之间复用未变化文件的 reader (流式合并时忽略)。
+    append 为 True (--append) 时，如果合并结果的索引有效且 output_dir 中只在末尾新增了文件，
+    只把这些文件以增量更新的方式追加到合并结果 (见 append_to_merged)；否则完整重写并建立索引。
+    rebuild 为 True 时总是完整重写。
+    prefetch 大于 0 且不复用 readers 时，后台线程预读并解析接下来的 prefetch 个文件 (见 Prefetcher)。
     """
-    relative_output_dir = output_dir.relative_to(PROJECT_DIR)
+    relative_output_dir = display_path(output_dir)
     print(f"\n[*] 开始合并: {relative_output_dir}/")
+    if _progress is not None:
+        _progress.stage("merge")
     
     processed_pdf_files = [f for f in output_dir.glob('*.pdf') 
                            if f.is_file() and not f.name.startswith('temp_')]
-
-    def get_sort_key(pdf_path: Path) -> Tuple[float, str]:
-        match = re.match(r"^\s*(\d+)", pdf_path.name)
-        if match:
-            return (int(match.group(1)), pdf_path.name)
-        return (float('inf'), pdf_path.name) 
     processed_pdf_files.sort(key=get_sort_key)
     
     pdf_file_names = [p.name for p in processed_pdf_files]
     if not processed_pdf_files:
-        print(f"[!] 警告: 在 {relative_output_dir} 中未找到可合并的 PDF 文件.")
+        report_error(f"[!] 警告: 在 {relative_output_dir} 中未找到可合并的 PDF 文件.")
         return
 
     display_limit = 5
@@ -362,82 +1122,215 @@ def merge_pdfs_with_bookmarks(output_dir: Path, final_pdf_filename: str = MERGED
         files_to_merge_display.append('...')
     print(f"[*] 合并 {len(processed_pdf_files)} 个文件 (排序后): {files_to_merge_display}")
 
-    merged_writer = PdfWriter()
+    final_pdf_path = PROJECT_DIR / final_pdf_filename
+    if append:
+        index = None if rebuild else MergeIndex.load(final_pdf_path)
+        if index is not None and index.matches_prefix(processed_pdf_files):
+            new_files = processed_pdf_files[len(index.files):]
+            if not new_files:
+                print(f"[*] 没有新文件, {final_pdf_filename} 已是最新.")
+                return
+            if append_to_merged(index, new_files):
+                return
+        elif rebuild:
+            print(f"[*] --rebuild: 完整重写 {final_pdf_filename}.")
+        elif index is not None:
+            print(f"[*] 已合并的文件有修改、删除，或新文件没有排在末尾, 完整重写 {final_pdf_filename}.")
+        else:
+            print(f"[*] 没有可用的索引 {final_pdf_filename}{MERGE_INDEX_SUFFIX}, 完整重写 {final_pdf_filename}.")
+    MergeIndex.path_for(final_pdf_path).unlink(missing_ok=True) # 完整重写后原来的索引不再有效
+
+    merged_writer = open_merged_writer(streaming, final_pdf_filename, compact)
     current_page_in_merged_pdf = 0 # 0-based index
     total_files_to_merge = len(processed_pdf_files)
     files_merged_count = 0
 
-    for idx, processed_pdf_path in enumerate(processed_pdf_files):
-        relative_processed_path = processed_pdf_path.relative_to(PROJECT_DIR)
-        
-        try:
-            print(f"    -> 读取页面和书签 ({idx+1}/{total_files_to_merge}): {relative_processed_path}")
-            reader_processed = PdfReader(str(processed_pdf_path), strict=False)
-            num_pages = len(reader_processed.pages)
-            if num_pages == 0:
-                print(f"    [!] 跳过空文件 ({idx+1}/{total_files_to_merge}): {relative_processed_path}")
-                continue
+    if streaming:
+        readers = None
+    prefetcher = None
+    sources = ((processed_pdf_path, None) for processed_pdf_path in processed_pdf_files)
+    if prefetch > 0 and readers is None:
+        prefetcher = Prefetcher(processed_pdf_files, PrefetchedInput.load, prefetch, profile_stage)
+        sources = prefetcher
+    page_counts = []
+    try:
+        for idx, (processed_pdf_path, prefetched) in enumerate(sources):
+            processed = processed_pdf_path
+            if prefetched is not None and prefetched.reader is not None:
+                outline_index(prefetched.reader, prefetched.outline)
+                profile_count("bytes_read", len(prefetched.data))
+                processed = ProcessedPdf(processed_pdf_path, True, processed_pdf_path, prefetched.reader)
+            page_increment = append_processed_pdf(merged_writer, processed, current_page_in_merged_pdf,
+                                                  idx, total_files_to_merge, readers)
+            page_counts.append(page_increment)
+            if page_increment:
+                current_page_in_merged_pdf += page_increment
+                files_merged_count += 1
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+            report_io_queues(prefetcher)
+    if readers is not None:
+        readers.prune(processed_pdf_files)
 
-            # --- 书签处理逻辑 --- 
-            bookmark_title = processed_pdf_path.stem
-            parent_bookmark = merged_writer.add_outline_item(
-                bookmark_title, 
-                current_page_in_merged_pdf # 顶层指向此部分内容的开始页
-            )
-            processed_outline_data = reader_processed.outline
-            if processed_outline_data:
-                 print(f"        -> 从处理后文件发现并尝试添加原有书签...")
-                 # 页面映射: 在此处理后文件内的页索引 -> 最终合并文件内的页索引
-                 page_map_func = lambda idx_in_processed: idx_in_processed + current_page_in_merged_pdf
-                 add_nested_outline(
-                     reader=reader_processed,       
-                     source_items=processed_outline_data, 
-                     target_writer=merged_writer,   
-                     target_parent=parent_bookmark, 
-                     page_idx_transform_func=page_map_func
-                 )
-            else:
-                 # 如果处理后的文件没有书签，可能原始文件就没有，或者add_page_numbers阶段出错
-                 print(f"        -> 处理后文件 '{processed_pdf_path.name}' 未包含书签." )
-            # --- 书签处理结束 --- 
-
-            # --- 使用 add_page() 逐页添加 --- 
-            print(f"        -> 逐页添加 {num_pages} 页内容...")
-            for page_num in range(num_pages):
-                page = reader_processed.pages[page_num]
-                merged_writer.add_page(page)
-            # --- 页面添加结束 ---
-            
-            page_increment = num_pages
-            current_page_in_merged_pdf += page_increment 
-            files_merged_count += 1
-            print(f"    -> ({idx+1}/{total_files_to_merge}) {processed_pdf_path.name} ({page_increment}页) | 下一页偏移: {current_page_in_merged_pdf}")
+    # --- 写入最终合并的 PDF --- 
+    written = write_merged_pdf(merged_writer, current_page_in_merged_pdf, files_merged_count,
+                               total_files_to_merge, final_pdf_filename, compact)
+    if append and written:
+        with profile_stage("index"):
+            index = MergeIndex.build(final_pdf_path, processed_pdf_files, page_counts, PdfReader)
+        if index is not None:
+            index.save()
 
-        except Exception as e:
-            print(f"    [!] 错误合并文件 ({idx+1}/{total_files_to_merge}) {relative_processed_path}: {e}")
-            traceback.print_exc()
 
-    # --- 写入最终合并的 PDF --- 
-    if current_page_in_merged_pdf == 0:
-        print("[!] 错误: 没有页面被成功合并. 未创建输出文件.")
-        return
+def _process_pdf_worker(input_file: Path, output_dir: Optional[Path], backup_dir: Path,
+                        result_cache: Optional[ResultCache] = None, max_pages: Optional[int] = None
+                        ) -> Tuple[Optional[ProcessedPdf], int, Tuple[int, int, int], int, int]:
+    """(子进程) 读入并解析 input_file 后执行 process_pdf (解析结果直接交给它，不再重复解析)。
 
-    final_pdf_path = PROJECT_DIR / final_pdf_filename
-    try:
-        relative_final_path = final_pdf_path.relative_to(PROJECT_DIR)
-    except ValueError:
-        relative_final_path = final_pdf_path
+    返回可传回主进程的结果 (见 ProcessedPdf.detached)、原始页数 (无法解析时为 0)，以及本次调用产生的
+    覆盖层缓存和处理结果缓存的命中/未命中数。页数超过 max_pages 且不在处理结果缓存中的大文件只读取页面树
+    统计页数，不在这里处理，结果为 None，由主进程按页范围分片后提交到同一个进程池。
+    """
+    overlay_before = OVERLAY_CACHE.stats()
+    result_hits, result_misses = (result_cache.hits, result_cache.misses) if result_cache else (0, 0)
+    prefetched = PrefetchedInput.load(input_file, "read", max_pages)
+    page_count = len(prefetched.reader.pages) if prefetched.reader is not None else 0
+    if max_pages is not None and page_count > max_pages:
+        if result_cache is not None:
+            result_cache.remember(input_file, prefetched.data)
+        if result_cache is None or result_cache.key(input_file) not in result_cache:
+            return None, page_count, (0, 0, 0), 0, 0
+    processed = process_pdf(input_file, output_dir, backup_dir, result_cache=result_cache,
+                            prefetched=prefetched).detached()
+    if result_cache is not None:
+        result_hits, result_misses = result_cache.hits - result_hits, result_cache.misses - result_misses
+    return processed, page_count, OVERLAY_CACHE.since(overlay_before), result_hits, result_misses
+
+
+def iter_processed_serially(pdf_files: List[Path], output_dir: Optional[Path], backup_dir: Path,
+                            result_cache: Optional[ResultCache] = None, prefetch: int = PREFETCH_DEPTH):
+    """在主进程中按顺序逐个处理 pdf_files (jobs 为 1 时)。
 
+    prefetch 大于 0 时由后台线程预读接下来的 prefetch 个文件 (读入内容、解析页面树和书签，见 PrefetchedInput)，
+    备份、处理结果和缓存条目交给另一个后台线程延后写出 (见 WriteBehind)；全部处理完后等待写出完成，
+    并报告两个队列的等待时间。
+
+    Yields:
+        Tuple[Path, ProcessedPdf]: (输入文件, process_pdf 的返回值)。
+    """
+    if prefetch <= 0:
+        for pdf_file in pdf_files:
+            yield pdf_file, process_pdf(pdf_file, output_dir, backup_dir, result_cache=result_cache)
+        return
+    prefetcher = Prefetcher(pdf_files, PrefetchedInput.load, prefetch, profile_stage)
+    write_behind = WriteBehind(prefetch, profile_stage)
     try:
-        with open(final_pdf_path, "wb") as fp:
-            merged_writer.write(fp)
-        print(f"[+] 合并完成: {relative_final_path} ({files_merged_count}/{total_files_to_merge} 文件, {current_page_in_merged_pdf} 页)")
-    except Exception as e:
-        print(f"[!] 错误写入最终 PDF {relative_final_path}: {e}")
-        traceback.print_exc()
+        for pdf_file, prefetched in prefetcher:
+            yield pdf_file, process_pdf(pdf_file, output_dir, backup_dir, result_cache=result_cache,
+                                        prefetched=prefetched, write_behind=write_behind)
+    finally:
+        prefetcher.close()
+        write_behind.close()
+        report_io_queues(prefetcher, write_behind)
+
+
+def iter_processed_in_order(pdf_files: List[Path], output_dir: Optional[Path], backup_dir: Path, jobs: int,
+                            shard_size: int = SHARD_SIZE, shard_threshold: int = SHARD_THRESHOLD,
+                            result_cache: Optional[ResultCache] = None):
+    """在进程池中并行处理 pdf_files，并按 pdf_files 的顺序逐个产出结果。
+
+    一旦某个有序前缀全部完成就立即产出，调用方 (如合并) 因此可以与其余文件的处理重叠进行。
+    每个文件的失败互相隔离：处理异常或子进程崩溃时该文件的结果为 None。
+    页数由子进程在解析时顺便统计并传回；超过 shard_threshold 的大文件由子进程只读取页面树后交回主进程，
+    主进程按页范围分片，把分片提交到同一个进程池 (不再另建进程池)，与其余任务一起等待，
+    全部分片完成后再由 process_pdf 拼接，其间其他文件的结果照常产出。
+    子进程的结果以 output/ 中的文件 (output_dir 为 None 时为 PDF 字节) 传回，大文件的结果保留在内存中。
+
+    Yields:
+        Tuple[Path, ProcessedPdf]: (输入文件, process_pdf 的返回值)。
+    """
+    results = {}
+    next_idx = 0
+    max_pages = shard_threshold if shard_size > 0 else None
+    sharded = {} # 正在分片处理的大文件的序号 -> 尚未完成的分片任务数
+
+    with process_pool(jobs) as pool:
+        owners = {pool.submit(_process_pdf_worker, pdf_file, output_dir, backup_dir, result_cache, max_pages): idx
+                  for idx, pdf_file in enumerate(pdf_files)}
+        shard_futures = {} # 大文件的序号 -> 其全部分片任务
+        pending = set(owners)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = owners.pop(future)
+                pdf_file = pdf_files[idx]
+                if idx in sharded: # 大文件的一个分片
+                    sharded[idx] -= 1
+                    if sharded[idx]:
+                        continue
+                    del sharded[idx]
+                    # 分片已全部完成，process_pdf 只读取结果并拼接，不会阻塞在分片上
+                    results[idx] = process_pdf(pdf_file, output_dir, backup_dir, jobs, shard_size, shard_threshold,
+                                               result_cache, shard_futures=shard_futures.pop(idx))
+                else:
+                    try:
+                        processed, page_count, overlay_stats, result_hits, result_misses = future.result()
+                        OVERLAY_CACHE.add(overlay_stats)
+                        if result_cache is not None:
+                            result_cache.hits += result_hits
+                            result_cache.misses += result_misses
+                    except Exception as e:
+                        print(f"[!] 错误处理 {pdf_file.name}: 子进程异常 {e}")
+                        processed, page_count = ProcessedPdf(pdf_file, False), 0
+                    if processed is None: # 大文件: 按页范围分片，与其他任务一起在进程池中处理
+                        futures = [pool.submit(_process_pdf_shard, pdf_file, start, end, page_count)
+                                   for start, end in page_range_shards(page_count, shard_size, shard_threshold)]
+                        shard_futures[idx] = futures
+                        sharded[idx] = len(futures)
+                        owners.update((shard_future, idx) for shard_future in futures)
+                        pending.update(futures)
+                        continue
+                    report_file_finished(pdf_file, processed.output_file, page_count, processed.ok)
+                    results[idx] = processed
+                while next_idx in results:
+                    yield pdf_files[next_idx], results.pop(next_idx)
+                    next_idx += 1
+
+
+@dataclass
+class RunOptions:
+    """处理 pdfs/ 时的运行选项，由 main() 根据命令行参数构造一次，交给 process_all_pdfs、
+    append_input_dir 和 watch_input_dir。"""
+    jobs: int = 1
+    shard_size: int = SHARD_SIZE
+    shard_threshold: int = SHARD_THRESHOLD
+    streaming: bool = False            # --stream
+    max_memory: Optional[int] = None   # --max-memory (字节)：预计峰值内存超出时改用流式合并
+    result_cache: Optional[ResultCache] = None
+    compact: bool = False
+    merged_only: bool = False          # 不把各文件的处理结果写出到 output/
+    append: bool = False
+    rebuild: bool = False              # --append 时强制完整重写合并结果
+    prefetch: int = PREFETCH_DEPTH
+    watch_interval: float = WATCH_INTERVAL
 
-def process_all_pdfs():
-    """处理 INPUT_DIR (默认是 pdfs/) 中的所有 PDF 文件。"""
+
+def iter_processed(pdf_files: List[Path], output_dir: Optional[Path], options: RunOptions):
+    """按 options.jobs 选择 iter_processed_in_order (并行) 或 iter_processed_serially 处理 pdf_files。"""
+    if options.jobs > 1:
+        return iter_processed_in_order(pdf_files, output_dir, BACKUP_DIR, options.jobs, options.shard_size,
+                                       options.shard_threshold, options.result_cache)
+    return iter_processed_serially(pdf_files, output_dir, BACKUP_DIR, options.result_cache, options.prefetch)
+
+
+def process_all_pdfs(options: RunOptions):
+    """处理 INPUT_DIR (默认是 pdfs/) 中的所有 PDF 文件，并合并为 merged_output.pdf。
+
+    每个文件处理完成后按 get_sort_key 顺序直接追加到合并结果 (见 process_and_merge_pipelined)，
+    jobs 大于 1 时文件在进程池中并行处理，合并与其余文件的处理同时进行。
+    给定 max_memory 且普通合并的预计峰值内存超出时，自动改用流式合并写入器。
+    """
     INPUT_DIR.mkdir(exist_ok=True)
     OUTPUT_DIR.mkdir(exist_ok=True)
     BACKUP_DIR.mkdir(exist_ok=True)
@@ -447,32 +1340,498 @@ def process_all_pdfs():
     
     pdf_files = list(INPUT_DIR.glob('*.pdf'))
     if not pdf_files:
-        print(f"[!] 警告: 在 {relative_input_dir} 未找到 PDF 文件.")
+        report_error(f"[!] 警告: 在 {relative_input_dir} 未找到 PDF 文件.")
         return
         
     print(f"[*] 发现 {len(pdf_files)} 个 PDF 文件.")
-    
+    if _progress is not None:
+        _progress.begin(sorted(pdf_files, key=get_sort_key))
+        _progress.stage("process")
+
+    streaming = choose_streaming(pdf_files, options.streaming, options.max_memory)
+    process_and_merge_pipelined(pdf_files, options, streaming)
+
+
+def process_and_merge_pipelined(pdf_files: List[Path], options: RunOptions, streaming: bool = False,
+                                final_pdf_filename: str = MERGED_FILENAME):
+    """处理 pdf_files (见 iter_processed)，并按排序顺序将完成的文件逐个追加到合并结果。
+
+    合并直接使用 process_pdf 返回的结果 (见 ProcessedPdf)：在主进程中处理的文件取内存中的页面，
+    不再解析写出到 OUTPUT_DIR 的文件；处理失败时合并原始文件，失败文件记录在 failed_files 中。
+    每个文件追加后即可释放，峰值内存不包括所有文件的处理结果。
+    options.merged_only 为 True 时各文件的处理结果不写出到 OUTPUT_DIR。
+    """
+    pdf_files = sorted(pdf_files, key=get_sort_key)
+    merged_only, compact = options.merged_only, options.compact
+    output_dir = None if merged_only else OUTPUT_DIR
+    if options.jobs > 1:
+        print(f"[*] 使用 {options.jobs} 个进程并行处理，并按顺序流式合并.")
+    results = iter_processed(pdf_files, output_dir, options)
+    if merged_only:
+        print(f"[*] --merged-only: 处理结果不写出到 {OUTPUT_DIR.relative_to(PROJECT_DIR)}/，直接合并.")
+
     processed_files_count = 0
     failed_files: List[str] = []
-    
-    for pdf_file in pdf_files:
-        output_file_path = process_pdf(pdf_file, OUTPUT_DIR, BACKUP_DIR)
-        if output_file_path and output_file_path.exists():
-             processed_files_count += 1
+    merged_writer = open_merged_writer(streaming, final_pdf_filename, compact)
+    current_page_in_merged_pdf = 0 # 0-based index
+    total_files_to_merge = len(pdf_files)
+    files_merged_count = 0
+
+    for idx, (pdf_file, processed) in enumerate(results):
+        if processed.ok:
+            processed_files_count += 1
         else:
-            # 如果 process_pdf 返回 None 或文件不存在，则记录失败
             failed_files.append(pdf_file.name)
-            
+
+        if processed.document is not None:
+            page_increment = append_processed_pdf(merged_writer, processed, current_page_in_merged_pdf,
+                                                  idx, total_files_to_merge)
+            if page_increment:
+                current_page_in_merged_pdf += page_increment
+                files_merged_count += 1
+
     print(f"\n[*] 处理结果: {processed_files_count} 成功, {len(failed_files)} 失败.")
+    report_caches(options.result_cache)
     if failed_files:
         print(f"[!] 失败文件列表: {failed_files}")
-    
+
     if processed_files_count > 0:
-        merge_pdfs_with_bookmarks(OUTPUT_DIR, MERGED_FILENAME)
+        write_merged_pdf(merged_writer, current_page_in_merged_pdf, files_merged_count,
+                         total_files_to_merge, final_pdf_filename, compact)
+    else:
+        report_error("[!] 无成功处理的文件，跳过合并步骤.")
+        if isinstance(merged_writer, StreamingPdfWriter): # 删除已打开的未完成文件
+            merged_writer.stream.close()
+            (PROJECT_DIR / final_pdf_filename).unlink(missing_ok=True)
+
+# --- 增量追加 (--append) --- 
+def append_to_merged(index: MergeIndex, new_files: List[Path]) -> bool:
+    """--append: 把 new_files (output/ 中已处理的文件) 作为 PDF 增量更新追加到合并结果末尾，并更新索引。
+
+    页码只与各文件自身有关，原有页面因此完全不需要改写：增量更新只包含新文件的页面和书签、
+    页面树根、书签根和原来的最后一个顶层书签，写出量只取决于新文件。
+    出错时把合并结果截断回原来的长度 (索引保持有效) 并返回 False，由调用方改为完整重写。
+    """
+    final_pdf_path = index.pdf_path
+    base_stat = final_pdf_path.stat()
+    print(f"[*] 以增量更新的方式追加 {len(new_files)} 个文件到 {final_pdf_path.name} (原有 {len(index.page_ids)} 页).")
+    page_counts = []
+    try:
+        with open(final_pdf_path, "rb") as base_file, open(final_pdf_path, "ab") as f:
+            merged_writer = StreamingPdfWriter(f, generic, index.compact, base=index,
+                                               base_reader=PdfReader(base_file, strict=False))
+            for idx, processed_pdf_path in enumerate(new_files):
+                page_counts.append(append_processed_pdf(merged_writer, processed_pdf_path, len(merged_writer),
+                                                        idx, len(new_files)))
+            if _progress is not None:
+                _progress.stage("write")
+            with profile_stage("write", file=final_pdf_path.name, compact=index.compact):
+                merged_writer.close()
+            appended_bytes = f.tell() - base_stat.st_size
+    except Exception as e:
+        os.truncate(final_pdf_path, base_stat.st_size)
+        os.utime(final_pdf_path, ns=(base_stat.st_atime_ns, base_stat.st_mtime_ns))
+        print(f"[!] 增量追加失败: {e}, 改为完整重写.")
+        traceback.print_exc()
+        return False
+    profile_count("bytes_written", appended_bytes)
+    if _progress is not None:
+        _progress.written(final_pdf_path, appended_bytes)
+    report_dedup(merged_writer.dedup_count, merged_writer.dedup_saved)
+
+    if len(merged_writer.outline_ids) != sum(1 for count in page_counts if count):
+        # 有文件在添加书签之后才出错，书签与文件无法再一一对应，下次追加时完整重写
+        index.path_for(final_pdf_path).unlink(missing_ok=True)
     else:
-        print("[!] 无成功处理的文件，跳过合并步骤.")
+        index.record_append(merged_writer, new_files, page_counts)
+    print(f"[+] 追加完成: {final_pdf_path.name} (新增 {sum(page_counts)} 页, 共 {len(merged_writer)} 页, "
+          f"写出 {appended_bytes / 1024 ** 2:.1f}MB)")
+    return True
+
+
+def append_input_dir(options: RunOptions):
+    """--append (默认模式): 只处理 pdfs/ 中新增或修改过的文件，再把新文件追加到已有的合并结果。
+
+    与普通运行不同，output/ 中已有的处理结果和合并结果都保留：处理结果不存在或比原始文件旧时
+    才重新处理，原始文件已删除的结果从 output/ 和 backup/ 中移除。合并见 merge_pdfs_with_bookmarks。
+    """
+    INPUT_DIR.mkdir(exist_ok=True)
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    BACKUP_DIR.mkdir(exist_ok=True)
+
+    pdf_files = sorted(INPUT_DIR.glob('*.pdf'), key=get_sort_key)
+    for processed_pdf_path in OUTPUT_DIR.glob('*.pdf'):
+        if not (INPUT_DIR / processed_pdf_path.name).exists():
+            processed_pdf_path.unlink()
+            (BACKUP_DIR / processed_pdf_path.name).unlink(missing_ok=True)
+            print(f"    -> 已移除 {processed_pdf_path.name} 的处理结果 (原始文件已删除).")
+    if not pdf_files:
+        report_error(f"[!] 警告: 在 {INPUT_DIR.relative_to(PROJECT_DIR)} 未找到 PDF 文件.")
+        return
+
+    changed = [pdf_file for pdf_file in pdf_files if not (OUTPUT_DIR / pdf_file.name).exists()
+               or (OUTPUT_DIR / pdf_file.name).stat().st_mtime_ns < pdf_file.stat().st_mtime_ns]
+    print(f"[*] 发现 {len(pdf_files)} 个 PDF 文件, 其中 {len(changed)} 个新增或修改过, 需要处理.")
+    if _progress is not None:
+        _progress.begin(changed)
+        _progress.stage("process")
+
+    failed_files = [pdf_file.name for pdf_file, processed in iter_processed(changed, OUTPUT_DIR, options)
+                    if not processed.ok]
+    print(f"\n[*] 处理结果: {len(changed) - len(failed_files)} 成功, {len(failed_files)} 失败.")
+    report_caches(options.result_cache)
+    if failed_files:
+        print(f"[!] 失败文件列表: {failed_files}")
+
+    streaming = choose_streaming(pdf_files, options.streaming, options.max_memory)
+    merge_pdfs_with_bookmarks(OUTPUT_DIR, MERGED_FILENAME, streaming, options.compact, append=True,
+                              rebuild=options.rebuild, prefetch=options.prefetch)
+
+
+# --- 标准输入/输出与分帧流 (-, -o, --frames) --- 
+_stdout_binary: Optional[BinaryIO] = None # -o - 时保存的标准输出 (见 enable_stdout_output)
+
+
+def enable_stdout_output():
+    """-o -: 在文件描述符层面保存标准输出供写出 PDF 使用，再把标准输出指向标准错误，
+    文字日志因此不会混入 PDF 数据。需要在 enable_progress 之前调用。"""
+    global _stdout_binary
+    _stdout_binary = detach_stdout()
+
+
+def open_output(path: Path) -> BinaryIO:
+    """以二进制写方式打开输出文件；path 为 "-" 时返回标准输出 (StdoutOutput)。"""
+    if str(path) == STDIO_PATH:
+        return StdoutOutput(_stdout_binary if _stdout_binary is not None else sys.stdout.buffer)
+    return open(path, "wb")
+
+
+def merged_file_path(final_pdf_filename: str) -> Path:
+    """合并结果的路径: 相对路径位于 PROJECT_DIR 下，"-" 表示标准输出。"""
+    return Path(STDIO_PATH) if final_pdf_filename == STDIO_PATH else PROJECT_DIR / final_pdf_filename
+
+
+def process_pdf_data(data: bytes, name: str) -> ProcessedPdf:
+    """在内存中处理一个 PDF 的内容 data (步骤 2-4 及原始书签)，不备份、不写出、不使用处理结果缓存。
+    name 是日志中的文件名和合并时的书签标题来源。出错 (包括没有页面) 时抛出异常。"""
+    input_file = Path(name)
+    if _progress is not None:
+        _progress.file_started(input_file)
+    with profile_stage("file", file=name):
+        with profile_stage("parse", file=name):
+            original_input_reader = PdfReader(BytesIO(data), strict=False)
+            original_outline = outline_index(original_input_reader)
+            original_page_count = len(original_input_reader.pages)
+        profile_count("bytes_read", len(data))
+        if original_page_count == 0:
+            raise ValueError(f"{name} 没有页面")
+        print(f"[*] 处理: {name} ({original_page_count} 页)")
+        output_writer = PdfWriter()
+        build_processed_pages(original_input_reader, 0, original_page_count, original_page_count, output_writer,
+                              name)
+        add_original_outline(original_outline, output_writer, name)
+    report_file_finished(input_file, None, original_page_count)
+    return ProcessedPdf(input_file, True, document=(output_writer, original_input_reader))
+
+
+def process_file_data(pdf_file: Path, shared: bool = True) -> ProcessedPdf:
+    """读取并在内存中处理 pdf_file (见 process_pdf_data)。批量运行时 (见 share_inputs) 且 shared 为 True 时
+    先在同一组任务已处理的结果中查找，新处理的结果也放入其中。"""
+    documents = _shared_documents if shared else None
+    processed = documents.get(pdf_file) if documents is not None else None
+    if processed is not None:
+        print(f"[*] 复用: {pdf_file.name} (同组任务已处理)")
+        return processed
+    with profile_stage("read", file=pdf_file.name):
+        data = pdf_file.read_bytes()
+    processed = process_pdf_data(data, pdf_file.name)
+    if documents is not None:
+        documents.put(pdf_file, processed)
+    return processed
+
+
+def process_stream(source: str, output: str = STDIO_PATH, frames: bool = False, streaming: bool = False,
+                   compact: bool = False) -> bool:
+    """标准输入/输出模式: 处理 source (文件或目录路径，"-" 表示标准输入)，结果写到 output (文件路径，"-" 表示标准输出)。
+
+    source 是一个 PDF 时输出与 process_pdf 写到 output/ 的处理结果相同；frames 为 True 时 source 是分帧流
+    (见 read_frames)，其中的 PDF 依次处理后按流中的顺序合并，书签与默认模式的合并结果相同 (帧中的文件名作为
+    顶层书签)；source 是目录时与分帧流相同，合并其中的 PDF (按 get_sort_key 排序，文件名作为顶层书签)。
+    streaming、compact 同 merge_pdfs_with_bookmarks。
+    不备份、不使用处理结果缓存，也不读写 pdfs/、output/、backup/ 等目录或临时文件。
+
+    Returns:
+        bool: 是否全部处理成功并写出。
+    """
+    source_name = STDIN_NAME if source == STDIO_PATH else Path(source).name
+    directory = source != STDIO_PATH and Path(source).is_dir()
+    if output != STDIO_PATH:
+        output = str(Path(output).resolve()) # 相对路径相对于当前目录，而不是合并结果所在的 PROJECT_DIR
+    output_path = Path(output)
+    try:
+        if directory:
+            documents = [(pdf_file.name, pdf_file) for pdf_file in sorted(Path(source).glob('*.pdf'), key=get_sort_key)]
+            print(f"[*] 从目录 {source_name}/ 读取 {len(documents)} 个 PDF 文件.")
+        elif frames:
+            with nullcontext(sys.stdin.buffer) if source == STDIO_PATH else open(source, "rb") as stream:
+                with profile_stage("read", file=source_name):
+                    documents = list(read_frames(stream))
+            print(f"[*] 从分帧流 {source_name} 读取 {len(documents)} 个 PDF 文件.")
+        else:
+            documents = None
+
+        if documents is None:
+            if source == STDIO_PATH:
+                with profile_stage("read", file=source_name):
+                    data = sys.stdin.buffer.read()
+                output_writer = process_pdf_data(data, source_name).document[0]
+            else:
+                output_writer = process_file_data(Path(source)).document[0]
+            with profile_stage("write", file=source_name), open_output(output_path) as fp:
+                output_writer.write(fp)
+                profile_count("bytes_written", fp.tell())
+                if _progress is not None:
+                    _progress.written(output_path, fp.tell())
+            print(f"[+] 完成: {source_name} -> {display_path(output_path)}")
+            return True
+
+        if _progress is not None:
+            _progress.stage("merge")
+        merged_writer = open_merged_writer(streaming, output, compact)
+        current_page_in_merged_pdf = 0
+        for idx, (name, data) in enumerate(documents):
+            if isinstance(data, Path):
+                processed = process_file_data(data, shared=not streaming)
+            else:
+                processed = process_pdf_data(data, name)
+            page_increment = append_processed_pdf(merged_writer, processed, current_page_in_merged_pdf, idx,
+                                                  len(documents))
+            if not page_increment:
+                raise RuntimeError(f"合并 {name} 失败")
+            current_page_in_merged_pdf += page_increment
+        return write_merged_pdf(merged_writer, current_page_in_merged_pdf, len(documents), len(documents), output,
+                                compact)
+    except Exception as e:
+        report_error(f"[!] 错误处理 {source_name}: {e}")
+        traceback.print_exc()
+        return False
+
+
+# --- 常驻监视 (--watch) --- 
+def snapshot_pdfs(directory: Path) -> dict:
+    """返回目录中各 PDF 文件的 {路径: (大小, 修改时间)}。"""
+    snapshot = {}
+    for path in directory.glob('*.pdf'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError: # 列出目录后被删除
+            continue
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def watch_changes(directory: Path, interval: float = WATCH_INTERVAL, debounce: float = WATCH_DEBOUNCE):
+    """每隔 interval 秒轮询目录，产出 (新增或修改的文件, 删除的文件)。
+
+    第一次立即产出目录中已有的全部文件。检测到变化后等待目录连续 debounce 秒不再变化再产出，
+    因此正在复制的文件 (大小或修改时间仍在变化) 不会被读取，一批文件也只产出一次。
+
+    Yields:
+        Tuple[List[Path], List[Path]]: (新增或修改的文件, 删除的文件)，均按 get_sort_key 排序。
+    """
+    previous: dict = {}
+    current = snapshot_pdfs(directory)
+    while True:
+        if current != previous:
+            changed = sorted((path for path, state in current.items() if previous.get(path) != state), key=get_sort_key)
+            deleted = sorted((path for path in previous if path not in current), key=get_sort_key)
+            previous = current
+            yield changed, deleted
+        time.sleep(interval)
+        current = snapshot_pdfs(directory)
+        while current != previous:
+            time.sleep(debounce)
+            latest = snapshot_pdfs(directory)
+            if latest == current:
+                break
+            current = latest
+
+
+def watch_input_dir(options: RunOptions):
+    """--watch: 常驻运行，INPUT_DIR 中的 PDF 新增、修改或删除后只处理受影响的文件，再重新合并。
+
+    新增或修改的文件重新执行 process_pdf，删除的文件从 output/ 和 backup/ 中移除，其余文件在
+    output/ 中的结果保持不变。重新合并时页码覆盖层缓存 (OVERLAY_CACHE) 常驻内存，未变化文件的
+    reader 也直接复用 (见 ResidentReaders)。options.append 为 True (--append) 时只在末尾新增了文件的变化
+    以增量更新的方式追加到合并结果。单次处理失败只报告错误，继续监视。按 Ctrl+C 退出。
+    """
+    global _progress
+    interval = options.watch_interval
+    INPUT_DIR.mkdir(exist_ok=True)
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    BACKUP_DIR.mkdir(exist_ok=True)
+    readers = ResidentReaders()
+    print(f"[*] 监视 {INPUT_DIR.relative_to(PROJECT_DIR)}/ (每 {interval:g} 秒检查一次), 按 Ctrl+C 退出.")
+
+    try:
+        for changed, deleted in watch_changes(INPUT_DIR, interval):
+            print(f"\n[*] {time.strftime('%H:%M:%S')} 检测到变化: 新增/修改 {len(changed)} 个, 删除 {len(deleted)} 个文件.")
+            if _progress is not None: # 每次重新处理输出一组 start ... done 事件
+                _progress = ProgressReporter(_progress.stream, "pdfinsert")
+            try:
+                for pdf_file in deleted:
+                    (OUTPUT_DIR / pdf_file.name).unlink(missing_ok=True)
+                    (BACKUP_DIR / pdf_file.name).unlink(missing_ok=True)
+                    print(f"    -> 已移除 {pdf_file.name} 的处理结果.")
+                if _progress is not None:
+                    _progress.begin(changed)
+                    _progress.stage("process")
+
+                failed_files = [pdf_file.name for pdf_file, processed in iter_processed(changed, OUTPUT_DIR, options)
+                                if not processed.ok]
+                print(f"\n[*] 处理结果: {len(changed) - len(failed_files)} 成功, {len(failed_files)} 失败.")
+                report_caches(options.result_cache)
+                if failed_files:
+                    print(f"[!] 失败文件列表: {failed_files}")
+
+                pdf_files = list(INPUT_DIR.glob('*.pdf'))
+                if pdf_files:
+                    streaming = choose_streaming(pdf_files, options.streaming, options.max_memory)
+                    merge_pdfs_with_bookmarks(OUTPUT_DIR, MERGED_FILENAME, streaming, options.compact, readers,
+                                              options.append, prefetch=options.prefetch)
+                else:
+                    MERGED_FILE_PATH.unlink(missing_ok=True)
+                    MERGE_INDEX_PATH.unlink(missing_ok=True)
+                    print(f"[*] pdfs/ 中已没有 PDF 文件, 已删除 {MERGED_FILENAME}.")
+            except Exception as e:
+                report_error(f"[!] 错误: 处理变化失败: {e}")
+                traceback.print_exc()
+            if _progress is not None:
+                _progress.finish()
+    except KeyboardInterrupt:
+        print("\n[*] 已停止监视.")
+
+
+# --- 常驻服务 (--serve) --- 
+_in_service = False # 当前进程是否为 --serve 的工作进程
+
+
+def default_socket_path() -> str:
+    """--serve --socket 和 pdfinsert_client.py 默认使用的 socket 路径 (可由 PDFINSERT_SOCKET 环境变量覆盖)。"""
+    return os.environ.get(SERVICE_SOCKET_ENV) or os.path.join(tempfile.gettempdir(), f"pdfinsert-{os.getuid()}.sock")
+
+
+def _init_service_worker():
+    """(--serve 工作进程) 进程池的 initializer。
+
+    导入的 PyPDF2/reportlab 和页码覆盖层缓存 (OVERLAY_CACHE) 在请求之间常驻。标准输出在文件描述符
+    层面改为指向标准错误：stdin 模式下服务进程的标准输出是 JSON-RPC 通道，工作进程及其子进程中
+    不经过 sys.stdout 的输出不能混入其中。
+    """
+    global _in_service
+    os.dup2(2, 1)
+    _in_service = True
+
+
+def _service_run(params: dict) -> dict:
+    """run: 以 params["argv"] 为命令行参数执行与 pdfinsert.py 相同的处理 (客户端 pdfinsert_client.py 使用)。"""
+    argv = params.get("argv", [])
+    if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+        raise ValueError("argv 必须是字符串列表")
+    try:
+        main(argv)
+    except SystemExit as e: # argparse 的参数错误、--help 和 --clean 后的退出
+        return {"exit_code": e.code if isinstance(e.code, int) else int(e.code is not None)}
+    return {"exit_code": 0}
+
+
+def _service_process_pdf(params: dict) -> dict:
+    """process_pdf: 处理 params["input"]，结果写入 output_dir (默认 output/)，原文件备份到 backup_dir (默认 backup/)。"""
+    require_params(params, "input")
+    result_cache = None if params.get("no_cache") else open_result_cache()
+    output_dir = Path(params.get("output_dir", OUTPUT_DIR)).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    processed = process_pdf(Path(params["input"]).resolve(), output_dir,
+                            Path(params.get("backup_dir", BACKUP_DIR)).resolve(), params.get("jobs", 1),
+                            result_cache=result_cache)
+    if not processed.ok:
+        raise RuntimeError(f"处理 {params['input']} 失败")
+    return {"output": str(processed.output_file)}
+
+
+def _service_merge_pdfs(params: dict) -> dict:
+    """merge_pdfs: 合并 output/ 中的处理结果 (带层级书签)，写出到项目目录下的 params["filename"]。"""
+    filename = params.get("filename", MERGED_FILENAME)
+    (PROJECT_DIR / filename).unlink(missing_ok=True)
+    merge_pdfs_with_bookmarks(OUTPUT_DIR, filename, params.get("stream", False), params.get("compact", False))
+    if not (PROJECT_DIR / filename).exists():
+        raise RuntimeError("没有页面被成功合并")
+    return {"output": str(PROJECT_DIR / filename)}
+
+
+# --serve 交给工作进程执行的方法 (见 pdf_common.service.WorkerService)，参数均可另加 cwd;
+# 读写项目目录的请求 (见 _uses_project_dir) 依次执行:
+#     run          argv: 与命令行运行 pdfinsert.py 相同 (包括默认模式的处理与合并)，返回 exit_code
+#     process_pdf  input, output_dir, backup_dir, jobs, no_cache: 处理单个文件，返回 output
+#     merge_pdfs   filename, stream, compact: 合并 output/ 中的处理结果，返回 output
+SERVICE_METHODS = {"run": _service_run, "process_pdf": _service_process_pdf, "merge_pdfs": _service_merge_pdfs}
+
+
+def _uses_project_dir(method: str, params: dict) -> bool:
+    """请求是否读写项目目录 (pdfs/、output/、backup/ 和合并结果)；这类请求必须依次执行。"""
+    return method != "process_pdf" or "output_dir" not in params or "backup_dir" not in params
+
+
+def _service_call(method: str, params: dict) -> Tuple[Optional[dict], Optional[str], str, str]:
+    """(--serve 工作进程) 在 params["cwd"] 下执行一个请求。返回 (结果, 错误信息, 标准输出, 标准错误)。
+
+    请求期间的输出全部被收集并返回给客户端；请求结束后执行 register_cleanup 注册的清理函数，
+    并清除 --profile/--progress 的状态，不影响同一工作进程处理的下一个请求。页码覆盖层缓存保留，
+    只有命中/未命中计数每次重新开始。
+    """
+    global _request_cleanups, _profiler, _progress
+    stdout, stderr = StringIO(), StringIO()
+    result, error = None, None
+    _request_cleanups = []
+    OVERLAY_CACHE.reset_stats()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(params["cwd"])
+            result = SERVICE_METHODS[method](params)
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            for func, args in reversed(_request_cleanups):
+                try:
+                    func(*args)
+                except Exception:
+                    traceback.print_exc()
+            _request_cleanups = None
+            _profiler = None
+            _progress = None
+    return result, error, stdout.getvalue(), stderr.getvalue()
+
+
+def serve(socket_path: Optional[str] = None, workers: int = 0):
+    """--serve: 启动 WorkerService，socket_path 为 None 时通过标准输入/输出通信。服务自身的日志写到标准错误。"""
+    workers = workers or os.cpu_count() or 1
+    service = WorkerService(workers, _service_call, _init_service_worker, SERVICE_METHODS, serial=_uses_project_dir)
+    where = socket_path or "标准输入/输出"
+    print(f"[*] pdfinsert 服务已启动: {where}, {workers} 个工作进程 (进程号 {os.getpid()})", file=sys.stderr)
+    try:
+        if socket_path is None:
+            service.serve_stdio()
+        else:
+            service.serve_socket(socket_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        print(f"[*] 服务已停止, 共处理 {service.requests} 个请求", file=sys.stderr)
 
-def main():
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(description="为PDF添加边距、空白页、页码和层级书签，然后合并。默认清理生成文件。")
     parser.add_argument(
         "--clean", 
@@ -483,18 +1842,221 @@ def main():
         "inputs", 
         nargs="*", 
         help="可选参数，指定要处理的 PDF 文件或目录路径。若省略，则处理 'pdfs/' 目录。"
+             "'-' 表示从标准输入读取一个 PDF (标准输入/输出模式，见 -o)。"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        metavar="PATH",
+        default=None,
+        help="标准输入/输出模式: 只处理一个输入 (文件、目录或 '-')，结果写到 PATH ('-' 表示标准输出，此时文字日志输出到"
+             "标准错误)，不备份、不使用缓存，也不读写 pdfs/、output/、backup/。输入为目录时合并其中的 PDF (同 --frames)。"
+             "输入为 '-' 或使用 --frames 时默认为 '-'。"
+    )
+    parser.add_argument(
+        "--frames",
+        action="store_true",
+        help="标准输入/输出模式: 输入是分帧流 (每帧为 4 字节文件名长度、UTF-8 文件名、8 字节数据长度和 PDF 数据，"
+             "长度均为大端)，各 PDF 处理后按顺序合并为一个带层级书签的 PDF。可配合 --stream、--compact。"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="并行处理的进程数 (默认 1 即串行, 0 表示使用全部 CPU 核心)。默认模式下完成的文件按顺序流式合并。"
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=SHARD_SIZE,
+        help=f"大文件按页范围分片并行处理时每个分片的原始页数 (默认 {SHARD_SIZE})。"
+    )
+    parser.add_argument(
+        "--shard-threshold",
+        type=int,
+        default=SHARD_THRESHOLD,
+        help=f"原始页数超过此值的文件在 --jobs > 1 时自动分片 (默认 {SHARD_THRESHOLD})。"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=PREFETCH_DEPTH,
+        metavar="N",
+        help=f"串行处理 (-j 1) 和合并时在后台线程中预读并解析接下来的 N 个文件，处理结果等输出交给后台线程延后写出 "
+             f"(默认 {PREFETCH_DEPTH} 即关闭；输入、输出位于网络盘或慢速磁盘时可设为 2)。结束时报告等待预读和写出队列的时间。"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="使用流式合并写入器: 每个文件追加后立即写出，峰值内存取决于最大的单个文件而不是全部文件。"
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        default=None,
+        help="合并的内存上限 (如 512M、2G)。预计峰值超出时自动使用流式合并。"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不使用处理结果缓存 (.cache/)，重新处理所有文件。"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=parse_size,
+        default=CACHE_MAX_BYTES,
+        help="处理结果缓存的总大小上限 (如 500M、4G，默认 2G)，超出时淘汰最久未使用的条目。"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="以紧凑格式写出合并结果: 压缩内容流，小对象打包进对象流，使用交叉引用流 (PDF 1.5+)。"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="TRACE.json",
+        default=None,
+        help="记录各阶段和各文件的耗时及计数，写出 Chrome trace-event 格式的 JSON (可用 Perfetto 打开)。"
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE.prof",
+        default=None,
+        help="配合 --profile，同时把 cProfile 统计写入此文件 (子进程写入 FILE.prof.<进程号>)。"
+    )
+    parser.add_argument(
+        "--progress",
+        choices=("text", "jsonl"),
+        default="text",
+        help="进度输出格式: text (默认, 文字日志) 或 jsonl (每行一个 JSON 事件, 不再输出文字日志)。"
+    )
+    parser.add_argument(
+        "--progress-fd",
+        type=int,
+        default=1,
+        metavar="FD",
+        help="--progress jsonl 的事件写入的文件描述符 (默认 1 即标准输出)。"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="常驻运行 (仅默认模式): 监视 pdfs/，PDF 新增、修改或删除后只处理受影响的文件并重新合并。"
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        metavar="SECONDS",
+        help=f"--watch 检查 pdfs/ 的间隔秒数 (默认 {WATCH_INTERVAL:g})。"
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help=f"仅默认模式: 不清理上次的结果，只处理新增或修改过的文件；只在末尾新增了文件时以 PDF 增量更新的方式"
+             f"追加到 {MERGED_FILENAME} (依赖 {MERGED_FILENAME}{MERGE_INDEX_SUFFIX} 索引，否则完整重写并建立索引)。"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="配合 --append: 忽略索引完整重写合并结果，清除历次追加留下的旧版本对象。"
+    )
+    parser.add_argument(
+        "--merged-only",
+        action="store_true",
+        help=f"仅默认模式: 只生成 {MERGED_FILENAME}，各文件的处理结果直接在内存中合并，不写出到 output/。"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="作为常驻服务运行: 通过标准输入/输出 (或 --socket) 接收 JSON-RPC 请求，工作进程常驻内存，"
+             "客户端见 pdfinsert_client.py。"
+    )
+    parser.add_argument(
+        "--socket",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="PATH",
+        help=f"配合 --serve: 在 Unix socket 上监听 (省略 PATH 时为 ${SERVICE_SOCKET_ENV} 或临时目录下的默认路径)。"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="配合 --serve: 工作进程数，即可同时处理的请求数 (默认 0 表示 CPU 核心数)。"
     )
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.serve:
+        if _in_service:
+            parser.error("--serve 不能通过服务运行")
+        socket_path = None
+        if args.socket is not None:
+            socket_path = args.socket or default_socket_path()
+        serve(socket_path, args.workers)
+        return
+    if args.socket is not None:
+        parser.error("--socket 需要同时指定 --serve")
+    if args.watch and _in_service:
+        parser.error("--watch 不能通过服务运行，请直接运行 pdfinsert.py")
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile 需要同时指定 --profile")
+    if args.watch and args.inputs:
+        parser.error("--watch 只能用于默认模式 (监视 pdfs/)，不能同时指定输入文件或目录")
+    if args.append and (args.inputs or args.clean):
+        parser.error("--append 只能用于默认模式，且不能与 --clean 同时使用")
+    if args.rebuild and (not args.append or args.watch):
+        parser.error("--rebuild 需要同时指定 --append，且不能用于 --watch")
+    if args.merged_only and (args.inputs or args.append or args.watch):
+        parser.error("--merged-only 只能用于默认模式，且不能与 --append、--watch 同时使用 (它们依赖 output/ 中的处理结果)")
+    if args.prefetch < 0:
+        parser.error("--prefetch 不能为负数")
+    stdio = args.frames or args.output is not None or STDIO_PATH in args.inputs
+    if stdio:
+        if len(args.inputs) != 1:
+            parser.error("标准输入/输出模式需要且只能指定一个输入 ('-' 表示标准输入)")
+        if args.clean or args.watch or args.append or args.merged_only:
+            parser.error("标准输入/输出模式不能与 --clean、--watch、--append、--merged-only 同时使用")
+        if args.output is None:
+            args.output = STDIO_PATH
+        if _in_service and STDIO_PATH in (args.inputs[0], args.output):
+            parser.error("标准输入/输出 (-) 不能通过服务运行，请直接运行 pdfinsert.py")
+        if args.output == STDIO_PATH and args.progress == "jsonl" and args.progress_fd == 1:
+            parser.error("-o - 时标准输出用于写出 PDF，--progress jsonl 需要用 --progress-fd 指定其他文件描述符")
+        if args.output == STDIO_PATH:
+            enable_stdout_output()
+    if args.profile:
+        enable_profiling(Path(args.profile).resolve(), args.cprofile)
+    if args.progress == "jsonl":
+        enable_progress(args.progress_fd)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
 
-    # 默认操作: 清理生成文件
-    cleanup_generated_files()
+    if stdio:
+        # 标准输入/输出模式: 不清理、不使用缓存，也不读写项目目录
+        ok = process_stream(args.inputs[0], args.output, args.frames, args.stream, args.compact)
+        if _progress is not None:
+            _progress.finish()
+        if not ok:
+            sys.exit(1)
+        return
+
+    result_cache = None if args.no_cache else open_result_cache(args.cache_size)
+    options = RunOptions(jobs=jobs, shard_size=args.shard_size, shard_threshold=args.shard_threshold,
+                         streaming=args.stream, max_memory=args.max_memory, result_cache=result_cache,
+                         compact=args.compact, merged_only=args.merged_only, append=args.append,
+                         rebuild=args.rebuild, prefetch=args.prefetch, watch_interval=args.watch_interval)
+
+    # 默认操作: 清理生成文件 (--append 保留上次的结果，只处理新增或修改过的文件)
+    if args.watch or not args.append:
+        cleanup_generated_files()
 
     # --clean 选项处理
     if args.clean:
         cleanup_input_files()
-        if not args.inputs:
+        cleanup_result_cache()
+        if not args.inputs and not args.watch:
             print("[*] --clean 已执行，无输入参数，退出.")
+            if _progress is not None:
+                _progress.finish()
             sys.exit(0)
 
     # 处理模式判断
@@ -514,30 +2076,50 @@ def main():
                  print(f"[!] 警告: 参数 '{p_str}' 不是有效的 PDF 文件或目录, 跳过.")
 
         if not pdf_files_to_process:
-             print("[!] 命令行未指定有效的 PDF 文件或目录.")
+             report_error("[!] 命令行未指定有效的 PDF 文件或目录.")
+             if _progress is not None:
+                 _progress.finish()
              return
              
         print(f"[*] 从命令行处理 {len(pdf_files_to_process)} 个文件.")
         processed_count_cli = 0
         failed_files_cli: List[str] = []
+        existing_pdf_files: List[Path] = []
         for pdf_file in pdf_files_to_process:
             if pdf_file.exists(): 
-                 output_file_res = process_pdf(pdf_file, OUTPUT_DIR, BACKUP_DIR)
-                 if output_file_res: 
-                      processed_count_cli += 1
-                 else:
-                      failed_files_cli.append(pdf_file.name)
+                 existing_pdf_files.append(pdf_file)
             else:
                  print(f"    [*] 信息: 文件 {pdf_file.name} 未找到 (可能已被 --clean 删除或不存在). 跳过.")
+        if _progress is not None:
+            _progress.begin(existing_pdf_files)
+            _progress.stage("process")
+
+        for pdf_file, processed in iter_processed(existing_pdf_files, OUTPUT_DIR, options):
+            if processed.ok:
+                 processed_count_cli += 1
+            else:
+                 failed_files_cli.append(pdf_file.name)
         
         print(f"[*] 命令行模式结束. 处理了 {processed_count_cli} 个文件, {len(failed_files_cli)} 个失败.")
+        report_caches(result_cache)
         if failed_files_cli:
              print(f"[!] 失败文件列表: {failed_files_cli}")
 
     else:
         # 默认模式 (处理 'pdfs/' 并合并)
         print("[*] 默认模式运行 (处理 'pdfs/' 并合并).")
-        process_all_pdfs()
+        if args.watch:
+            watch_input_dir(options)
+            return
+        if args.append:
+            append_input_dir(options)
+            if _progress is not None:
+                _progress.finish()
+            return
+        process_all_pdfs(options)
+
+    if _progress is not None:
+        _progress.finish()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,26 @@
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_DIR))
+
+
+def text_pdf(pages, prefix="page"):
+    """生成每页带一行文字 (未压缩的内容流) 的 PDF，返回其字节。"""
+    from reportlab.pdfgen import canvas
+    packet = BytesIO()
+    c = canvas.Canvas(packet, pageCompression=0)
+    for index in range(pages):
+        c.drawString(72, 720, f"{prefix} {index + 1}")
+        c.showPage()
+    c.save()
+    return packet.getvalue()
+
+
+@pytest.fixture
+def make_pdf():
+    return text_pdf
@@ -0,0 +1,144 @@
+"""--append (增量追加) 与合并结果旁路索引 (.index.json) 的测试。"""
+
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+from io import BytesIO
+
+import pytest
+
+from conftest import REPO_DIR
+from pdf_common.merge_index import MergeIndex, read_startxref
+from pdf_common.writer import StreamingPdfWriter
+
+LIBRARIES = ("pypdf", "PyPDF2")
+
+
+def run_script(script, args, cwd):
+    env = dict(os.environ, PYTHONPATH=str(REPO_DIR))
+    result = subprocess.run([sys.executable, str(script)] + args, cwd=cwd, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert result.returncode == 0, result.stdout
+    return result.stdout
+
+
+def outline_summary(reader, outline=None):
+    """[(标题, 页号, 子书签)]，用于比较两个合并结果的书签。"""
+    items = []
+    for item in reader.outline if outline is None else outline:
+        if isinstance(item, list):
+            items[-1] = items[-1][:2] + (outline_summary(reader, item),)
+        else:
+            items.append((item.title, reader.get_destination_page_number(item), []))
+    return items
+
+
+def pdf_summary(path, library="pypdf"):
+    """(各页文字, 书签)。pdfinsert 的输出用它自己的 PyPDF2 读取：PyPDF2 写出的变换矩阵数字很长，
+    pypdf 的内容流解析会拒绝。"""
+    reader = importlib.import_module(library).PdfReader(path, strict=True)
+    return [page.extract_text() for page in reader.pages], outline_summary(reader)
+
+
+def write_inputs(directory, make_pdf, names_pages):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, pages in names_pages:
+        (directory / name).write_bytes(make_pdf(pages, name))
+
+
+def check_index(pdf_path, count):
+    """索引能读回，且与合并结果本身一致。"""
+    from pypdf import PdfReader
+    index = MergeIndex.load(pdf_path)
+    assert index is not None
+    assert len(index.files) == count
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        assert index.page_ids == [page.indirect_reference.idnum for page in reader.pages]
+        assert sum(entry["pages"] for entry in index.files) == len(reader.pages)
+        assert index.startxref == read_startxref(f)
+        top = [item for item in reader.outline if not isinstance(item, list)]
+        assert index.outline_ids == [item.indirect_reference.idnum for item in top]
+
+
+FIRST = [("01_a.pdf", 3), ("02_b.pdf", 2)]
+SECOND = [("03_c.pdf", 4), ("04_d.pdf", 1)]
+
+
+@pytest.mark.parametrize("extra", ([], ["--compact"]))
+def test_pdf_fill_append_matches_rebuild(tmp_path, make_pdf, extra):
+    script = REPO_DIR / "pdf_fill" / "pdf_fill.py"
+    inputs, appended, rebuilt = tmp_path / "in", tmp_path / "appended.pdf", tmp_path / "rebuilt.pdf"
+    args = [str(inputs), "--no-cache"] + extra
+    write_inputs(inputs, make_pdf, FIRST)
+    run_script(script, args + ["-o", str(appended), "--append"], script.parent)
+    check_index(appended, len(FIRST))
+
+    write_inputs(inputs, make_pdf, SECOND)
+    before = appended.read_bytes()
+    output = run_script(script, args + ["-o", str(appended), "--append"], script.parent)
+    assert "追加 2 个文件" in output
+    assert appended.read_bytes().startswith(before)
+    check_index(appended, len(FIRST) + len(SECOND))
+
+    run_script(script, args + ["-o", str(rebuilt)], script.parent)
+    assert pdf_summary(appended) == pdf_summary(rebuilt)
+    assert len(pdf_summary(appended)[0]) == 10
+
+
+@pytest.mark.parametrize("extra", ([], ["--compact"]))
+def test_pdfinsert_append_matches_rebuild(tmp_path, make_pdf, extra):
+    appended_dir, rebuilt_dir = tmp_path / "appended", tmp_path / "rebuilt"
+    for project_dir in (appended_dir, rebuilt_dir):
+        project_dir.mkdir()
+        shutil.copy(REPO_DIR / "pdf_insert" / "pdfinsert.py", project_dir)
+    appended = appended_dir / "merged_output.pdf"
+    write_inputs(appended_dir / "pdfs", make_pdf, FIRST)
+    run_script("pdfinsert.py", ["--no-cache", "--append"] + extra, appended_dir)
+    check_index(appended, len(FIRST))
+
+    write_inputs(appended_dir / "pdfs", make_pdf, SECOND)
+    before = appended.read_bytes()
+    output = run_script("pdfinsert.py", ["--no-cache", "--append"] + extra, appended_dir)
+    assert "追加完成" in output
+    assert appended.read_bytes().startswith(before)
+    check_index(appended, len(FIRST) + len(SECOND))
+
+    write_inputs(rebuilt_dir / "pdfs", make_pdf, FIRST + SECOND)
+    run_script("pdfinsert.py", ["--no-cache"] + extra, rebuilt_dir)
+    assert pdf_summary(appended, "PyPDF2") == pdf_summary(rebuilt_dir / "merged_output.pdf", "PyPDF2")
+    assert len(pdf_summary(appended, "PyPDF2")[0]) == 20 # 每页后插入一张空白页
+
+
+@pytest.mark.parametrize("compact", (False, True))
+@pytest.mark.parametrize("library", LIBRARIES)
+def test_index_round_trip(tmp_path, make_pdf, library, compact):
+    pdf = importlib.import_module(library)
+    sources = [tmp_path / "a.pdf", tmp_path / "empty.pdf", tmp_path / "b.pdf"]
+    sources[0].write_bytes(make_pdf(2, "a"))
+    sources[1].write_bytes(b"")
+    sources[2].write_bytes(make_pdf(3, "b"))
+    merged = tmp_path / "merged.pdf"
+    with open(merged, "wb") as f:
+        writer = StreamingPdfWriter(f, importlib.import_module(f"{library}.generic"), compact)
+        for source in (sources[0], sources[2]):
+            start = len(writer)
+            writer.add_pages(pdf.PdfReader(BytesIO(source.read_bytes())).pages)
+            writer.add_outline_item(source.stem, start)
+        writer.close()
+
+    index = MergeIndex.build(merged, sources, [2, 0, 3], pdf.PdfReader)
+    assert index.compact == compact
+    assert [entry["outline"] is None for entry in index.files] == [False, True, False]
+    index.save()
+    loaded = MergeIndex.load(merged)
+    assert vars(loaded) == vars(index)
+    assert loaded.matches_prefix(sources) and loaded.matches_prefix(sources + [tmp_path / "c.pdf"])
+    assert not loaded.matches_prefix(sources[::-1])
+
+    # 合并结果被改动后索引失效
+    with open(merged, "ab") as f:
+        f.write(b"\n")
+    assert MergeIndex.load(merged) is None
@@ -0,0 +1,54 @@
+"""紧凑格式 (--compact) 写出的往返测试: 用两个库分别写出，再以 strict=True 读回检查。"""
+
+import importlib
+from io import BytesIO
+
+import pytest
+
+from pdf_common.writer import OBJECT_STREAM_SIZE, write_compact_pdf
+
+LIBRARIES = ("pypdf", "PyPDF2")
+PAGE_COUNT = OBJECT_STREAM_SIZE + 20 # 页面对象多于一个对象流的容量
+
+
+def build_writer(pdf, make_pdf):
+    """返回带 PAGE_COUNT 页和两层书签的 PdfWriter，以及每个书签 (标题, 层级) 对应的页索引。"""
+    writer = pdf.PdfWriter()
+    reader = pdf.PdfReader(BytesIO(make_pdf(PAGE_COUNT)))
+    for page in reader.pages:
+        writer.add_page(page)
+    expected = {}
+    for index in range(0, PAGE_COUNT, 10):
+        parent = writer.add_outline_item(f"part {index}", index)
+        expected[(f"part {index}", 0)] = index
+        writer.add_outline_item(f"section {index + 5}", index + 5, parent=parent)
+        expected[(f"section {index + 5}", 1)] = index + 5
+    return writer, expected
+
+
+def flatten_outline(reader, items, depth=0):
+    result = {}
+    for item in items:
+        if isinstance(item, list):
+            result.update(flatten_outline(reader, item, depth + 1))
+        else:
+            result[(item.title, depth)] = reader.get_destination_page_number(item)
+    return result
+
+
+@pytest.mark.parametrize("library", LIBRARIES)
+def test_compact_round_trip(library, make_pdf):
+    pdf = importlib.import_module(library)
+    writer, expected = build_writer(pdf, make_pdf)
+    output = BytesIO()
+    write_compact_pdf(writer, output)
+
+    data = output.getvalue()
+    assert b"/ObjStm" in data and b"/XRef" in data
+    assert b"\nxref\n" not in data and b"trailer" not in data
+
+    reader = pdf.PdfReader(BytesIO(data), strict=True)
+    assert len(reader.pages) == PAGE_COUNT
+    assert "page 7" in reader.pages[6].extract_text()
+    assert reader.pages[0]["/Contents"].get_object()["/Filter"] == "/FlateDecode"
+    assert flatten_outline(reader, reader.outline) == expected
@@ -0,0 +1,40 @@
+"""处理结果缓存的键、写入和淘汰。"""
+
+import os
+
+from pdf_common.cache import ResultCache
+
+
+def test_key_depends_on_content_and_params(tmp_path):
+    source = tmp_path / "a.pdf"
+    source.write_bytes(b"%PDF-1.4 a")
+    cache = ResultCache(tmp_path / "cache", params=(1, "fill"))
+    key = cache.key(source, "resized", 0, 5)
+    assert cache.key(source, "resized", 0, 5) == key
+    assert cache.key(source, "resized", 5, 10) != key
+    assert ResultCache(tmp_path / "cache", params=(2, "fill")).key(source, "resized", 0, 5) != key
+
+    prefetched = ResultCache(tmp_path / "cache", params=(1, "fill"))
+    prefetched.remember(source, source.read_bytes())
+    assert prefetched.key(source, "resized", 0, 5) == key
+
+
+def test_put_get_and_evict(tmp_path):
+    class Writer:
+        def write(self, fp):
+            fp.write(b"w" * 100)
+
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"s" * 100)
+    cache = ResultCache(tmp_path / "cache", max_bytes=250)
+    assert cache.get("a") is None
+    for index, (key, result) in enumerate((("a", b"b" * 100), ("b", source), ("c", Writer()))):
+        cache.put(key, result)
+        os.utime(tmp_path / "cache" / f"{key}.pdf", (index, index)) # 固定使用顺序: a 最旧
+    assert cache.get("b").read_bytes() == b"s" * 100
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    assert cache.evict() == (1, 100)
+    assert cache.get("a") is None
+    assert cache.get("c").read_bytes() == b"w" * 100
+    assert not list((tmp_path / "cache").glob("*.tmp"))
@@ -0,0 +1,38 @@
+"""大文件按页范围分片处理 (--shard-threshold / --shard-size) 的测试：分片与不分片的合并结果一致。"""
+
+import shutil
+
+import pytest
+
+from conftest import REPO_DIR
+from test_append import pdf_summary, run_script, write_inputs
+
+# 23 页的文件按 7 页一片分成 4 片，页码须跨分片边界连续；4 页的文件不分片
+INPUTS = [("01_big.pdf", 23), ("02_small.pdf", 4), ("03_big.pdf", 12)]
+SHARDED = ["--jobs", "2", "--shard-threshold", "10", "--shard-size", "7"]
+
+
+@pytest.mark.parametrize("extra", ([], ["--stream"]))
+def test_pdf_fill_sharded_matches_unsharded(tmp_path, make_pdf, extra):
+    script = REPO_DIR / "pdf_fill" / "pdf_fill.py"
+    inputs, sharded, unsharded = tmp_path / "in", tmp_path / "sharded.pdf", tmp_path / "unsharded.pdf"
+    write_inputs(inputs, make_pdf, INPUTS)
+    args = [str(inputs), "--no-cache"] + extra
+    run_script(script, args + ["-o", str(unsharded)], script.parent)
+    assert "拆分为 4 个分片" in run_script(script, args + SHARDED + ["-o", str(sharded)], script.parent)
+    assert pdf_summary(sharded) == pdf_summary(unsharded)
+    assert len(pdf_summary(sharded)[0]) == 39
+
+
+@pytest.mark.parametrize("extra", ([], ["--stream"]))
+def test_pdfinsert_sharded_matches_unsharded(tmp_path, make_pdf, extra):
+    sharded_dir, unsharded_dir = tmp_path / "sharded", tmp_path / "unsharded"
+    for project_dir in (sharded_dir, unsharded_dir):
+        project_dir.mkdir()
+        shutil.copy(REPO_DIR / "pdf_insert" / "pdfinsert.py", project_dir)
+        write_inputs(project_dir / "pdfs", make_pdf, INPUTS)
+    run_script("pdfinsert.py", ["--no-cache"] + extra, unsharded_dir)
+    assert "拆分为 4 个分片" in run_script("pdfinsert.py", ["--no-cache"] + extra + SHARDED, sharded_dir)
+    sharded = pdf_summary(sharded_dir / "merged_output.pdf", "PyPDF2")
+    assert sharded == pdf_summary(unsharded_dir / "merged_output.pdf", "PyPDF2")
+    assert len(sharded[0]) == 78 # 每页后插入一张空白页
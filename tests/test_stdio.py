@@ -0,0 +1,33 @@
+"""分帧流的读写。"""
+
+from io import BytesIO
+
+import pytest
+
+from pdf_common.stdio import StdoutOutput, read_frames, write_frame
+
+
+def test_frames_round_trip():
+    stream = BytesIO()
+    frames = [("a.pdf", b"%PDF-1.4 a"), ("", b""), ("中文.pdf", b"%PDF-1.7 " * 100)]
+    for name, data in frames:
+        write_frame(stream, name, data)
+    stream.seek(0)
+    assert list(read_frames(stream)) == [("a.pdf", b"%PDF-1.4 a"), ("stdin-2", b""), frames[2]]
+
+
+@pytest.mark.parametrize("cut", (2, 6, 20))
+def test_truncated_frame(cut):
+    stream = BytesIO()
+    write_frame(stream, "a.pdf", b"%PDF-1.4 a")
+    with pytest.raises(ValueError):
+        list(read_frames(BytesIO(stream.getvalue()[:cut])))
+
+
+def test_stdout_output_counts_bytes():
+    stream = BytesIO()
+    with StdoutOutput(stream) as output:
+        output.write(b"abc")
+        output.write(b"de")
+        assert output.tell() == 5
+    assert not stream.closed and stream.getvalue() == b"abcde"
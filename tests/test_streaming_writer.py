@@ -0,0 +1,41 @@
+"""流式合并 (--stream) 写入器的往返测试。"""
+
+import importlib
+from io import BytesIO
+
+import pytest
+
+from pdf_common.writer import StreamingPdfWriter
+
+LIBRARIES = ("pypdf", "PyPDF2")
+
+
+def stream_merge(pdf, sources, compact):
+    """用 StreamingPdfWriter 依次合并 sources ((名称, PDF 字节) 列表)，每个文件一个顶层书签。"""
+    output = BytesIO()
+    writer = StreamingPdfWriter(output, importlib.import_module(f"{pdf.__name__}.generic"), compact)
+    for name, data in sources:
+        start = len(writer)
+        writer.add_pages(pdf.PdfReader(BytesIO(data)).pages)
+        parent = writer.add_outline_item(name, start)
+        writer.add_outline_item(f"{name} end", len(writer) - 1, parent=parent)
+    writer.close()
+    return writer, output.getvalue()
+
+
+@pytest.mark.parametrize("compact", (False, True))
+@pytest.mark.parametrize("library", LIBRARIES)
+def test_streaming_round_trip(library, compact, make_pdf):
+    pdf = importlib.import_module(library)
+    sources = [("a", make_pdf(3, "a")), ("b", make_pdf(2, "b")), ("c", make_pdf(4, "c"))]
+    writer, data = stream_merge(pdf, sources, compact)
+
+    reader = pdf.PdfReader(BytesIO(data), strict=True)
+    assert len(reader.pages) == 9
+    assert "b 2" in reader.pages[4].extract_text()
+    top = [item for item in reader.outline if not isinstance(item, list)]
+    assert [(item.title, reader.get_destination_page_number(item)) for item in top] == [("a", 0), ("b", 3), ("c", 5)]
+    children = [item for item in reader.outline if isinstance(item, list)]
+    assert [reader.get_destination_page_number(items[0]) for items in children] == [2, 4, 8]
+    # 三个文件的字体等资源内容相同，只写出一份
+    assert writer.dedup_count > 0